@@ -0,0 +1,134 @@
+from collections import defaultdict
+from statistics import NormalDist
+import math
+import zlib
+
+# Tag flags that fetch each location field
+FIELD_FLAGS = {
+    'country': '-a', 'state': '-b', 'locality': '-c', 'elevation': '-e',
+    'imageDate': '-m', 'timestamp': '-t', 'drivingDirection': '-D',
+    'altitude': '-s', 'azimuth': '-s', 'altitudeClass': '-s', 'azimuthClass': '-s', 'sunEvent': '-s',
+    'cloudCover': '-u', 'cloudCoverClass': '-u', 'precipitation': '-p', 'snowDepth': '-w'
+}
+MIN_STRATUM = 2  # Smallest sample per stratum that still gives an interval
+
+
+def parse_size(value):
+    """
+    Parses an --approx value: a fraction of each stratum (0 < f <= 1) or a total number of locations.
+
+    Returns:
+        float | int: The fraction, or the number of locations.
+    """
+    try:
+        size = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid approx value {value}")
+    if size <= 0 or (size > 1 and not size.is_integer()):
+        raise ValueError(f"Invalid approx value {value}")
+    return size if size <= 1 else int(size)
+
+
+def flags(fields):
+    """
+    Tag flags fetching the given fields (fields no stage fetches are skipped).
+    """
+    return sorted({FIELD_FLAGS[field] for field in fields if field in FIELD_FLAGS})
+
+
+def rank(loc):
+    """
+    Sampling order of a location, by a hash of its coordinates. The order is the same on every run,
+    so a larger sample contains every smaller one and already fetched locations are drawn again.
+    """
+    return zlib.crc32(f"{loc['lat']},{loc['lng']}".encode())
+
+
+def stratify(locs, key):
+    """
+    Groups locations by their key value, skipping locations without one.
+    """
+    strata = defaultdict(list)
+    for loc in locs:
+        if loc.get(key):
+            strata[loc[key]].append(loc)
+    return strata
+
+
+def allocate(sizes, size):
+    """
+    Sample size of each stratum.
+
+    A fraction samples that share of every stratum; a number of locations is split in proportion
+    to stratum sizes (largest remainders). Every stratum gets at least MIN_STRATUM locations.
+
+    Args:
+        sizes (dict): Locations per stratum.
+        size (float | int): Fraction, or total number of locations.
+
+    Returns:
+        dict: Sample size per stratum.
+    """
+    if isinstance(size, float):
+        counts = {key: math.ceil(n * size) for key, n in sizes.items()}
+    else:
+        total = min(size, sum(sizes.values()))
+        shares = {key: n * total / sum(sizes.values()) for key, n in sizes.items()}
+        counts = {key: math.floor(share) for key, share in shares.items()}
+        for key in sorted(shares, key=lambda key: counts[key] - shares[key])[:total - sum(counts.values())]:
+            counts[key] += 1
+    return {key: min(sizes[key], max(count, MIN_STRATUM)) for key, count in counts.items()}
+
+
+def draw(strata, size, complete=None):
+    """
+    Draws a stratified sample. A stratum whose locations are all complete already is taken whole.
+
+    Args:
+        strata (dict): Locations per stratum.
+        size (float | int): Fraction, or total number of locations.
+        complete (callable): Whether a location already holds the sampled fields.
+
+    Returns:
+        dict: Sampled locations per stratum.
+    """
+    counts = allocate({key: len(locs) for key, locs in strata.items()}, size)
+    sample = {}
+    for key, locs in strata.items():
+        if complete and all(complete(loc) for loc in locs):
+            sample[key] = locs
+        else:
+            sample[key] = sorted(locs, key=rank)[:counts[key]]
+    return sample
+
+
+def wilson(count, n, population, confidence=0.95):
+    """
+    Wilson score interval of a proportion estimated from a sample without replacement.
+
+    The finite population correction shrinks the interval as the sample covers more of the
+    stratum; a full census has no uncertainty left.
+
+    Args:
+        count (int): Sampled locations with the value.
+        n (int): Sampled locations.
+        population (int): Locations in the stratum.
+        confidence (float): Confidence level.
+
+    Returns:
+        tuple: Lower and upper bound of the proportion.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    p = count / n
+    if n >= population:
+        return p, p
+    fpc = (population - n) / (population - 1) if population > 1 else 0
+    if fpc == 0:
+        return p, p
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    effective = n / fpc
+    denominator = 1 + z * z / effective
+    center = (p + z * z / (2 * effective)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / effective + z * z / (4 * effective * effective)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
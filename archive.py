@@ -0,0 +1,111 @@
+from hashlib import sha256
+from pathlib import Path
+from time import time
+import sqlite3
+import zlib
+
+
+class HttpArchive:
+    """
+    Local archive of request/response pairs, for re-running a map offline.
+
+    In record mode, the governor stores the response of every successful request; in replay mode,
+    requests are answered from the archive alone, without rate limits or network, and a request
+    that was never recorded fails. Entries are keyed by a hash of the method, URL and body, and
+    stored zlib compressed in SQLite, with writes committed in batches. The database is opened on
+    first use and again after close(), so the governor can close it after every stage.
+
+    Args:
+        file (str): Path to the SQLite database.
+        mode (str): 'record' or 'replay'.
+        batch (int): Buffered writes per commit.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key BLOB PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            method TEXT NOT NULL,
+            url TEXT NOT NULL,
+            request BLOB,
+            response BLOB NOT NULL,
+            recorded REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_endpoint ON responses (endpoint);
+    """
+    MODES = ('record', 'replay')
+
+    def __init__(self, file, mode, batch=500):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown archive mode {mode}")
+        if mode == 'replay' and not Path(file).exists():
+            raise ValueError(f"Archive {file} not found")
+        self.file = file
+        self.mode = mode
+        self.batch = batch
+
+        self.db = None
+        self.connect()
+        self.pending = {}  # key -> row awaiting commit
+
+    def connect(self):
+        """
+        The open database connection, opening it if needed.
+        """
+        if self.db is None:
+            self.db = sqlite3.connect(self.file, timeout=30, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(self.SCHEMA)
+        return self.db
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    @staticmethod
+    def key(method, url, data=None):
+        """
+        Key of a request: a hash of its method, URL and body.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        return sha256(b'\0'.join([method.upper().encode(), url.encode(), data or b''])).digest()[:16]
+
+    def get(self, method, url, data=None):
+        """
+        The recorded response body of a request, or None.
+        """
+        key = self.key(method, url, data)
+        if key in self.pending:
+            return zlib.decompress(self.pending[key][5])
+        row = self.connect().execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def put(self, endpoint, method, url, data, response):
+        """
+        Records the response body of a request, replacing an earlier recording.
+        """
+        key = self.key(method, url, data)
+        request = zlib.compress(data.encode() if isinstance(data, str) else data) if data else None
+        self.pending[key] = (key, endpoint, method.upper(), url, request, zlib.compress(response), time())
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        db = self.connect()
+        db.execute("BEGIN")
+        db.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending.values())
+        db.execute("COMMIT")
+        self.pending.clear()
+
+    def close(self):
+        """
+        Commits pending writes and closes the database (checkpointing and removing its WAL files).
+        The next get or put opens it again.
+        """
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,61 @@
+# File size and save/load time of meta maps per format and compression codec
+
+from pathlib import Path
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import compress
+import jsonio
+from sv_map import SVMap
+from benchmarks.bench_json import meta_map, best_of
+
+
+def save(map_obj, file, level):
+    """Writes a map as save() does with compressFile (compact JSON, or NDJSON)."""
+    compress.LEVEL = level
+    if compress.map_suffix(file) == '.ndjson':
+        map_obj.save_ndjson(file, quiet=True)
+    else:
+        with compress.open_file(file, 'wb') as f:
+            f.write(jsonio.dumps(map_obj.data))
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Benchmark compressed map files")
+    args_parser.add_argument("--sizes", type=int, nargs='+', default=[10000, 100000])
+    args_parser.add_argument("--formats", nargs='+', choices=['json', 'ndjson'], default=['json', 'ndjson'])
+    args_parser.add_argument("--gzip-levels", type=int, nargs='*', default=[1, 6, 9])
+    args_parser.add_argument("--zstd-levels", type=int, nargs='*', default=[1, 3, 9, 19])
+    args_parser.add_argument("--repeat", type=int, default=3)
+    args = args_parser.parse_args()
+
+    codecs = [(None, None)] + [('gzip', level) for level in args.gzip_levels]
+    if compress.zstandard:
+        codecs += [('zstd', level) for level in args.zstd_levels]
+    else:
+        print("zstandard is not installed; skipping zstd")
+
+    print(f"{'format':<7} {'size':>8} {'codec':<6} {'level':>5} {'MB':>8} {'ratio':>6} {'save s':>8} {'load s':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            map_obj = SVMap.from_data(meta_map(size))
+            for fmt in args.formats:
+                plain = None
+                for codec, level in codecs:
+                    file = Path(workdir) / f"bench.{fmt}{compress.SUFFIXES.get(codec, '')}"
+                    write = best_of(lambda: save(map_obj, file, level), args.repeat)
+                    load = best_of(lambda: SVMap(file), args.repeat)
+                    megabytes = os.path.getsize(file) / 2**20
+                    plain = plain or megabytes
+                    print(f"{fmt:<7} {size:>8} {codec or 'none':<6} {level or '-':>5} {megabytes:>8.2f} {plain / megabytes:>6.1f} {write:>8.3f} {load:>8.3f}")
+                    file.unlink()
+    compress.LEVEL = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Decode/encode throughput of the JSON backends on map files and API responses
+
+from pathlib import Path
+import argparse
+import io
+import json
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import jsonio
+from benchmarks.synth import generate
+from benchmarks.mock_servers import Pano
+
+
+def meta_map(size):
+    """A synthetic map with the fields a tagged meta file carries."""
+    data = generate(size, 'clustered')
+    for loc in data['customCoordinates']:
+        pano = Pano(loc['lat'], loc['lng'], 1)
+        loc.update({
+            'panoId': pano.pano_id, 'drivingDirection': pano.driving_direction, 'elevation': pano.elevation,
+            'country': pano.country, 'state': pano.state, 'locality': pano.locality,
+            'imageDate': '2019-07', 'timestamp': int(pano.timestamp), 'altitude': 41.27, 'azimuth': 212.5,
+            'altitudeClass': 'High', 'azimuthClass': 'South-West', 'sunEvent': None
+        })
+        loc['extra']['tags'] = ['2019-07', pano.country, pano.state]
+    return data
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Benchmark the JSON backends")
+    args_parser.add_argument("--sizes", type=int, nargs='+', default=[10000, 100000])
+    args_parser.add_argument("--repeat", type=int, default=3)
+    args = args_parser.parse_args()
+
+    backends = ['json', 'auto', 'orjson'] if jsonio.orjson else ['json']
+    response = json.dumps(Pano(36.77, 10.08, 1).response()).encode()
+
+    print(f"{'backend':<8} {'size':>8} {'decode s':>10} {'encode s':>10} {'indent s':>10} {'identical':>10} {'response us':>12}")
+    for size in args.sizes:
+        data = meta_map(size)
+
+        # Reference output of the previous json.dump based save
+        reference, reference_indent = io.StringIO(), io.StringIO()
+        json.dump(data, reference)
+        json.dump(data, reference_indent, indent=4)
+        reference = reference.getvalue().encode()
+        reference_indent = reference_indent.getvalue().encode()
+
+        for name in backends:
+            backend = jsonio.configure(name)
+            decode = best_of(lambda: backend.loads(reference), args.repeat)
+            encode = best_of(lambda: backend.dumps(data), args.repeat)
+            indent = best_of(lambda: backend.dumps(data, indent=4), args.repeat)
+            identical = backend.dumps(data) == reference and backend.dumps(data, indent=4) == reference_indent
+            per_response = best_of(lambda: [backend.loads(response) for _ in range(1000)], args.repeat) * 1000
+            print(f"{name:<8} {size:>8} {decode:>10.4f} {encode:>10.4f} {indent:>10.4f} {str(identical):>10} {per_response:>12.2f}")
+
+    jsonio.configure()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# Local stand-ins for the Google SingleImageSearch and Open-Meteo archive endpoints
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+SINGLE_IMAGE_SEARCH_PATH = '/$rpc/google.internal.maps.mapsjs.v1.MapsJsInternalService/SingleImageSearch'
+OPEN_METEO_PATH = '/v1/archive'
+NO_IMAGES = '[[5,"generic","Search returned no images."]]'
+
+COVERAGE_START = datetime(2010, 1, 1, tzinfo=timezone.utc).timestamp()
+COVERAGE_END = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def seeded(*key):
+    """Deterministic 64-bit integer for a key, stable across runs and processes."""
+    return int.from_bytes(hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), 'big')
+
+
+def nest(entries):
+    """Builds a sparse nested list with values at the given index paths (None elsewhere)."""
+    root = []
+    for path, value in entries:
+        node = root
+        for depth, index in enumerate(path):
+            while len(node) <= index:
+                node.append(None)
+            if depth == len(path) - 1:
+                node[index] = value
+            else:
+                if node[index] is None:
+                    node[index] = []
+                node = node[index]
+    return root
+
+
+class Pano:
+    """Synthetic panorama nearest to a coordinate; the same spot always yields the same pano."""
+
+    def __init__(self, lat, lng, coverage):
+        key = (round(lat, 4), round(lng, 4))
+        h = seeded('pano', *key)
+        self.exists = (h % 10_000) / 10_000 < coverage
+        self.pano_id = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()[:22]
+        self.timestamp = COVERAGE_START + (h >> 16) % int(COVERAGE_END - COVERAGE_START)
+        self.driving_direction = (h >> 8) % 36000 / 100
+        self.elevation = (h >> 24) % 300000 / 100
+        self.country = f"Country {int((lng + 180) // 20)}"
+        self.state = f"State {int((lat + 90) // 5)}"
+        self.locality = f"Locality {(h >> 32) % 1000}"
+
+    def response(self):
+        capture = datetime.fromtimestamp(self.timestamp, timezone.utc)
+        return nest([
+            ((0,), [0]),
+            ((1, 1, 1), self.pano_id),
+            ((1, 3, 2), [[f"{self.locality}, {self.state}"]]),
+            ((1, 5, 0, 1, 4), self.country),
+            ((1, 5, 0, 3, 0, 2, 2, 1, 0), self.elevation),
+            ((1, 5, 0, 3, 0, 4, 2, 2, 0), self.driving_direction),
+            ((1, 6, 7), [capture.year, capture.month]),
+        ])
+
+
+class Endpoint:
+    """Latency, failure and rate-limit emulation plus request accounting for one endpoint."""
+
+    def __init__(self, name, latency=0.0, jitter=0.0, error_rate=0.0, rate=0.0, seed=0, tail_rate=0.0, tail_latency=0.0, per_ip=False):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.rate = rate
+        self.per_ip = per_ip
+        self.buckets = {}
+        self.random = random.Random(seed)
+        self.stats = defaultdict(int)
+        self.remotes = defaultdict(int)
+
+    def throttle(self, remote=None):
+        """Token bucket (one per client address with per_ip); returns seconds until the next token if it is empty."""
+        if not self.rate:
+            return 0
+        key = remote if self.per_ip else None
+        now = time.monotonic()
+        tokens, refilled = self.buckets.get(key, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - refilled) * self.rate)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+        self.buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    async def handle(self, respond, remote=None):
+        self.stats['requests'] += 1
+        self.remotes[remote] += 1
+        wait = self.throttle(remote)
+        if wait:
+            self.stats['throttled'] += 1
+            return web.Response(status=429, headers={'Retry-After': str(math.ceil(wait))}, text='Too Many Requests')
+
+        latency = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if self.random.random() < self.tail_rate:
+            self.stats['slow'] += 1
+            latency = self.tail_latency
+        await asyncio.sleep(max(0.0, latency))
+
+        if self.random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+
+        self.stats['ok'] += 1
+        return respond()
+
+
+class MockServers:
+    def __init__(self, args):
+        self.coverage = args.coverage
+        self.google = Endpoint('singleImageSearch', args.latency, args.jitter, args.error_rate, args.google_rate, args.seed, args.tail_rate, args.tail_latency, args.per_ip)
+        self.meteo = Endpoint('openMeteoArchive', args.meteo_latency, args.jitter, args.error_rate, args.meteo_rate, args.seed + 1, per_ip=args.per_ip)
+
+    async def single_image_search(self, request):
+        body = json.loads(await request.text())
+
+        def respond():
+            lat, lng = body[1][0][2], body[1][0][3]
+            pano = Pano(lat, lng, self.coverage)
+            search = body[2][0]
+
+            # Timestamp probes carry a [start, end] range; everything else is a metadata lookup
+            if isinstance(search, list) and len(search) > 10 and search[10]:
+                start, end = search[10]
+                self.google.stats['probes'] += 1
+                if not pano.exists or not (start <= pano.timestamp <= end):
+                    return web.Response(text=NO_IMAGES, content_type='application/json+protobuf')
+            elif not pano.exists:
+                return web.Response(text=NO_IMAGES, content_type='application/json+protobuf')
+
+            return web.Response(text=json.dumps(pano.response()), content_type='application/json+protobuf')
+
+        return await self.google.handle(respond, request.remote)
+
+    async def open_meteo(self, request):
+        query = request.query
+
+        def respond():
+            lats = [float(v) for v in query['latitude'].split(',')]
+            lngs = [float(v) for v in query['longitude'].split(',')]
+            starts = query['start_date'].split(',')
+            ends = query['end_date'].split(',')
+            hourly = query.get('hourly', '').split(',')
+            if not (len(lats) == len(lngs) == len(starts) == len(ends)):
+                return web.json_response({'error': True, 'reason': 'Parameter lists must be of equal length'}, status=400)
+
+            results = []
+            for lat, lng, start, end in zip(lats, lngs, starts, ends):
+                lat, lng = round(lat, 1), round(lng, 1)
+                first = datetime.strptime(start, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                last = datetime.strptime(end, '%Y-%m-%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+                times = list(range(int(first.timestamp()), int(last.timestamp()), 3600))
+
+                series = {'time': times}
+                for param in hourly:
+                    values = [seeded(param, lat, lng, t) for t in times]
+                    if param == 'cloud_cover':
+                        series[param] = [v % 101 for v in values]
+                    elif param == 'precipitation':
+                        series[param] = [round(max(0, v % 100 - 80) / 10, 1) for v in values]
+                    elif param == 'snow_depth':
+                        series[param] = [round(max(0, v % 100 - 90) / 100, 2) for v in values]
+                results.append({'latitude': lat, 'longitude': lng, 'utc_offset_seconds': 0, 'hourly': series})
+
+            self.meteo.stats['locations'] += len(results)
+            # The real API only wraps multi-location replies in a list
+            return web.json_response(results if len(results) > 1 else results[0])
+
+        return await self.meteo.handle(respond, request.remote)
+
+    async def stats(self, request):
+        return web.json_response({e.name: {**e.stats, 'remotes': dict(e.remotes)} for e in (self.google, self.meteo)})
+
+    async def reset(self, request):
+        for endpoint in (self.google, self.meteo):
+            endpoint.stats.clear()
+            endpoint.remotes.clear()
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application(client_max_size=2**24)
+        app.router.add_post(SINGLE_IMAGE_SEARCH_PATH, self.single_image_search)
+        app.router.add_get(OPEN_METEO_PATH, self.open_meteo)
+        app.router.add_get('/_stats', self.stats)
+        app.router.add_post('/_reset', self.reset)
+        return app
+
+
+class Proxy:
+    """
+    Minimal forwarding HTTP proxy, standing in for an egress route. Requests leave from their own
+    loopback address, so the mocks (with --per-ip) see each proxy as a separate client. A broken
+    proxy answers every request with 502.
+    """
+
+    def __init__(self, port, source, broken=False):
+        self.port = port
+        self.source = source
+        self.broken = broken
+        self.session = None
+
+    async def start(self):
+        from aiohttp import ClientSession, TCPConnector
+        self.session = ClientSession(connector=TCPConnector(local_addr=(self.source, 0)))
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', self.port)
+
+    async def stop(self):
+        self.server.close()
+        await self.session.close()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, url, _ = line.decode().split(' ', 2)
+                headers = {}
+                while (header := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, value = header.decode().split(':', 1)
+                    headers[name.strip()] = value.strip()
+                body = await reader.readexactly(int(headers.get('Content-Length', 0)))
+
+                if self.broken:
+                    status, reason, payload = 502, 'Bad Gateway', b'Bad Gateway'
+                    reply = {'Content-Type': 'text/plain'}
+                else:
+                    forward = {k: v for k, v in headers.items() if k.lower() not in ('host', 'proxy-connection', 'connection', 'content-length')}
+                    async with self.session.request(method, url, headers=forward, data=body or None) as response:
+                        status, reason, payload = response.status, response.reason, await response.read()
+                        reply = {k: response.headers[k] for k in ('Content-Type', 'Retry-After') if k in response.headers}
+
+                reply['Content-Length'] = len(payload)
+                head = ''.join(f"{k}: {v}\r\n" for k, v in reply.items())
+                writer.write(f"HTTP/1.1 {status} {reason}\r\n{head}\r\n".encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean SingleImageSearch latency (s)")
+    parser.add_argument("--meteo-latency", type=float, default=0.1, help="Mean Open-Meteo latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform latency jitter (s)")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Fraction of SingleImageSearch requests that stall")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="Latency of stalled SingleImageSearch requests (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--google-rate", type=float, default=0.0, help="SingleImageSearch requests/s before 429 (0 = unlimited)")
+    parser.add_argument("--meteo-rate", type=float, default=0.0, help="Open-Meteo requests/s before 429 (0 = unlimited)")
+    parser.add_argument("--coverage", type=float, default=0.98, help="Fraction of locations with imagery")
+    parser.add_argument("--per-ip", action='store_true', help="Apply --google-rate and --meteo-rate per client address")
+    parser.add_argument("--proxies", type=int, default=0, help="HTTP proxy stand-ins to serve on the ports after --port")
+    parser.add_argument("--broken-proxies", type=int, default=0, help="How many of the proxies answer every request with 502")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Serve local stand-ins for the MetaTag endpoints")
+    args_parser.add_argument("--host", default="127.0.0.1")
+    args_parser.add_argument("--port", type=int, default=8765)
+    add_arguments(args_parser)
+
+    args = args_parser.parse_args()
+    app = MockServers(args).app()
+
+    # Proxy i listens on port + i and sends from 127.0.0.(i + 1)
+    proxies = [Proxy(args.port + i, f"127.0.0.{i + 1}", i > args.proxies - args.broken_proxies) for i in range(1, args.proxies + 1)]
+
+    async def start_proxies(app):
+        for proxy in proxies:
+            await proxy.start()
+
+    async def stop_proxies(app):
+        for proxy in proxies:
+            await proxy.stop()
+
+    app.on_startup.append(start_proxies)
+    app.on_cleanup.append(stop_proxies)
+    web.run_app(app, host=args.host, port=args.port, print=None)
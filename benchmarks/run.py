@@ -0,0 +1,203 @@
+# Throughput benchmark of the tag and extract stages against local mock endpoints
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from urllib.parse import urlsplit
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.synth import generate
+from benchmarks.mock_servers import SINGLE_IMAGE_SEARCH_PATH, OPEN_METEO_PATH, add_arguments
+
+STAGES = ['load', 'fetch_meta', 'timestamp', 'solar', 'weather', 'tag', 'extract']
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class MockProcess:
+    """Runs the mock servers in a child process so they do not share the client's event loop or GIL."""
+
+    def __init__(self, port, server_args):
+        self.base = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            [sys.executable, str(ROOT / 'benchmarks' / 'mock_servers.py'), '--port', str(port), *server_args]
+        )
+        for _ in range(100):
+            try:
+                self.stats()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError("Mock servers failed to start")
+
+    def stats(self):
+        with urllib.request.urlopen(self.base + '/_stats') as response:
+            return json.load(response)
+
+    def reset(self):
+        urllib.request.urlopen(urllib.request.Request(self.base + '/_reset', method='POST')).close()
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_scenario(metatag, mock, size, layout, flags, stages, workdir):
+    """
+    Runs the requested stages on one synthetic map and records per-stage measurements.
+    """
+    file = Path(workdir) / f"bench-{layout}-{size}-{os.getpid()}.json"
+    with open(file, 'w') as f:
+        json.dump(generate(size, layout), f)
+
+    argparser = metatag.ArgParser(['tag', str(file), *flags])
+    argparser.cached = False
+    map_obj = None
+    mfparser = None
+    results = []
+
+    def measure(stage, func):
+        mock.reset()
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        stats = mock.stats()
+        results.append({
+            'stage': stage,
+            'locations': len(map_obj.locs) if map_obj else size,
+            'wall_s': round(wall, 4),
+            'cpu_s': round(cpu, 4),
+            'locs_per_s': round(size / wall, 1) if wall else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'requests': {name: endpoint.get('requests', 0) for name, endpoint in stats.items()},
+            'endpoint_stats': stats
+        })
+
+    def load():
+        nonlocal map_obj, mfparser
+        map_obj = metatag.SVMap(file)
+        mfparser = metatag.MetaFetchParser(map_obj, argparser, metatag.CONFIG['panoFetchRadius'], metatag.CONFIG['panoFetchChunkSize'])
+
+    measure('load', load)
+    for stage in stages:
+        if stage == 'fetch_meta':
+            measure(stage, lambda: asyncio.run(mfparser.bulk_parse(mfparser.fetch_meta)))
+        elif stage == 'timestamp':
+            measure(stage, lambda: asyncio.run(mfparser.bulk_parse(mfparser.timestamp)))
+        elif stage == 'solar':
+            measure(stage, lambda: asyncio.run(mfparser.bulk_parse(mfparser.solar)))
+        elif stage == 'weather':
+            measure(stage, lambda: asyncio.run(mfparser.weather()))
+        elif stage == 'tag':
+            measure(stage, lambda: metatag.MetaTag(map_obj, argparser, argparser.args.workers))
+        elif stage == 'extract':
+            extract_args = metatag.ArgParser(['extract', str(file), '--key', 'state', '--attr', 'drivingDirection', '--classify', 'direction']).args
+            measure(stage, lambda: metatag.extract(map_obj, extract_args))
+
+    file.unlink()
+    return results
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Benchmark MetaTag stages against local mock endpoints")
+    args_parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000], help="Map sizes (locations)")
+    args_parser.add_argument("--layouts", nargs='+', choices=['uniform', 'clustered'], default=['uniform', 'clustered'])
+    args_parser.add_argument("--stages", nargs='+', choices=STAGES[1:], default=['fetch_meta', 'timestamp', 'solar', 'tag', 'extract'])
+    args_parser.add_argument("--flags", nargs='+', default=['-d', '-a', '-b', '-D', '-s'], help="Tag flags passed to the tag stages")
+    args_parser.add_argument("--port", type=int, default=8765)
+    args_parser.add_argument("--no-hedge", action='store_true', help="Disable request hedging")
+    args_parser.add_argument("--unlimited", action='store_true', help="Ignore the configured per-host rate limits")
+    args_parser.add_argument("--output", type=str, default=None, help="Report path (defaults to benchmarks/results/<timestamp>.json)")
+    add_arguments(args_parser)
+    args = args_parser.parse_args()
+
+    # metatag refuses to import without its configured folders
+    config = json.load(open(ROOT / 'config.json'))
+    for folder in config['path'].values():
+        (ROOT / folder).mkdir(parents=True, exist_ok=True)
+
+    import metatag
+    endpoints = metatag.CONFIG['endpoints']
+    limits = metatag.CONFIG['rateLimits']
+
+    hedge = {} if args.no_hedge else metatag.CONFIG['hedge']
+    # With proxy stand-ins, every request goes out through them
+    egress = dict(metatag.CONFIG['egress'], routes=[
+        {'name': f"proxy{i}", 'proxy': f"http://127.0.0.1:{args.port + i}"} for i in range(1, args.proxies + 1)
+    ])
+
+    # The mocks answer on separate host names, each paced like the host it stands in for
+    if not args.unlimited:
+        metatag.GOVERNOR.configure({
+            'localhost': limits.get(urlsplit(endpoints['singleImageSearch']).hostname),
+            '127.0.0.1': limits.get(urlsplit(endpoints['openMeteoArchive']).hostname)
+        }, metatag.CONFIG['retry'], metatag.CONFIG['requestTimeout'], hedge, egress)
+    else:
+        metatag.GOVERNOR.configure({}, metatag.CONFIG['retry'], metatag.CONFIG['requestTimeout'], hedge, egress)
+
+    endpoints['singleImageSearch'] = f"http://localhost:{args.port}{SINGLE_IMAGE_SEARCH_PATH}"
+    endpoints['openMeteoArchive'] = f"http://127.0.0.1:{args.port}{OPEN_METEO_PATH}"
+
+    server_args = [
+        '--latency', str(args.latency), '--meteo-latency', str(args.meteo_latency), '--jitter', str(args.jitter),
+        '--error-rate', str(args.error_rate), '--google-rate', str(args.google_rate),
+        '--meteo-rate', str(args.meteo_rate), '--coverage', str(args.coverage), '--seed', str(args.seed),
+        '--tail-rate', str(args.tail_rate), '--tail-latency', str(args.tail_latency),
+        '--proxies', str(args.proxies), '--broken-proxies', str(args.broken_proxies), *(['--per-ip'] if args.per_ip else [])
+    ]
+    mock = MockProcess(args.port, server_args)
+
+    report = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'flags': args.flags,
+        'server': vars(args),
+        'scenarios': []
+    }
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for layout in args.layouts:
+                for size in args.sizes:
+                    print(f"== {layout} {size}")
+                    stages = run_scenario(metatag, mock, size, layout, args.flags, args.stages, workdir)
+                    report['scenarios'].append({'layout': layout, 'size': size, 'stages': stages})
+    finally:
+        mock.close()
+
+    print(f"\n{'layout':<10} {'size':>8} {'stage':<11} {'wall s':>9} {'locs/s':>10} {'requests':>9} {'rss MB':>8}")
+    for scenario in report['scenarios']:
+        for stage in scenario['stages']:
+            print(f"{scenario['layout']:<10} {scenario['size']:>8} {stage['stage']:<11} {stage['wall_s']:>9} "
+                  f"{stage['locs_per_s'] or '-':>10} {sum(stage['requests'].values()):>9} {stage['peak_rss_mb'] or '-':>8}")
+
+    output = Path(args.output) if args.output else ROOT / 'benchmarks' / 'results' / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nReport written to {output}")
+
+
+if __name__ == "__main__":
+    main()
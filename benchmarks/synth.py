@@ -0,0 +1,56 @@
+import json
+import random
+import argparse
+
+
+def generate(size, layout='uniform', seed=0, clusters=50, spread=0.5):
+    """
+    Generates a synthetic map-making.app map.
+
+    Args:
+        size (int): Number of locations.
+        layout (str): 'uniform' over the inhabited latitudes, or 'clustered' around random centres.
+        seed (int): Random seed, so runs are reproducible.
+        clusters (int): Number of cluster centres for the clustered layout.
+        spread (float): Standard deviation (degrees) of each cluster.
+
+    Returns:
+        dict: The map data.
+    """
+    rng = random.Random(seed)
+    locs = []
+
+    if layout == 'uniform':
+        for _ in range(size):
+            locs.append((rng.uniform(-55, 70), rng.uniform(-180, 180)))
+    elif layout == 'clustered':
+        centres = [(rng.uniform(-50, 65), rng.uniform(-175, 175)) for _ in range(clusters)]
+        for _ in range(size):
+            lat, lng = rng.choice(centres)
+            locs.append((
+                max(-85, min(85, rng.gauss(lat, spread))),
+                (rng.gauss(lng, spread) + 180) % 360 - 180
+            ))
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
+
+    return {
+        "name": f"Synthetic {layout} {size}",
+        "customCoordinates": [
+            {"lat": lat, "lng": lng, "heading": 0, "pitch": 0, "panoId": None, "extra": {"tags": []}}
+            for lat, lng in locs
+        ]
+    }
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Generate a synthetic map")
+    args_parser.add_argument("size", type=int, help="Number of locations")
+    args_parser.add_argument("output", help="Path to the output JSON file")
+    args_parser.add_argument("--layout", choices=['uniform', 'clustered'], default='uniform')
+    args_parser.add_argument("--seed", type=int, default=0)
+
+    args = args_parser.parse_args()
+
+    with open(args.output, 'w') as f:
+        json.dump(generate(args.size, args.layout, args.seed), f)
@@ -0,0 +1,73 @@
+from collections import defaultdict
+from time import monotonic
+
+SMOOTHING = 0.3  # Weight of the latest chunk in the live cost of a stage
+
+
+class TimeBudget:
+    """
+    Deadline of a tag run. Stages ask it before each chunk of locations whether the chunk, and the
+    later stages those locations still have to go through, fit in the time left; what doesn't fit
+    is left for the next run.
+
+    Per-location costs start from the plan's estimates and follow the measured time of each chunk,
+    so a slow or rate limited endpoint shrinks what is scheduled after it.
+
+    Args:
+        seconds (float): Length of the budget.
+        costs (dict): Estimated seconds per location of each stage.
+        stages (list): The stages of the run, in order.
+        started (float): Monotonic time the run started at (defaults to now).
+    """
+    def __init__(self, seconds, costs, stages, started=None):
+        self.seconds = seconds
+        self.deadline = (started if started is not None else monotonic()) + seconds
+        self.costs = dict(costs)
+        self.stages = list(stages)
+        self.admitted = defaultdict(int)  # Locations each stage has taken on
+        self.left = defaultdict(int)  # Locations each stage left for the next run
+
+    def remaining(self):
+        return self.deadline - monotonic()
+
+    def downstream(self, stage):
+        """
+        Seconds per location of the stages after one.
+        """
+        return sum(self.costs.get(later, 0) for later in self.stages[self.stages.index(stage) + 1:])
+
+    def admit(self, stage, count):
+        """
+        Whether a stage can take on count more locations. The reserve covers the later stages of
+        every location the stage has already taken on, so those can still be finished.
+        """
+        later = self.downstream(stage)
+        cost = count * (self.costs.get(stage, 0) + later) + self.admitted[stage] * later
+        if cost > self.remaining():
+            return False
+        self.admitted[stage] += count
+        return True
+
+    def observe(self, stage, count, seconds):
+        """
+        Updates the cost of a stage from a chunk of count locations that took seconds.
+        """
+        if count:
+            cost = seconds / count
+            self.costs[stage] = cost if stage not in self.costs else (1 - SMOOTHING) * self.costs[stage] + SMOOTHING * cost
+
+    def leave(self, stage, count):
+        self.left[stage] += count
+
+    @property
+    def exhausted(self):
+        return any(self.left.values())
+
+    def report(self):
+        return {
+            'seconds': self.seconds,
+            'used': round(self.seconds - self.remaining(), 2),
+            'exhausted': self.exhausted,
+            'left': dict(self.left),
+            'costs': {stage: round(cost, 4) for stage, cost in self.costs.items()}
+        }
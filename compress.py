@@ -0,0 +1,97 @@
+from pathlib import Path
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+CODECS = {suffix: codec for codec, suffix in SUFFIXES.items()}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+CODEC = None
+LEVEL = None
+
+
+def configure(codec=None, level=None):
+    """
+    Selects the codec new meta and tagged files are written with.
+
+    Args:
+        codec (str): 'gzip', 'zstd' (needs the zstandard package) or None for plain files.
+        level (int): Compression level (defaults to 6 for gzip, 3 for zstd).
+    """
+    global CODEC, LEVEL
+    if codec not in (None, *SUFFIXES):
+        raise ValueError(f"Unknown compression codec {codec}")
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+    CODEC = codec
+    LEVEL = level
+
+
+def suffix():
+    """
+    File suffix of the configured codec ('' for plain files).
+    """
+    return SUFFIXES.get(CODEC, '')
+
+
+def codec_of(file):
+    """
+    Codec a file is compressed with, from its suffix (None for plain files).
+    """
+    return CODECS.get(Path(file).suffix)
+
+
+def strip(file):
+    """
+    The path without its compression suffix, e.g. map.json.gz -> map.json.
+    """
+    file = Path(file)
+    return file.with_suffix('') if codec_of(file) else file
+
+
+def map_suffix(file):
+    """
+    Format suffix of a map file, ignoring compression: '.json' for map.json.gz.
+    """
+    return strip(file).suffix
+
+
+def map_stem(file):
+    """
+    Name of a map file without format and compression suffixes: 'map' for map.json.gz.
+    """
+    return strip(file).stem
+
+
+def open_file(file, mode='rb', level=None):
+    """
+    Opens a map file for streaming binary reads or writes, compressing or decompressing by its
+    suffix. Writes use the configured level unless one is given.
+
+    Args:
+        file (str): The file.
+        mode (str): 'rb' or 'wb'.
+        level (int): Compression level.
+
+    Returns:
+        A binary file object (with readline when reading).
+    """
+    codec = codec_of(file)
+    if level is None:
+        level = LEVEL if LEVEL is not None else DEFAULT_LEVELS.get(codec)
+    if codec == 'gzip':
+        # No timestamp in the header, so the same map always compresses to the same bytes
+        return gzip.GzipFile(file, mode, compresslevel=level, mtime=0)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError(f"Reading {Path(file).name} needs the zstandard package (pip install zstandard)")
+        raw = open(file, mode)
+        if mode == 'rb':
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), 1 << 20)
+        return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=True)
+    return open(file, mode)
@@ -0,0 +1,215 @@
+from pathlib import Path
+import json
+
+import numpy as np
+
+import jsonio
+
+
+class Geocoder:
+    """
+    Offline reverse geocoder over GeoJSON boundary files.
+
+    Boundaries are packed into flat edge arrays (one contiguous run per polygon part) with a
+    bounding box per part. Queries sort the points by longitude once, so each part only tests
+    the points inside its bounding box, and point-in-polygon refinement is a vectorized
+    even-odd test against the edges of the horizontal strip each point falls in.
+
+    Args:
+        file (str): Path to a GeoJSON FeatureCollection of Polygon/MultiPolygon features.
+        country_field (str): Feature property holding the ISO 3166-1 alpha-2 country code, the
+            format the metadata fetch stores (e.g. "TN").
+        state_field (str): Feature property holding the first-level subdivision name (optional).
+
+    Attributes:
+        countries (list): Country code per feature.
+        states (list): Subdivision name per feature.
+    """
+    CHUNK_CELLS = 4_000_000  # Max point x edge comparisons held in memory at once
+
+    MISSING_CODES = ('-1', '-99', '')  # Natural Earth placeholders for features without a code
+
+    def __init__(self, file, country_field='iso_a2', state_field='name'):
+        self.file = Path(file)
+        self.country_field = country_field
+        self.state_field = state_field
+        self.strips = {}
+
+        cache = self.file.with_suffix('.npz')
+        if cache.exists() and cache.stat().st_mtime_ns >= self.file.stat().st_mtime_ns:
+            self.load_packed(cache)
+        else:
+            self.pack()
+            self.save_packed(cache)
+
+    def pack(self):
+        """
+        Flattens the boundary features into edge arrays, part offsets and part bounding boxes.
+        """
+        with open(self.file, 'rb') as f:
+            features = jsonio.loads(f.read())['features']
+
+        self.countries, self.states = [], []
+        edges, offsets, bboxes, owners = [], [0], [], []
+
+        for feature in features:
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Polygon':
+                parts = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                parts = geometry['coordinates']
+            else:
+                continue
+
+            properties = feature.get('properties') or {}
+            owner = len(self.countries)
+            country = properties.get(self.country_field)
+            self.countries.append(None if country in self.MISSING_CODES else country)
+            self.states.append(properties.get(self.state_field) if self.state_field else None)
+
+            for rings in parts:
+                # Holes are handled by the even-odd rule, so all rings of a part are pooled
+                part_edges = []
+                for ring in rings:
+                    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+                    if len(ring) < 3:
+                        continue
+                    if not np.array_equal(ring[0], ring[-1]):
+                        ring = np.vstack([ring, ring[:1]])
+                    part_edges.append(np.hstack([ring[:-1], ring[1:]]))
+                if not part_edges:
+                    continue
+
+                part_edges = np.vstack(part_edges)
+                edges.append(part_edges)
+                offsets.append(offsets[-1] + len(part_edges))
+                bboxes.append([
+                    min(part_edges[:, 0].min(), part_edges[:, 2].min()),
+                    min(part_edges[:, 1].min(), part_edges[:, 3].min()),
+                    max(part_edges[:, 0].max(), part_edges[:, 2].max()),
+                    max(part_edges[:, 1].max(), part_edges[:, 3].max())
+                ])
+                owners.append(owner)
+
+        self.edges = np.vstack(edges) if edges else np.empty((0, 4))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.owners = np.asarray(owners, dtype=np.int64)
+
+    def save_packed(self, file):
+        try:
+            np.savez(file, edges=self.edges, offsets=self.offsets, bboxes=self.bboxes, owners=self.owners,
+                     names=np.array(json.dumps([self.country_field, self.state_field, self.countries, self.states])))
+        except OSError:
+            pass
+
+    def load_packed(self, file):
+        packed = np.load(file)
+        country_field, state_field, self.countries, self.states = json.loads(str(packed['names']))
+        if (country_field, state_field) != (self.country_field, self.state_field):
+            self.pack()
+            self.save_packed(file)
+            return
+        self.edges = packed['edges']
+        self.offsets = packed['offsets']
+        self.bboxes = packed['bboxes']
+        self.owners = packed['owners']
+
+    def locate(self, lats, lngs):
+        """
+        Finds the boundary feature containing each point.
+
+        Args:
+            lats (array): Latitudes.
+            lngs (array): Longitudes.
+
+        Returns:
+            np.ndarray: Feature index per point, -1 where no feature contains it.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        order = np.argsort(lngs, kind='stable')
+        xs, ys = lngs[order], lats[order]
+        found = np.full(len(xs), -1, dtype=np.int64)
+
+        # Smaller parts first, so enclaves win over the polygons that surround them
+        areas = (self.bboxes[:, 2] - self.bboxes[:, 0]) * (self.bboxes[:, 3] - self.bboxes[:, 1])
+        lo = np.searchsorted(xs, self.bboxes[:, 0], side='left')
+        hi = np.searchsorted(xs, self.bboxes[:, 2], side='right')
+
+        for part in np.argsort(areas, kind='stable'):
+            if lo[part] == hi[part]:
+                continue
+            candidates = np.arange(lo[part], hi[part])
+            min_lat, max_lat = self.bboxes[part, 1], self.bboxes[part, 3]
+            candidates = candidates[(found[candidates] == -1) & (ys[candidates] >= min_lat) & (ys[candidates] <= max_lat)]
+            if not len(candidates):
+                continue
+            inside = self.contains(part, xs[candidates], ys[candidates])
+            found[candidates[inside]] = self.owners[part]
+
+        result = np.empty_like(found)
+        result[order] = found
+        return result
+
+    def contains(self, part, xs, ys):
+        """
+        Even-odd point-in-polygon test of points against one polygon part.
+        """
+        edges, strip_edges, strip_offsets, min_lat, height = self.strip_index(part)
+        strip = np.clip(((ys - min_lat) / height).astype(np.int64), 0, len(strip_offsets) - 2)
+        inside = np.zeros(len(xs), dtype=bool)
+
+        for s in np.unique(strip):
+            points = np.nonzero(strip == s)[0]
+            e = edges[strip_edges[strip_offsets[s]:strip_offsets[s + 1]]]
+            if not len(e):
+                continue
+            x1, y1, x2, y2 = e[:, 0], e[:, 1], e[:, 2], e[:, 3]
+            dy = np.where(y2 == y1, 1.0, y2 - y1)
+            step = max(1, self.CHUNK_CELLS // len(e))
+
+            for i in range(0, len(points), step):
+                idx = points[i:i + step]
+                px, py = xs[idx, None], ys[idx, None]
+                spans = (y1 > py) != (y2 > py)
+                crossings = spans & (px < (x2 - x1) * (py - y1) / dy + x1)
+                inside[idx] = np.count_nonzero(crossings, axis=1) % 2 == 1
+
+        return inside
+
+    def strip_index(self, part):
+        """
+        Buckets the edges of a part into horizontal strips (cached per part).
+        """
+        if part in self.strips:
+            return self.strips[part]
+
+        edges = self.edges[self.offsets[part]:self.offsets[part + 1]]
+        min_lat, max_lat = self.bboxes[part, 1], self.bboxes[part, 3]
+        count = max(1, int(np.sqrt(len(edges))))
+        height = max((max_lat - min_lat) / count, 1e-12)
+
+        first = np.clip(((np.minimum(edges[:, 1], edges[:, 3]) - min_lat) / height).astype(np.int64), 0, count - 1)
+        last = np.clip(((np.maximum(edges[:, 1], edges[:, 3]) - min_lat) / height).astype(np.int64), 0, count - 1)
+        spans = last - first + 1
+        edge_ids = np.repeat(np.arange(len(edges)), spans)
+        strip_ids = np.repeat(first, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+
+        order = np.argsort(strip_ids, kind='stable')
+        strip_offsets = np.concatenate([[0], np.cumsum(np.bincount(strip_ids, minlength=count))])
+
+        self.strips[part] = (edges, edge_ids[order], strip_offsets, min_lat, height)
+        return self.strips[part]
+
+    def reverse(self, lats, lngs):
+        """
+        Resolves the country code and state name of each point.
+
+        Returns:
+            list: (country, state) tuples, (None, None) where unresolved.
+        """
+        return [
+            (self.countries[i], self.states[i]) if i >= 0 else (None, None)
+            for i in self.locate(lats, lngs)
+        ]
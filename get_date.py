@@ -1,46 +1,63 @@
 from datetime import datetime, timedelta, timezone
 
-import aiohttp
+from governor import GOVERNOR
 
 headers = {
     'content-type': 'application/json+protobuf'
 }
+SINGLE_IMAGE_SEARCH_URL = 'https://maps.googleapis.com/$rpc/google.internal.maps.mapsjs.v1.MapsJsInternalService/SingleImageSearch'
 
 
-async def check_timestamp(lat, lng, start, end, radius, session):
+async def check_timestamp(lat, lng, start, end, radius, url=SINGLE_IMAGE_SEARCH_URL):
     data = f'[["apiv3"],[[null,null,{lat},{lng}],{radius}],[[null,null,null,null,null,null,null,null,null,null,[{start},{end}]],null,null,null,null,null,null,null,[1],null,[[[2,true,2]]]],[[2,6]]]'
 
-    async with session.post(
-        'https://maps.googleapis.com/$rpc/google.internal.maps.mapsjs.v1.MapsJsInternalService/SingleImageSearch',
-        headers = headers,
-        data = data,
-    ) as response:
-        res = await response.text()
-        return 'Search returned no images.' not in res
-
-
-async def find_accurate_timestamp(lat, lng, date, radius, accuracy=1):
-    year, month = map(int, date.split('-'))
-
-    start_date = datetime(year, month, 1, tzinfo=timezone.utc) - timedelta(days=1)
-    end_date = datetime(year, month, 1, tzinfo=timezone.utc) + timedelta(days=32)
+    res = await GOVERNOR.request('POST', url, 'singleImageSearch', headers = headers, data = data)
+    return b'Search returned no images.' not in res
+
+
+async def find_accurate_timestamp(lat, lng, date, radius, accuracy=1, url=SINGLE_IMAGE_SEARCH_URL, settled=None, interval=None):
+    """
+    Bisects the capture time of the image at a location.
+
+    The search stops once the interval is at most accuracy seconds wide, or earlier once settled
+    says nothing derived from the time can change within it (an image has to have been found first).
+
+    Args:
+        lat (float): The latitude.
+        lng (float): The longitude.
+        date (str): Month of the image (YYYY-MM), searched with a day of padding.
+        radius (int): Search radius.
+        accuracy (int): Largest interval width in seconds.
+        url (str): SingleImageSearch endpoint.
+        settled (callable): Called with the interval (start, end) in UNIX time; True to stop.
+        interval (tuple): Interval (start, end) the time is known to lie in, to refine instead of the month.
+
+    Returns:
+        tuple: The UNIX time (middle of the interval) and the width of the interval in seconds.
+    """
+    if interval:
+        start_date, end_date = (datetime.fromtimestamp(t, timezone.utc) for t in interval)
+    else:
+        year, month = map(int, date.split('-'))
+        start_date = datetime(year, month, 1, tzinfo=timezone.utc) - timedelta(days=1)
+        end_date = datetime(year, month, 1, tzinfo=timezone.utc) + timedelta(days=32)
     initial_end_date = end_date
-
-    async with aiohttp.ClientSession() as session:
-        while True:
-            # Calculate the midpoint timestamp
-            total_seconds = (end_date - start_date).total_seconds()
-            midpoint_date = start_date + timedelta(seconds=total_seconds // 2)
-
-            if total_seconds <= accuracy:
-                # None of the time range checks worked, so failed to get timestamp
-                if (initial_end_date - midpoint_date).total_seconds() <= 1:
-                    raise Exception('Failed to get date')
-                return int(midpoint_date.timestamp())
-
-            midpoint_timestamp = midpoint_date.timestamp()
-            if await check_timestamp(lat, lng, start_date.timestamp(), midpoint_timestamp, radius, session):
-                end_date = midpoint_date
-            else:
-                start_date = midpoint_date
-
+    found = bool(interval)
+
+    while True:
+        # Calculate the midpoint timestamp
+        total_seconds = (end_date - start_date).total_seconds()
+        midpoint_date = start_date + timedelta(seconds=total_seconds // 2)
+
+        if total_seconds <= accuracy or (found and settled and settled(start_date.timestamp(), end_date.timestamp())):
+            # None of the time range checks worked, so failed to get timestamp
+            if not found and (initial_end_date - midpoint_date).total_seconds() <= 1:
+                raise Exception('Failed to get date')
+            return int(midpoint_date.timestamp()), int(total_seconds)
+
+        midpoint_timestamp = midpoint_date.timestamp()
+        if await check_timestamp(lat, lng, start_date.timestamp(), midpoint_timestamp, radius, url):
+            end_date = midpoint_date
+            found = True
+        else:
+            start_date = midpoint_date
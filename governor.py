@@ -0,0 +1,408 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from collections import defaultdict, deque
+import asyncio
+import logging
+import random
+
+import aiohttp
+from aiolimiter import AsyncLimiter
+
+from metrics import METRICS
+
+
+class RequestError(Exception):
+    """Exception raised when a request fails after all retries."""
+    def __init__(self, url, status=None, message=None):
+        self.url = url
+        self.status = status
+        self.message = message or (f"HTTP {status}" if status else "Request failed")
+        super().__init__(f"{self.message} ({urlsplit(url).netloc})")
+
+
+class LatencyTracker:
+    """
+    Online latency percentile of one endpoint, over a sliding window of its recent requests.
+
+    Args:
+        percentile (float): The percentile to track (0-1).
+        window (int): Number of recent latencies kept.
+        min_samples (int): Latencies needed before the percentile is trusted.
+        every (int): Samples between recomputations.
+    """
+    def __init__(self, percentile, window=512, min_samples=50, every=16):
+        self.percentile = percentile
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.every = every
+        self.count = 0
+        self.value = None
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        if self.count >= self.min_samples and (self.value is None or self.count % self.every == 0):
+            ordered = sorted(self.samples)
+            self.value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+
+class Egress:
+    """
+    One route out to the internet: the default route, a local address to bind to, or an HTTP
+    proxy. Remote rate limits apply per source address, so each egress has its own token bucket
+    and 429 pause per host, and a health score (moving average of attempt outcomes).
+
+    Args:
+        name (str): Name in logs and reports.
+        bind (str): Local address to send from.
+        proxy (str): HTTP proxy URL.
+    """
+    def __init__(self, name, bind=None, proxy=None):
+        self.name = name
+        self.bind = bind
+        self.proxy = proxy
+        self.limiters = {}
+        self.paused = {}
+        self.waiting = defaultdict(int)
+        self.active = 0
+        self.sent = 0
+        self.health = 1.0
+        self.down_until = 0.0
+        self.sessions = {}
+
+
+class RateGovernor:
+    """
+    Shared per-host rate limiting and retry policy for every outgoing request.
+
+    Each host gets one token bucket per egress route, so all stages that talk to the same host
+    draw from the same budget, and every configured route adds its own. Requests go out through
+    the healthy route with the shortest queue for the host; routes whose health falls below
+    `min_health` are left out for `cooldown` seconds. A 429 pauses the whole host on that route
+    for its Retry-After (or the backoff delay), and transient failures are retried with jittered
+    exponential backoff, preferably through another route. Attempts on hedged
+    endpoints that run past the endpoint's usual latency get a duplicate; whichever answers first
+    is used, and the number of duplicates is capped at a share of the endpoint's requests.
+    """
+
+    def __init__(self):
+        self.limits = {}
+        self.attempts = 5
+        self.backoff_base = 1.0
+        self.backoff_max = 60.0
+        self.retry_statuses = {429, 500, 502, 503, 504}
+        self.timeout = aiohttp.ClientTimeout(total=30)
+        self.hedge_budget = 0.05
+        self.hedge_min_delay = 0.05
+        self.min_health = 0.3
+        self.health_weight = 0.2
+        self.cooldown = 60.0
+
+        self.trackers = {}
+        self.sent = defaultdict(int)
+        self.hedged = defaultdict(int)
+        self.egresses = [Egress('default')]
+        self.archive = None  # HttpArchive recorded to or replayed from, if any
+
+    def configure(self, limits, retry=None, timeout=None, hedge=None, egress=None):
+        """
+        Args:
+            limits (dict): Host -> {"rate": requests, "period": seconds}; "default" applies to unlisted hosts.
+            retry (dict): {"attempts", "backoffBase", "backoffMax", "statuses"}.
+            timeout (float): Total timeout per request attempt (seconds).
+            hedge (dict): {"endpoints", "percentile", "budget", "minSamples", "minDelay"}; attempts
+                on the listed endpoints slower than the percentile are duplicated, for at most
+                `budget` (a share) of their requests.
+            egress (dict): {"routes", "minHealth", "healthWeight", "cooldown"}; routes are
+                {"name", "bind"} or {"name", "proxy"} dicts. No routes means the default route.
+        """
+        self.limits = limits or {}
+        for route in self.egresses:
+            route.limiters = {}
+        if retry:
+            self.attempts = retry.get('attempts', self.attempts)
+            self.backoff_base = retry.get('backoffBase', self.backoff_base)
+            self.backoff_max = retry.get('backoffMax', self.backoff_max)
+            self.retry_statuses = set(retry.get('statuses', self.retry_statuses))
+        if timeout:
+            self.timeout = aiohttp.ClientTimeout(total=timeout)
+        if hedge is not None:
+            self.hedge_budget = hedge.get('budget', self.hedge_budget)
+            self.hedge_min_delay = hedge.get('minDelay', self.hedge_min_delay)
+            self.trackers = {
+                endpoint: LatencyTracker(hedge.get('percentile', 0.95), min_samples=hedge.get('minSamples', 50))
+                for endpoint in hedge.get('endpoints', [])
+            }
+        if egress is not None:
+            self.min_health = egress.get('minHealth', self.min_health)
+            self.health_weight = egress.get('healthWeight', self.health_weight)
+            self.cooldown = egress.get('cooldown', self.cooldown)
+            routes = egress.get('routes') or [{'name': 'default'}]
+            self.egresses = [
+                Egress(route.get('name') or route.get('bind') or route.get('proxy'), route.get('bind'), route.get('proxy'))
+                for route in routes
+            ]
+
+    def limiter(self, egress, host):
+        if host not in egress.limiters:
+            limit = self.limits.get(host, self.limits.get('default'))
+            egress.limiters[host] = AsyncLimiter(limit['rate'], limit.get('period', 1)) if limit else None
+        return egress.limiters[host]
+
+    def session(self, egress):
+        """
+        Returns the client session of an egress in the running event loop (stages each run their
+        own loop).
+        """
+        loop = asyncio.get_running_loop()
+        session = egress.sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(local_addr=(egress.bind, 0)) if egress.bind else None
+            session = aiohttp.ClientSession(timeout=self.timeout, connector=connector)
+            egress.sessions[loop] = session
+        return session
+
+    async def close(self):
+        """
+        Closes the sessions of the running event loop, and the archive until its next request.
+        """
+        loop = asyncio.get_running_loop()
+        for egress in self.egresses:
+            session = egress.sessions.pop(loop, None)
+            if session is not None:
+                await session.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def choose(self, host, avoid=None):
+        """
+        Picks the egress for the next attempt on a host: among the healthy ones that are not
+        paused, one with a token left in its bucket, then the fewest attempts waiting for a token,
+        then the fewest in flight, then the fewest sent (round robin). When every egress is down,
+        the healthiest one is used anyway.
+
+        Args:
+            host (str): The request host.
+            avoid (Egress): An egress to use only if it is the only healthy one (the previous try).
+        """
+        now = asyncio.get_running_loop().time()
+        healthy = [egress for egress in self.egresses if egress.down_until <= now]
+        if not healthy:
+            return max(self.egresses, key=lambda egress: egress.health)
+        if avoid is not None and len(healthy) > 1 and avoid in healthy:
+            healthy.remove(avoid)
+
+        def load(egress):
+            limiter = self.limiter(egress, host)
+            full = limiter is not None and not limiter.has_capacity()
+            return max(egress.paused.get(host, 0) - now, 0), full, egress.waiting[host], egress.active, egress.sent
+        egress = min(healthy, key=load)
+        egress.sent += 1
+        return egress
+
+    def observe(self, egress, ok):
+        """
+        Updates the health of an egress after an attempt, taking it out of rotation for the
+        cooldown once the score falls below the threshold.
+        """
+        now = asyncio.get_running_loop().time()
+        if egress.down_until > now:
+            # Attempts still in flight when it was taken out
+            METRICS.egress(egress.name, ok, egress.health)
+            return
+        egress.health += self.health_weight * ((1.0 if ok else 0.0) - egress.health)
+        METRICS.egress(egress.name, ok, egress.health)
+        if egress.health < self.min_health and len(self.egresses) > 1:
+            egress.down_until = now + self.cooldown
+            # Back on probation after the cooldown
+            egress.health = self.min_health + self.health_weight
+            METRICS.egress_down(egress.name)
+            logging.warning(f"Egress {egress.name} is unhealthy, leaving it out for {self.cooldown:.0f}s")
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for an attempt (0-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def retry_after(response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    async def throttle(self, host, endpoint, avoid=None):
+        """
+        Picks an egress, waits out any pause of the host on it, then takes a token from its
+        bucket for the host.
+
+        Returns:
+            Egress: The egress to send through.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        egress = self.choose(host, avoid)
+        egress.waiting[host] += 1
+        try:
+            while egress.paused.get(host, 0) > loop.time():
+                await asyncio.sleep(egress.paused[host] - loop.time())
+            limiter = self.limiter(egress, host)
+            if limiter is not None:
+                await limiter.acquire()
+        finally:
+            egress.waiting[host] -= 1
+        METRICS.wait(endpoint, loop.time() - start)
+        return egress
+
+    async def attempt(self, egress, method, url, endpoint, **kwargs):
+        """
+        Sends one copy of a request through an egress.
+
+        Returns:
+            tuple: Body (None on a retryable failure), status, Retry-After delay and error message.
+
+        Raises:
+            RequestError: On a non-retryable status.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        status, delay, message = None, None, None
+        if egress.proxy:
+            kwargs['proxy'] = egress.proxy
+        egress.active += 1
+        try:
+            with METRICS.request(endpoint) as request:
+                async with self.session(egress).request(method, url, **kwargs) as response:
+                    request.status = status = response.status
+                    body = await response.read()
+                    # A 429 is the host's rate limit, handled by pausing, not a faulty route
+                    if status != 429:
+                        self.observe(egress, status < 500)
+                    if 200 <= status < 300:
+                        return body, status, None, None
+                    if status not in self.retry_statuses:
+                        raise RequestError(url, status)
+                    delay = self.retry_after(response)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.observe(egress, False)
+            message = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        finally:
+            egress.active -= 1
+            # Cancelled copies count with the time they ran, a lower bound of their latency
+            if endpoint in self.trackers:
+                self.trackers[endpoint].observe(loop.time() - start)
+        return None, status, delay, message
+
+    async def send(self, egress, host, method, url, endpoint, **kwargs):
+        """
+        Sends one attempt of a request, hedged if the endpoint is: when the attempt runs past the
+        endpoint's latency percentile and the hedge budget allows, a duplicate is sent (through
+        another egress if there is one), the first copy to succeed is used and the other is
+        cancelled.
+
+        Returns:
+            tuple: See attempt().
+        """
+        tracker = self.trackers.get(endpoint)
+        if tracker is None or tracker.value is None:
+            return await self.attempt(egress, method, url, endpoint, **kwargs)
+
+        self.sent[endpoint] += 1
+        primary = asyncio.ensure_future(self.attempt(egress, method, url, endpoint, **kwargs))
+        throttle = hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=max(tracker.value, self.hedge_min_delay))
+            if done or self.hedged[endpoint] >= self.hedge_budget * self.sent[endpoint]:
+                return await primary
+
+            # The duplicate draws from the same rate budget. A token is only taken once the wait
+            # for it ends, so if the primary answers first, cancelling the wait spends nothing
+            throttle = asyncio.ensure_future(self.throttle(host, endpoint, avoid=egress))
+            await asyncio.wait({primary, throttle}, return_when=asyncio.FIRST_COMPLETED)
+            if not throttle.done():
+                return await primary
+            duplicate = throttle.result()
+            if primary.done():
+                return primary.result()
+            self.hedged[endpoint] += 1
+            METRICS.hedge(endpoint)
+            hedge = asyncio.ensure_future(self.attempt(duplicate, method, url, endpoint, **kwargs))
+
+            pending, result = {primary, hedge}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result[0] is not None:
+                        if task is hedge:
+                            METRICS.hedge(endpoint, won=True)
+                        return result
+            return result
+        finally:
+            for task in (primary, throttle, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def request(self, method, url, endpoint, **kwargs):
+        """
+        Sends a rate-limited request, retrying transient failures.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Request URL.
+            endpoint (str): Endpoint name for metrics.
+            **kwargs: Passed to aiohttp (headers, data, ...).
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            RequestError: On a non-retryable status, or once all attempts are spent (or, when
+                replaying an archive, if the request was not recorded).
+        """
+        if self.archive is not None and self.archive.replaying:
+            body = self.archive.get(method, url, kwargs.get('data'))
+            METRICS.cache('archive', body is not None)
+            if body is None:
+                METRICS.failure(endpoint)
+                raise RequestError(url, None, "Not in the archive")
+            return body
+
+        host = urlsplit(url).hostname
+        loop = asyncio.get_running_loop()
+        egress = None
+
+        try:
+            for attempt in range(self.attempts):
+                egress = await self.throttle(host, endpoint, avoid=egress)
+                body, status, delay, message = await self.send(egress, host, method, url, endpoint, **kwargs)
+                if body is not None:
+                    if self.archive is not None:
+                        self.archive.put(endpoint, method, url, kwargs.get('data'), body)
+                    return body
+
+                if attempt == self.attempts - 1:
+                    break
+
+                delay = self.backoff(attempt) if delay is None else delay + random.uniform(0, self.backoff_base)
+                if status == 429:
+                    # Back the whole host off on this egress, not just this request
+                    egress.paused[host] = max(egress.paused.get(host, 0), loop.time() + delay)
+                METRICS.retry(endpoint)
+                logging.debug(f"Retrying {endpoint} in {delay:.2f}s ({message or status})")
+                await asyncio.sleep(delay)
+
+            raise RequestError(url, status, message)
+        except RequestError:
+            METRICS.failure(endpoint)
+            raise
+
+
+GOVERNOR = RateGovernor()
@@ -1,11 +1,14 @@
 const { app, BrowserWindow, ipcMain, dialog } = require('electron');
 const { spawn } = require('child_process');
 const fs = require('fs');
+const os = require('os');
+const zlib = require('zlib');
 const path = require('path');
 const processMap = new Map();
 
 const isDev = process.env.NODE_ENV === 'development';
 const resourcesPath = isDev ? '..' : process.resourcesPath
+const PARTIAL_INTERVAL = 30; // Seconds between partial maps of a running tag
 
 if (isDev) {
     try {
@@ -112,24 +115,40 @@ app.whenReady().then(async () => {
 });
 
 ipcMain.handle('run-python', (event, args) => {
-    const python = spawn('python', ['metatag.py', args.command, args.filePath, ...args.selectedOptions], {
-        cwd: resourcesPath
+    // Progress events arrive as NDJSON on a dedicated pipe (fd 3); tag runs also publish partial output
+    const checkpoint = args.command === 'tag' ? ['--checkpoint', String(PARTIAL_INTERVAL)] : [];
+    const python = spawn('python', ['metatag.py', '--progress-format', 'ndjson', '--progress-fd', '3', args.command, args.filePath, ...args.selectedOptions, ...checkpoint], {
+        cwd: resourcesPath,
+        stdio: ['pipe', 'pipe', 'pipe', 'pipe']
     });
     
     event.sender.send('python-script-pid', python.pid);
     processMap.set(python.pid, python);
 
+    let pendingEvents = '';
+    python.stdio[3].on('data', (data) => {
+        const lines = (pendingEvents + data.toString()).split('\n');
+        pendingEvents = lines.pop();
+        lines.filter((line) => line.trim()).forEach((line) => {
+            let progressEvent;
+            try {
+                progressEvent = JSON.parse(line);
+            } catch (error) {
+                console.error('Invalid progress event', line);
+                return;
+            }
+            if (progressEvent.event === 'partial') {
+                sendMapData(event.sender, progressEvent.file);
+            }
+            event.sender.send('python-script-event', progressEvent);
+        });
+    });
+
     python.stdout.on('data', (data) => {
         console.log(`stdout: ${data}`);
         if(data.toString().includes('Saved to')){
             const filePath = data.toString().split('Saved to ')[1].trim();
-            fs.readFile(filePath, 'utf-8', (err, data) => {
-                if (err) {
-                    console.error('Failed to read file', err);
-                    return;
-                }
-                event.sender.send('file-data', data);
-            });
+            sendTaggedData(event.sender, filePath);
         }
         event.sender.send('python-script-progress', data.toString());
     });
@@ -159,14 +178,63 @@ ipcMain.on('cancel-python', (event, processId) => {
 });
 
 ipcMain.on('read-file', (event, filePath) => {
-    fs.readFile(filePath, 'utf-8', (err, data) => {
-        if (err) {
-            console.error('Failed to read file', err);
+    sendMapData(event.sender, filePath);
+});
+
+// Decompresses gzip and zstd map files (see compression in config.json)
+function decompress(filePath, buffer) {
+    if (filePath.endsWith('.gz')) {
+        return zlib.gunzipSync(buffer);
+    }
+    if (filePath.endsWith('.zst')) {
+        if (!zlib.zstdDecompressSync) {
+            throw new Error('Opening zstd maps needs a newer Electron; use gzip compression');
+        }
+        return zlib.zstdDecompressSync(buffer);
+    }
+    return buffer;
+}
+
+// Sends the output of a run; an overlay holds only the tags, so the full map is materialized to a temporary file
+function sendTaggedData(sender, filePath) {
+    if (!filePath.endsWith('.overlay.json')) {
+        sendMapData(sender, filePath);
+        return;
+    }
+    const output = path.join(os.tmpdir(), path.basename(filePath).replace(/\.overlay\.json$/, '.json'));
+    const materialize = spawn('python', ['metatag.py', 'materialize', filePath, '-o', output], { cwd: resourcesPath });
+    materialize.on('close', (code) => {
+        if (code === 0) {
+            sendMapData(sender, output, filePath);
+        } else {
+            console.error('Failed to materialize', filePath);
+        }
+    });
+}
+
+// Sends a map file along with its tile index, if one was written next to it (or next to the overlay it came from)
+function sendMapData(sender, filePath, sourcePath = filePath) {
+    fs.readFile(filePath, (err, buffer) => {
+        let data;
+        try {
+            if (err) {
+                throw err;
+            }
+            data = decompress(filePath, buffer).toString('utf-8');
+        } catch (error) {
+            console.error('Failed to read file', error);
             return;
         }
-        event.sender.send('file-data', data);
+        const tilesPath = sourcePath.replace(/(\.overlay)?\.(nd)?json(\.gz|\.zst)?$/, '.tiles.json');
+        if (tilesPath === sourcePath) {
+            sender.send('file-data', data, null);
+            return;
+        }
+        fs.readFile(tilesPath, 'utf-8', (tilesErr, tiles) => {
+            sender.send('file-data', data, tilesErr ? null : tiles);
+        });
     });
-});
+}
 
 app.on('window-all-closed', function () {
     if (process.platform !== 'darwin') app.quit();
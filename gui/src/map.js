@@ -1,5 +1,7 @@
 const config = {
     markerSize: 6,
+    tileClusterSize: 16, // Tiles holding more locations than this are drawn as one cluster marker
+    tileZoomOffset: 3, // Index zoom used relative to the map zoom
     attrRedundantTooltip: new Set(['lat', 'lng', 'latitude', 'longitude', 'links', 'panoId', 'country', 'state', 'locality', 'countryCode', 'stateCode'])
 }
 
@@ -10,12 +12,17 @@ class SVLink {
 }
 
 class SVMap {
-    constructor(json) {
+    constructor(json, tiles = null) {
         this.json = json;
-        this.locations = shuffle(json.customCoordinates);
+        this.tiles = tiles;
+        // The tile index refers to locations by position, so they keep their order
+        this.locations = tiles ? json.customCoordinates : shuffle(json.customCoordinates);
         this.filteredLocations = this.locations;
+        this.renderedLocations = [];
         this.filterMap = new Map();
-        this.tree = new kdTree([...this.locations], distance, ['lat','lng']);
+        this.tagMembers = new Map();
+        this.tileStarts = new Map();
+        this.tree = tiles ? null : new kdTree([...this.locations], distance, ['lat','lng']);
         
         // Performance caps
         this.maxMarkers = 30000;
@@ -43,7 +50,7 @@ class SVMap {
         }).addTo(this.map);
 
         this.updateInfoBox();
-        this.fitToBounds(this.locations);
+        this.fitToBounds(tiles ? this.tileCentroids(Math.min(tiles.maxZoom, 8)) : this.locations);
 
         this.pixiContainer = new PIXI.ParticleContainer({maxSize: Math.min(this.locations.length, this.maxMarkers), vertices: true});
         this.pixiOverlay = L.pixiOverlay((utils) => {
@@ -53,13 +60,10 @@ class SVMap {
             const project = this.pixiOverlay.utils.latLngToLayerPoint;
 
             this.pixiContainer.removeChildren();
+            this.renderedLocations = [];
 
             const bounds = this.map.getBounds();
-            const visibleLocations = this.filteredLocations.filter(loc => 
-                this.isLocationVisible(bounds, loc)
-            );
-
-            const locationsToRender = visibleLocations.slice(0, this.maxMarkers);
+            const locationsToRender = this.visibleLocations(bounds);
             
             locationsToRender.forEach((loc) => {
                 const wrappedLocs = this.getWrappedLocations(loc);
@@ -72,9 +76,10 @@ class SVMap {
                     marker.position.set(markerCoords.x, markerCoords.y);
     
                     
-                    marker.scale.set(this.markerScaleSize(this.map));
+                    marker.scale.set(this.markerScaleSize(this.map) * (loc.cluster ? Math.min(4, 1 + Math.log10(loc.locations)) : 1));
 
                     this.pixiContainer.addChild(marker);
+                    this.renderedLocations.push(loc);
                 });
             });
     
@@ -138,7 +143,9 @@ class SVMap {
         this.SVLinkHandler = (event) => {
             const proximalNode = this.proximalNode(event, 0.1);
             
-            if(proximalNode.nearest && proximalNode.mouseOnMarker){
+            if(proximalNode.nearest && proximalNode.mouseOnMarker && proximalNode.nearest.cluster){
+                this.map.setView([proximalNode.nearest.lat, proximalNode.nearest.lng], this.map.getZoom() + 2);
+            } else if(proximalNode.nearest && proximalNode.mouseOnMarker){
                 const link = new SVLink(proximalNode.nearest);
                 console.log(link.url);
                 window.open(link.url);
@@ -224,6 +231,11 @@ class SVMap {
             }
         };
 
+        if (filter === 'tags') {
+            const members = this.getTagMembers(value);
+            return locations.filter(loc => members.has(loc) === (operator !== '!='));
+        }
+
         return locations.filter(loc => {
             let locValue = loc[filter];
             let parsedValue;
@@ -280,7 +292,7 @@ class SVMap {
             if (distance < minDistance) {
                 minDistance = distance;
                 closestMarker = marker;
-                nearestLocation = this.filteredLocations[Math.floor(index / 3)]; // Divide by 3 because each location can have up to 3 markers due to wrapping
+                nearestLocation = this.renderedLocations[index];
             }
         });
     
@@ -325,6 +337,9 @@ class SVMap {
                     }
                 });
             });
+            if (this.tiles && Object.keys(this.tiles.tags).length) {
+                this.attributes.add('tags');
+            }
             subline.textContent = Array.from(this.attributes).join(' / ');
         }
     }
@@ -368,6 +383,78 @@ class SVMap {
         }
     }
 
+    /**
+     * Returns the locations to draw in the given bounds. With a tile index and no active filters,
+     * only visible tiles are read, and tiles with many locations become one cluster marker.
+     */
+    visibleLocations(bounds) {
+        if (!this.tiles || this.filteredLocations !== this.locations) {
+            return this.filteredLocations.filter(loc => this.isLocationVisible(bounds, loc)).slice(0, this.maxMarkers);
+        }
+
+        const level = Math.max(0, Math.min(this.tiles.maxZoom, Math.floor(this.map.getZoom()) + config.tileZoomOffset));
+        const zoom = this.tiles.zooms[level];
+        const starts = this.getTileStarts(level);
+        const n = 2 ** level;
+        const locations = [];
+
+        for (let i = 0; i < zoom.counts.length && locations.length < this.maxMarkers; i++) {
+            if (!this.isTileVisible(bounds, zoom.x[i], zoom.y[i], n)) continue;
+
+            if (zoom.counts[i] <= config.tileClusterSize || level === this.tiles.maxZoom) {
+                for (let j = starts[i]; j < starts[i] + zoom.counts[i]; j++) {
+                    locations.push(this.locations[this.tiles.order[j]]);
+                }
+            } else {
+                locations.push({ lat: zoom.lat[i], lng: zoom.lng[i], locations: zoom.counts[i], cluster: true });
+            }
+        }
+        return locations;
+    }
+
+    isTileVisible(bounds, x, y, n) {
+        if (tileLat(y + 1, n) > bounds.getNorth() || tileLat(y, n) < bounds.getSouth()) return false;
+        const west = x / n * 360 - 180;
+        const east = (x + 1) / n * 360 - 180;
+        return [-360, 0, 360].some(offset => west + offset <= bounds.getEast() && east + offset >= bounds.getWest());
+    }
+
+    /**
+     * Offsets of each tile's range in the index order (running sum of the tile counts).
+     */
+    getTileStarts(level) {
+        if (!this.tileStarts.has(level)) {
+            const counts = this.tiles.zooms[level].counts;
+            const starts = new Array(counts.length);
+            let start = 0;
+            counts.forEach((count, i) => {
+                starts[i] = start;
+                start += count;
+            });
+            this.tileStarts.set(level, starts);
+        }
+        return this.tileStarts.get(level);
+    }
+
+    tileCentroids(level) {
+        const zoom = this.tiles.zooms[level];
+        return zoom.lat.map((lat, i) => ({ lat, lng: zoom.lng[i] }));
+    }
+
+    /**
+     * Returns the set of locations carrying a tag, from the tile index bitmap when available.
+     */
+    getTagMembers(tag) {
+        if (!this.tagMembers.has(tag)) {
+            const bitmap = this.tiles && this.tiles.tags[tag];
+            const members = bitmap
+                ? decodeBitmap(bitmap).map(position => this.locations[this.tiles.order[position]])
+                : this.locations.filter(loc => loc.extra && Array.isArray(loc.extra.tags) && loc.extra.tags.includes(tag));
+            this.tagMembers.set(tag, new Set(members));
+        }
+        return this.tagMembers.get(tag);
+    }
+
     isLocationVisible(bounds, loc) {
         const wrappedLocs = this.getWrappedLocations(loc);
         return wrappedLocs.some(wrappedLoc => bounds.contains(L.latLng(wrappedLoc.lat, wrappedLoc.lng)));
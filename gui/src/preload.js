@@ -5,7 +5,8 @@ contextBridge.exposeInMainWorld('electronAPI', {
     runPythonScript: (arg) => ipcRenderer.invoke('run-python', arg),
     cancelPythonScript: (processId) => ipcRenderer.send('cancel-python', processId),
     onPythonScriptProgress: (callback) => ipcRenderer.on('python-script-progress', callback),
+    onPythonScriptEvent: (callback) => ipcRenderer.on('python-script-event', (event, data) => callback(data)),
     onPythonScriptPid: (callback) => ipcRenderer.on('python-script-pid', callback),
     sendFilePath: (filePath) => ipcRenderer.send('read-file', filePath),
-    onFileData: (callback) => ipcRenderer.on('file-data', (event, data) => callback(data))
+    onFileData: (callback) => ipcRenderer.on('file-data', (event, data, tiles) => callback(data, tiles))
   })
\ No newline at end of file
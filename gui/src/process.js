@@ -12,9 +12,9 @@ document.getElementById('mapFile').addEventListener('change', (event) => {
 });
   
 // Retrieve file data
-window.electronAPI.onFileData(async (data) => {
+window.electronAPI.onFileData(async (data, tilesData) => {
     try {
-        var json = JSON.parse(data);
+        var json = parseMapData(data);
         if (!json.customCoordinates) {
             throw new Error('Missing customCoordinates.');
         }
@@ -25,7 +25,7 @@ window.electronAPI.onFileData(async (data) => {
         if (map) {
             map.map.remove();
         }
-        map = new SVMap(json);
+        map = new SVMap(json, parseTiles(json, tilesData));
     } catch (error) {
         console.error('Error parsing JSON:', error);
         Swal.fire({
@@ -177,47 +177,48 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Progress logic
 window.electronAPI.onPythonScriptProgress((event, message) => {
-    const progressRegex = /(\d+)%/;
-    const descriptionRegex = /(.*?):/;
-    const locsDoneRegex = /(\d+)\//;
-    const locsTotalRegex = /\/(\d+)/;
     const errorMessageRegex = /(?:Error|Exception):\s*(.+)/;
     const finishedRegex = /^(Saved to.*)/
 
-    if (!progressRegex.test(message)) {
-        const errorMatch = message.match(errorMessageRegex);
-        const finishedMatch = message.match(finishedRegex);
-        if(errorMatch){
-            Swal.fire({
-                icon: 'error',
-                title: 'Error',
-                text: errorMatch[1] || 'An error occurred.',
-                heightAuto: false
-            });
-            progressContainer.classList.add('hidden');
-        }
-        else if(finishedMatch){
-            Swal.fire({
-                icon: 'success',
-                title: 'Success',
-                text: finishedMatch[1],
-                heightAuto: false
-            });
-            progressContainer.classList.add('hidden');
-        }
-    } else {
-        const matchProgress = message.match(progressRegex);
-        const matchDescription = message.match(descriptionRegex);
+    const errorMatch = message.match(errorMessageRegex);
+    const finishedMatch = message.match(finishedRegex);
+    if(errorMatch){
+        Swal.fire({
+            icon: 'error',
+            title: 'Error',
+            text: errorMatch[1] || 'An error occurred.',
+            heightAuto: false
+        });
+        progressContainer.classList.add('hidden');
+    }
+    else if(finishedMatch){
+        Swal.fire({
+            icon: 'success',
+            title: 'Success',
+            text: finishedMatch[1],
+            heightAuto: false
+        });
+        progressContainer.classList.add('hidden');
+    }
+});
 
-        if (matchProgress) {
-            console.log(matchProgress[1]);
-            progress.style.width = ((message.match(locsDoneRegex)[1]/message.match(locsTotalRegex)[1])*100) + '%';
-        }
+// Stage progress events (see progress.py)
+window.electronAPI.onPythonScriptEvent((data) => {
+    if (data.event === 'start' || data.event === 'progress' || data.event === 'end') {
+        progress.style.width = (data.total ? (data.done || 0) / data.total * 100 : 0) + '%';
 
-        if (matchDescription) {
-            document.querySelector('#progressContainerDescription').textContent = matchDescription[1]+" ("+message.match(locsDoneRegex)[1]+"/"+message.match(locsTotalRegex)[1]+")";
-            console.log(matchDescription[1]);
+        let description = `${data.stage} (${data.done || 0}/${data.total})`;
+        if (data.event === 'progress' && data.eta !== null) {
+            description += ` - ${Math.ceil(data.eta)}s left`;
+        }
+        if (data.errors) {
+            description += ` - ${data.errors} errors`;
         }
+        document.querySelector('#progressContainerDescription').textContent = description;
+    }
+    else if (data.event === 'partial') {
+        // The partial map itself arrives through onFileData
+        document.querySelector('#progressContainerDescription').title = `Showing ${data.locations}/${data.total} finished locations`;
     }
 });
 
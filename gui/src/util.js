@@ -3,6 +3,60 @@ function distance(a, b) {
 }
 
 
+function parseMapData(data) {
+    try {
+        return JSON.parse(data);
+    } catch (error) {
+        // NDJSON: optional map header line, then one location per line
+        const lines = data.split('\n').filter((line) => line.trim());
+        if (lines.length < 2) {
+            throw error;
+        }
+        let header = JSON.parse(lines[0]);
+        let start = 1;
+        if ('lat' in header && 'lng' in header) {
+            header = {};
+            start = 0;
+        }
+        header.customCoordinates = lines.slice(start).map((line) => JSON.parse(line));
+        return header;
+    }
+}
+
+function parseTiles(json, data) {
+    // A tile index only applies to the exact map it was built from
+    if (!data) return null;
+    try {
+        const tiles = JSON.parse(data);
+        return tiles.version === 1 && tiles.locations === json.customCoordinates.length ? tiles : null;
+    } catch (error) {
+        console.error('Ignoring invalid tile index:', error);
+        return null;
+    }
+}
+
+function decodeBitmap(bitmap) {
+    const positions = [];
+    if (bitmap.runs) {
+        for (let i = 0; i < bitmap.runs.length; i += 2) {
+            for (let j = 0; j < bitmap.runs[i + 1]; j++) positions.push(bitmap.runs[i] + j);
+        }
+    } else {
+        const bytes = atob(bitmap.bits);
+        for (let i = 0; i < bytes.length; i++) {
+            const byte = bytes.charCodeAt(i);
+            for (let bit = 0; bit < 8; bit++) {
+                if (byte & (1 << bit)) positions.push(i * 8 + bit);
+            }
+        }
+    }
+    return positions;
+}
+
+function tileLat(y, n) {
+    return Math.atan(Math.sinh(Math.PI * (1 - 2 * y / n))) * 180 / Math.PI;
+}
+
 function formatAttrString(str) {
     str = str.replace(/(_[a-z])/g, (match) => match[1].toUpperCase());
 
@@ -0,0 +1,77 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StdlibBackend:
+    """
+    The standard library json module. Encodes in one shot, which uses the C encoder
+    (json.dump streams through the pure-Python one).
+    """
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, indent=None):
+        return json.dumps(obj, indent=indent).encode('utf-8')
+
+
+class OrjsonBackend(StdlibBackend):
+    """
+    orjson for decoding (bytes or str), falling back to the standard library for input orjson
+    rejects (NaN/Infinity, integers beyond 64 bits).
+
+    Args:
+        encode (bool): Also encode with orjson. Output is compact UTF-8 (or 2-space indented)
+            rather than the standard library's layout, so files are not byte-identical.
+    """
+    def __init__(self, encode=False):
+        self.encode = encode
+        self.name = 'orjson' if encode else 'auto'
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+    def dumps(self, obj, indent=None):
+        if not self.encode:
+            return super().dumps(obj, indent)
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            return super().dumps(obj, indent)
+
+
+BACKEND = OrjsonBackend() if orjson else StdlibBackend()
+
+
+def configure(name='auto'):
+    """
+    Selects the JSON backend.
+
+    Args:
+        name (str): 'auto' (orjson decoding if installed, standard library encoding with
+            byte-identical output), 'orjson' (orjson for both) or 'json' (standard library only).
+    """
+    global BACKEND
+    if name == 'json' or not orjson:
+        BACKEND = StdlibBackend()
+    else:
+        BACKEND = OrjsonBackend(encode=name == 'orjson')
+    return BACKEND
+
+
+def loads(data):
+    """Decodes JSON from bytes or str."""
+    return BACKEND.loads(data)
+
+
+def dumps(obj, indent=None):
+    """Encodes JSON to bytes."""
+    return BACKEND.dumps(obj, indent)
@@ -4,29 +4,51 @@ import csv, json
 import argparse
 import os
 import re
+import shlex
+import copy
 
 # Implicit processing
 from datetime import datetime as dt, timedelta
-from time import time, localtime
+from time import time, localtime, sleep, monotonic
 from timezonefinder import TimezoneFinder
 from pytz import utc, timezone
 import calendar
 from pysolar.solar import get_altitude, get_azimuth
 
 # Explicit processing
-import asyncio, aiohttp
-from aiolimiter import AsyncLimiter
-from tqdm import tqdm
+import asyncio
 import logging
 import random
+from bisect import bisect_right
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 # Local
-from sv_map import SVMap, Classifier, verify_extra, force_extra, clear_tags
+from sv_map import SVMap, Classifier, verify_extra, force_extra, clear_tags, NDJSON_SUFFIXES
 from get_date import find_accurate_timestamp
+from geocode import Geocoder
+from metrics import METRICS
+from governor import GOVERNOR, RequestError
+import jsonio
+import compress
+from compress import map_stem, map_suffix
+from overlay import save_overlay, materialize, file_version
+from tiles import save_tiles
+from pano_store import PanoStore
+from planner import Planner, print_plan, timestamp_interval
+from meteo import weather_chunks, closest_hour
+import shards
+import approx
+from budget import TimeBudget
+from archive import HttpArchive
+from query import MapIndex
+from progress import progress_bar, configure_progress, notify
 
 FILE = Path(__file__).parent
 CONFIG = json.load(open(FILE / 'config.json', 'r'))
+GOVERNOR.configure(CONFIG['rateLimits'], CONFIG['retry'], CONFIG['requestTimeout'], CONFIG['hedge'], CONFIG['egress'])
+jsonio.configure(CONFIG['jsonBackend'])
 FOLDERS = {
     'base': {
         'path': (FILE / CONFIG['path']['base']).resolve(),
@@ -49,6 +71,8 @@ FOLDERS = {
         'exists': False
     }
 }
+compress.configure(CONFIG['compression']['codec'], CONFIG['compression']['level'])
+MAP_SUFFIX = ('.ndjson' if CONFIG['mapFormat'] == 'ndjson' else '.json') + compress.suffix()
 DEBUG = CONFIG['debug']
 if DEBUG:
     if DEBUG == True: DEBUG = 0
@@ -60,9 +84,27 @@ for folder in FOLDERS.values():
         raise FileNotFoundError(f"Path {folder['path']} does not exist")
 
 
+def meta_file(stem):
+    """
+    Path of the meta file for a map. An existing meta file in another format or compression is
+    still used, so changing mapFormat or compression does not discard the cache.
+
+    Args:
+        stem (str): The map name.
+
+    Returns:
+        Path: The meta file.
+    """
+    for suffix in dict.fromkeys([MAP_SUFFIX] + [f"{ext}{codec}" for ext in ('.json', '.ndjson') for codec in ('', *compress.SUFFIXES.values())]):
+        file = FOLDERS['meta']['path'] / f"{stem}{suffix}"
+        if file.exists():
+            return file
+    return FOLDERS['meta']['path'] / f"{stem}{MAP_SUFFIX}"
+
+
 
 class ArgParser:
-    def __init__(self):
+    def __init__(self, argv=None):
         self.parser = argparse.ArgumentParser()
         self.SHORT_ARGS = {}
         self.args_by_group = {}
@@ -83,20 +125,43 @@ class ArgParser:
         self.extract_parser = self.subparsers.add_parser('extract', help='Extract attributes as table', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
         self.add_extract_arguments(self.extract_parser)
 
+        self.materialize_parser = self.subparsers.add_parser('materialize', help='Build a full tagged map from an overlay', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_materialize_arguments(self.materialize_parser)
+
+        self.convert_parser = self.subparsers.add_parser('convert', help='Convert a map between JSON, NDJSON and CSV', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_convert_arguments(self.convert_parser)
+
+        self.shard_parser = self.subparsers.add_parser('shard', help='Split a map into shards to tag on several machines', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_shard_arguments(self.shard_parser)
+
+        self.merge_parser = self.subparsers.add_parser('merge', help='Merge the meta files of tagged shards into the meta file of the map', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_merge_arguments(self.merge_parser)
+
+        self.query_parser = self.subparsers.add_parser('query', help='Select locations of a map by area, distance and attributes', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_query_arguments(self.query_parser)
+
+        self.watch_parser = self.subparsers.add_parser('watch', help='Re-tag maps in the base folder when they change', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        self.add_watch_arguments(self.watch_parser)
+
         self.parser.add_argument('-v', '--version', action='store_true', help='Version of project')
+        self.parser.add_argument('--progress-format', choices=['auto', 'tqdm', 'ndjson', 'none'], default='auto', help='Progress output (auto: tqdm on a terminal, otherwise none)')
+        self.parser.add_argument('--progress-fd', type=int, default=2, help='File descriptor for ndjson progress events')
+        archive = self.parser.add_mutually_exclusive_group()
+        archive.add_argument('--record', type=str, default=None, help='Record every request and response to an archive file')
+        archive.add_argument('--replay', type=str, default=None, help='Answer every request from an archive file, without network')
 
-        self.args = self.parser.parse_args()
+        self.args = self.parser.parse_args(argv)
         if self.args.version or not self.args.command:
             self.filepath = Path(".")
             return
         
         self.userparser =  self.subparsers.choices[self.args.command]
-        self.filepath = Path(self.args.file)
+        self.filepath = Path(self.args.file) if hasattr(self.args, 'file') else FOLDERS['base']['path']
 
         # Cache
-        if self.args.command == 'tag' or self.args.command == 'extract':
+        if self.args.command == 'tag' or self.args.command == 'extract' or self.args.command == 'query':
             print(str(FOLDERS['base']['path']))
-            self.cached_file = (FOLDERS['meta']['path'] / self.filepath.name).absolute()
+            self.cached_file = meta_file(map_stem(self.filepath)).absolute()
             if self.cached_file.exists() and ((hasattr(self.args, 'no_cache_in',) and not self.args.no_cache_in) or not hasattr(self.args, 'no_cache_in')):
                 print("Found cached file")
                 self.cached = True
@@ -119,6 +184,8 @@ class ArgParser:
 
         self.add_argument(parser, '--color', type=str, help='Colorscale color', default="red", group='cosmetic')
         self.add_argument(parser, '--color2', type=str, help='Colorscale color 2', default="red", group='cosmetic')
+        self.add_argument(parser, '--bins', type=int, default=0, help='Group numeric tags (-S, -U, -e) into at most this many ranges (0 to keep every value)', group='cosmetic')
+        self.add_argument(parser, '--bin-mode', choices=['width', 'quantile'], default='width', help='Ranges of equal width, or holding about as many locations each', group='cosmetic')
 
         self.add_argument(parser, '-t','--time', action='store_true', group='temporal')
         self.add_argument(parser, '-d','--date', action='store_true', group='temporal')
@@ -140,6 +207,12 @@ class ArgParser:
         self.add_argument(parser, '-p', '--precipitation', action='store_true', group='terrestrial')
         self.add_argument(parser, '-w', '--snow', action='store_true', group='terrestrial')
 
+        self.add_argument(parser, '--workers', type=int, default=1, help='Processes to tag with (0 for one per CPU)')
+        self.add_argument(parser, '--tiles', action='store_true', help='Write a tile index for the viewer')
+        self.add_argument(parser, '--merge', action='store_true', help='Load the base file, reusing meta cache entries of unchanged locations')
+        self.add_argument(parser, '--checkpoint', type=float, default=0, help='Seconds between partial tagged files of the locations finished so far (0 to disable)')
+        self.add_argument(parser, '--time-budget', type=float, default=0, help='Seconds the run may take; work that does not fit, cheapest first, is left for the next run (0 for no limit)')
+        self.add_argument(parser, '--plan', action='store_true', help='Print the stages, request counts and estimated runtime of the run without fetching')
         self.add_argument(parser, '-H', '--heading', type=str, default=None, help='Update heading; orient towards object i.e. solar')
         self.add_argument(parser, '-D', '--drivingdirection', action='store_true', help='Update driving direction')
 
@@ -160,6 +233,42 @@ class ArgParser:
         self.add_argument(parser, '--format', choices=['percent', 'count'], default='count', help='Format of the output (percent or count)')
         self.add_argument(parser, '--classify', nargs='*', help='Post-processing classifier types (one per attribute, use "none" to skip)')
         self.add_argument(parser, '--include-none', action='store_true', help='Include None values as a separate category')
+        self.add_argument(parser, '--approx', type=str, default=None, help='Estimate from a stratified sample by key: a fraction of each key value (e.g. 0.05) or a number of locations')
+        self.add_argument(parser, '--confidence', type=float, default=0.95, help='Confidence level of the intervals of --approx')
+
+    def add_materialize_arguments(self, parser):
+        self.add_argument(parser, 'file', type=str, help='Path to overlay file')
+        self.add_argument(parser, '-o', '--output', type=str, default=None, help='Output path (defaults to the overlay path without .overlay)')
+
+    def add_convert_arguments(self, parser):
+        self.add_argument(parser, 'file', type=str, help='Path to JSON, NDJSON or CSV file')
+        self.add_argument(parser, '--to', choices=['json', 'ndjson', 'csv'], required=True, help='Output format')
+        self.add_argument(parser, '-o', '--output', type=str, default=None, help='Output path (defaults to the input path with the new extension)')
+        self.add_argument(parser, '--workers', type=int, default=1, help='Processes to parse NDJSON with (0 for one per CPU)')
+
+    def add_shard_arguments(self, parser):
+        self.add_argument(parser, 'file', type=str, help='Path to base map')
+        self.add_argument(parser, '--count', type=int, required=True, help='Number of shards')
+        self.add_argument(parser, '-o', '--output', type=str, default=None, help='Folder to write shards to (defaults to the folder of the map)')
+
+    def add_merge_arguments(self, parser):
+        self.add_argument(parser, 'file', type=str, help='Path to base map the shards were split from')
+        self.add_argument(parser, '--shards', type=str, default=None, help='Folder holding the shard meta files (defaults to the meta folder)')
+        self.add_argument(parser, '--tag', type=str, default=None, help='Tag arguments to run on the merged map (quoted, e.g. --tag="-d -a")')
+
+    def add_query_arguments(self, parser):
+        self.add_argument(parser, 'file', type=str, help='Path to map (its meta file is queried if there is one)')
+        self.add_argument(parser, '--bbox', type=str, default=None, help='Bounding box as "min_lat,min_lng,max_lat,max_lng" (min_lng > max_lng crosses the antimeridian)')
+        self.add_argument(parser, '--near', type=str, default=None, help='Point as "lat,lng" for --radius and --nearest')
+        self.add_argument(parser, '--radius', type=float, default=None, help='Distance from --near in km')
+        self.add_argument(parser, '--nearest', type=int, default=None, help='Keep the k locations closest to --near, nearest first')
+        self.add_argument(parser, '--where', type=str, default=None, help='Attribute predicate, e.g. "state == \'Tunis\' and (altitude < 6 or tag == Overcast)"')
+        self.add_argument(parser, '-o', '--output', type=str, default=None, help='Output path (defaults to <map>-query in the base folder)')
+
+    def add_watch_arguments(self, parser):
+        self.add_argument(parser, '--profile', type=str, default=' '.join(CONFIG['watchProfile']), help='Tag arguments to run on changed maps (quoted, e.g. --profile="-d -a")')
+        self.add_argument(parser, '--interval', type=float, default=CONFIG['watchInterval'], help='Seconds between scans of the base folder')
+        self.add_argument(parser, '--once', action='store_true', help='Scan once and exit')
 
     def add_argument(self, parser, *args, **kwargs):
         group = kwargs.pop('group', None)
@@ -173,15 +282,275 @@ class ArgParser:
         return any(getattr(self.args, arg) is True for arg in self.args_by_group.get(group, []))
     
 
+class LocationTagger:
+    """
+    Computes the tags of individual locations. Holds no map state, so each worker process of a
+    parallel run builds its own and tags any shard of the map.
+
+    Args:
+        args (Namespace): The tag arguments.
+        cached (bool): Whether the map was loaded from the meta cache.
+        geographical (bool): Whether any geographical tag is requested.
+    """
+
+    def __init__(self, args, cached, geographical):
+        self.args = args
+        self.cached = cached
+        self.geographical = geographical
+
+        self.tf = TimezoneFinder() if args.time else None
+        self.datestring = self.datestring()
+
+    def tag(self, i, item, now):
+        """
+        Computes the tags of one location without modifying it.
+
+        Args:
+            i (int): Index of the location in the map.
+            item (dict): The location.
+            now (float): UNIX time of the run, bounding valid timestamps.
+
+        Returns:
+            tuple: The tags and a list of (attribute set, value) pairs for ordered tags.
+        """
+        lat, lng = float(item['lat']), float(item['lng'])
+        tags = []
+        attrs = []
+
+        if self.args.date or self.args.time:
+            unix_time = float(item['timestamp'])
+            if not (now - (20 * 365 * 24 * 60 * 60) <= unix_time <= now):
+                raise ValueError(f"Invalid UNIX time at line {i+2}: {unix_time}")
+
+            timestamp = self.tz_datestring(lat, lng, unix_time, self.args.round)
+            tags.append(timestamp)
+            attrs.append(('dates', timestamp))
+        elif self.args.month or self.args.year:
+            if item.get('imageDate'):
+                tags.append(item.get('imageDate'))
+            elif item.get('extra').get('panoDate'):
+                tags.append(item.get('extra').get('panoDate'))
+
+        if self.geographical:
+            tags.extend(filter(None, [
+                item.get('country') if self.args.country else None,
+                item.get('state') if self.args.state else None,
+                item.get('locality') if self.args.locality else None
+            ]))
+
+        if self.args.drivingdirection:
+            driving_direction = item.get('drivingDirection')
+            if driving_direction:
+                tags.append("DRIVING " + Classifier.direction(driving_direction))
+
+        if self.args.solar or self.args.SOLAR:
+            try:
+                altitude = round(float(item['altitude']))
+                azimuth = round(float(item['azimuth']))
+                altitude_class = str(item['altitudeClass'])
+                azimuth_class = str(item['azimuthClass'])
+                sun_event = item['sunEvent']
+
+                if self.args.solar:
+                    tags.extend([f"#{altitude_class}", f"@{azimuth_class}"])
+                    if sun_event:
+                        tags.append(sun_event)
+                if self.args.SOLAR:
+                    altitude_str, azimuth_str = f"{altitude} #", f"{azimuth} @"
+                    tags.extend([altitude_str, azimuth_str])
+                    attrs.append(('altitudes', altitude_str))
+                    attrs.append(('azimuths', azimuth_str))
+            except KeyError:
+                if self.cached:
+                    raise SVMap.CacheError()
+                else:
+                    raise ValueError("Solar data not found")
+
+        if self.args.clouds or self.args.CLOUDS:
+            cloud_cover = item.get('cloudCover')
+            if self.args.clouds and 'cloudCoverClass' in item:
+                tags.append(str(item['cloudCoverClass']))
+            if self.args.CLOUDS and cloud_cover:
+                cloud_tag = f"CLOUD {cloud_cover}"
+                tags.append(cloud_tag)
+                attrs.append(('cloudCover', cloud_tag))
+
+        if self.args.precipitation and 'precipitation' in item:
+            precipitation = item['precipitation']
+            if precipitation and precipitation > 0:
+                tags.append(f"PRCP {precipitation}")
+
+        if self.args.snow and 'snowDepth' in item:
+            snow_depth = item['snowDepth']
+            if snow_depth and snow_depth > 0:
+                tags.append(f"SNOW {snow_depth}")
+
+        if self.args.elevation and 'elevation' in item:
+            elevation = item['elevation']
+            if elevation:
+                elevation_str = f"ELEV {round(float(elevation))}"
+                tags.append(elevation_str)
+                attrs.append(('elevation', elevation_str))
+
+        return tags, attrs
+
+    def tag_shard(self, start, locs, now):
+        """
+        Tags a contiguous run of locations.
+
+        Args:
+            start (int): Index of the first location in the map.
+            locs (list): The locations.
+            now (float): UNIX time of the run.
+
+        Returns:
+            tuple: Tags per location (None where tagging failed), attribute sets and
+                (index, error) pairs in location order.
+        """
+        results = []
+        attr_sets = defaultdict(set)
+        errors = []
+
+        for i, item in enumerate(locs, start):
+            try:
+                tags, attrs = self.tag(i, item, now)
+            except Exception as e:
+                results.append(None)
+                errors.append((i, e))
+                if isinstance(e, SVMap.CacheError):
+                    break
+                continue
+
+            results.append(tags)
+            for attr_name, value in attrs:
+                attr_sets[attr_name].add(value)
+
+        return results, dict(attr_sets), errors
+
+    def tz_datestring(self, lat, lng, unix_time, roundt=False, fmt=None):
+        """
+        Generates a timezone-aware date string.
+
+        Args:
+            lat (float): The latitude.
+            lng (float): The longitude.
+            unix_time (float): The UNIX timestamp.
+            roundt (bool): Whether to round the time.
+            fmt (str): Format to use instead of the one tags are written in.
+
+        Returns:
+            str: The generated date string.
+        """
+        timezone_str = self.tf.timezone_at(lng=lng, lat=lat) if self.args.time else None
+        if timezone_str:
+            q = dt.fromtimestamp(unix_time, timezone(timezone_str))
+            if roundt:
+                discard = timedelta(minutes=q.minute % roundt,
+                             seconds=q.second,
+                             microseconds=q.microsecond)
+                q -= discard
+                if discard >= timedelta(minutes=roundt/2):
+                    q += timedelta(minutes=roundt)
+        else:
+            lt = localtime(unix_time)
+            q = dt(lt.tm_year, lt.tm_mon, lt.tm_mday, lt.tm_hour, lt.tm_min, lt.tm_sec)
+
+        return q.strftime(fmt or self.datestring or '%Y-%m-%d %H:%M')
+
+    def datestring(self):
+        """
+        Returns the appropriate date format string.
+
+        Returns:
+            str: The date format string.
+        """
+        if self.args.time and not self.args.date:
+            return '%H:%M'
+        elif self.args.date and not self.args.time:
+            return '%Y-%m-%d'
+        elif self.args.date and self.args.time:
+            return '%Y-%m-%d %H:%M'
+        elif self.args.month:
+            return '%Y-%m'
+        elif self.args.year:
+            return '%Y'
+        else:
+            return None
+
+
+TAG_WORKER = None
+
+def init_tag_worker(args, cached, geographical):
+    global TAG_WORKER
+    TAG_WORKER = LocationTagger(args, cached, geographical)
+
+def tag_shard(start, locs, now):
+    return TAG_WORKER.tag_shard(start, locs, now)
+
+
+def width_bins(low, high, count):
+    """
+    Splits [low, high] into at most count integer ranges of one round width (1, 2 or 5 times a
+    power of ten), aligned to multiples of it.
+
+    Returns:
+        list: (low, high) ranges, in order.
+    """
+    width = 1
+    while True:
+        for step in (1, 2, 5):
+            start = low // (width * step) * (width * step)
+            if (high - start) // (width * step) + 1 <= count:
+                width *= step
+                return [(bound, bound + width - 1) for bound in range(start, high + 1, width)]
+        width *= 10
+
+
+def quantile_bins(counts, count):
+    """
+    Splits values into at most count ranges holding about as many locations each. A value is never
+    split across ranges, so heavily repeated values can leave fewer ranges.
+
+    Args:
+        counts (dict): Value -> number of locations.
+        count (int): Maximum number of ranges.
+
+    Returns:
+        list: (low, high) ranges of the values present, in order.
+    """
+    total = sum(counts.values())
+    ranges, seen = [], 0
+    for value in sorted(counts):
+        # Range of the location at the middle of this value's run
+        index = min(count - 1, int((seen + counts[value] / 2) * count / total))
+        if ranges and ranges[-1][0] == index:
+            ranges[-1][2] = value
+        else:
+            ranges.append([index, value, value])
+        seen += counts[value]
+    return [(low, high) for _, low, high in ranges]
+
+
 class MetaTag:
     """
     Class for handling tagging of SVMap metadata.
+
+    Args:
+        map_obj (SVMap): The map to tag.
+        arg_parser (ArgParser): The parsed arguments.
+        workers (int): Processes to shard tagging across (0 for one per CPU). Output is identical
+            to tagging in a single process.
     """
+    PARALLEL_MIN = 20000  # Below this, process startup outweighs the tagging work
+    # Tag layout of the numeric attributes, to rebuild binned tags in the same style
+    NUMERIC_TAGS = {'altitudes': '{} #', 'azimuths': '{} @', 'cloudCover': 'CLOUD {}', 'elevation': 'ELEV {}'}
+    NUMBER = re.compile(r'-?\d+')
 
-    def __init__(self, map_obj, arg_parser): 
+    def __init__(self, map_obj, arg_parser, workers=1): 
         self.arg_parser = arg_parser
         self.args = arg_parser.args
         self.map = map_obj
+        self.workers = workers or os.cpu_count() or 1
 
         self.start_time = time()
         self.attr_sets = {
@@ -192,8 +561,8 @@ class MetaTag:
             'elevation': set()
         }
         
-        self.tf = TimezoneFinder()
-        self.datestring = self.datestring()
+        self.tagger = LocationTagger(self.args, arg_parser.cached, arg_parser.group_true('geographical'))
+        self.datestring = self.tagger.datestring
         self.offset = 0
 
         self.color = SVMap.COLORS[self.args.color]
@@ -209,101 +578,19 @@ class MetaTag:
             now = dt.now().timestamp()
 
             # Data processing
-            for i, item in enumerate(self.map.locs):
-                try:
-                    lat, lng = float(item['lat']), float(item['lng'])
-                    tags = []
+            if self.workers > 1 and len(self.map.locs) >= self.PARALLEL_MIN:
+                shards = self.tag_parallel(now)
+            else:
+                shards = [self.tagger.tag_shard(0, self.map.locs, now)]
 
-                    if self.arg_parser.args.date or self.arg_parser.args.time:
-                        unix_time = float(item['timestamp'])
-                        if not (now - (20 * 365 * 24 * 60 * 60) <= unix_time <= now):
-                            raise ValueError(f"Invalid UNIX time at line {i+2}: {unix_time}")
-                        
-                        timestamp = self.tz_datestring(lat, lng, unix_time, self.args.round)
-                        tags.append(timestamp)
-                        self.attr_sets['dates'].add(timestamp)
-                    elif self.arg_parser.args.month or self.arg_parser.args.year:
-                        if item.get('imageDate'):
-                            tags.append(item.get('imageDate'))
-                        elif item.get('extra').get('panoDate'):
-                            tags.append(item.get('extra').get('panoDate'))
-
-                    if self.arg_parser.group_true('geographical'):
-                        tags.extend(filter(None, [
-                            item.get('country') if self.args.country else None,
-                            item.get('state') if self.args.state else None,
-                            item.get('locality') if self.args.locality else None
-                        ]))
-
-                    if self.args.drivingdirection:
-                        driving_direction = item.get('drivingDirection')
-                        if driving_direction:
-                            tags.append("DRIVING " + Classifier.direction(driving_direction))
-
-                    if self.args.solar or self.args.SOLAR:
-                        try:
-                            altitude = round(float(item['altitude']))
-                            azimuth = round(float(item['azimuth']))
-                            altitude_class = str(item['altitudeClass'])
-                            azimuth_class = str(item['azimuthClass'])
-                            sun_event = item['sunEvent']
-
-                            if self.args.solar:
-                                tags.extend([f"#{altitude_class}", f"@{azimuth_class}"])
-                                if sun_event:
-                                    tags.append(sun_event)
-                            if self.args.SOLAR:
-                                altitude_str, azimuth_str = f"{altitude} #", f"{azimuth} @"
-                                tags.extend([altitude_str, azimuth_str])
-                                self.attr_sets['altitudes'].add(altitude_str)
-                                self.attr_sets['azimuths'].add(azimuth_str)
-                        except KeyError:
-                            if self.arg_parser.cached:
-                                raise SVMap.CacheError()
-                            else:
-                                raise ValueError("Solar data not found")
-
-                    if self.args.clouds or self.args.CLOUDS:
-                        cloud_cover = item.get('cloudCover')
-                        if self.args.clouds and 'cloudCoverClass' in item:
-                            tags.append(str(item['cloudCoverClass']))
-                        if self.args.CLOUDS and cloud_cover:
-                            cloud_tag = f"CLOUD {cloud_cover}"
-                            tags.append(cloud_tag)
-                            self.attr_sets['cloudCover'].add(cloud_tag)
-
-                    if self.args.precipitation and 'precipitation' in item:
-                        precipitation = item['precipitation']
-                        if precipitation and precipitation > 0:
-                            tags.append(f"PRCP {precipitation}")
-
-                    if self.args.snow and 'snowDepth' in item:
-                        snow_depth = item['snowDepth']
-                        if snow_depth and snow_depth > 0:
-                            tags.append(f"SNOW {snow_depth}")
-
-                    if self.args.elevation and 'elevation' in item:
-                        elevation = item['elevation']
-                        if elevation:
-                            elevation_str = f"ELEV {round(float(elevation))}"
-                            tags.append(elevation_str)
-                            self.attr_sets['elevation'].add(elevation_str)
-
-                    if tags:
-                        if verify_extra(item, tags=True):
-                            item["extra"]["tags"].extend(tags)
-                        else:
-                            item = force_extra(item, tags=tags)
-                            item["extra"]["tags"] = tags
-
-                except SVMap.CacheError as e:
-                    logging.error(e)
-                    exit(1)
-                except Exception as e:
-                    logging.error(e)
+            start = 0
+            for results, attr_sets, errors in shards:
+                self.apply_shard(start, results, attr_sets, errors)
+                start += len(results)
             
             logging.info("Purge map")
             self.map.purge()
+            keys = self.bin_tags() if self.args.bins else {}
             if not CONFIG['mapMakingAppStyles']:
                 return
 
@@ -314,83 +601,121 @@ class MetaTag:
                     logging.info(f"Order tags - {attr_name}")
                     if attr_name == 'dates':
                         sortby = 'date'
-                    elif attr_name == 'altitudes' or attr_name == 'azimuths' or attr_name == 'elevation' or attr_name == 'cloudCover':
+                    elif attr_name in self.NUMERIC_TAGS:
                         sortby = 'parseint'
                     else:
                         sortby = "lexicographic"
                         
-                    self.order_tags(attr_set, sortby=sortby)
+                    self.order_tags(attr_set, sortby=sortby, keys=keys.get(attr_name))
 
         except Exception as e:
             logging.error(f'Error: {e}')
             exit(1)
 
-    def tz_datestring(self, lat, lng, unix_time, roundt=False):
+    def tag_parallel(self, now):
         """
-        Generates a timezone-aware date string.
+        Tags the map in shards across a process pool.
 
         Args:
-            lat (float): The latitude.
-            lng (float): The longitude.
-            unix_time (float): The UNIX timestamp.
-            roundt (bool): Whether to round the time.
+            now (float): UNIX time of the run.
 
-        Returns:
-            str: The generated date string.
+        Yields:
+            tuple: Shard results in map order (see LocationTagger.tag_shard).
         """
-        timezone_str = self.tf.timezone_at(lng=lng, lat=lat) if self.args.time else None
-        if timezone_str:
-            q = dt.fromtimestamp(unix_time, timezone(timezone_str))
-            if roundt:
-                discard = timedelta(minutes=q.minute % roundt,
-                             seconds=q.second,
-                             microseconds=q.microsecond)
-                q -= discard
-                if discard >= timedelta(minutes=roundt/2):
-                    q += timedelta(minutes=roundt)
-        else:
-            lt = localtime(unix_time)
-            q = dt(lt.tm_year, lt.tm_mon, lt.tm_mday, lt.tm_hour, lt.tm_min, lt.tm_sec)
+        locs = self.map.locs
+        # Several shards per worker, so one slow shard does not idle the rest of the pool
+        size = -(-len(locs) // (self.workers * 8))
+        starts = range(0, len(locs), size)
 
-        return q.strftime(self.datestring if self.datestring else '%Y-%m-%d %H:%M')
+        logging.info(f"Tagging {len(locs)} locations across {self.workers} processes")
+        with ProcessPoolExecutor(self.workers, initializer=init_tag_worker,
+                                 initargs=(self.args, self.tagger.cached, self.tagger.geographical)) as executor:
+            yield from executor.map(tag_shard, starts, (locs[s:s + size] for s in starts), repeat(now))
 
-    def datestring(self):
+    def apply_shard(self, start, results, attr_sets, errors):
         """
-        Returns the appropriate date format string.
-
-        Returns:
-            str: The date format string.
+        Writes the tags of one shard to its locations and merges its attribute sets.
         """
-        if self.args.time and not self.args.date:
-            return '%H:%M'
-        elif self.args.date and not self.args.time:
-            return '%Y-%m-%d'
-        elif self.args.date and self.args.time:
-            return '%Y-%m-%d %H:%M'
-        elif self.args.month:
-            return '%Y-%m'
-        elif self.args.year:
-            return '%Y'
-        else:
-            return None
+        for i, e in errors:
+            logging.error(e)
+            if isinstance(e, SVMap.CacheError):
+                exit(1)
+
+        for item, tags in zip(self.map.locs[start:start + len(results)], results):
+            if tags:
+                if verify_extra(item, tags=True):
+                    item["extra"]["tags"].extend(tags)
+                else:
+                    item = force_extra(item, tags=tags)
+                    item["extra"]["tags"] = tags
+
+        for attr_name, attr_set in attr_sets.items():
+            self.attr_sets[attr_name] |= attr_set
 
     def generate_random_color(self):
         """Generate a random color based on the base color."""
         return [int(comp * (0.5 + 0.5 * random.random())) for comp in self.color]
 
-    def order_tags(self, attribute_set, sortby='date'):
+    def bin_tags(self):
+        """
+        Replaces the numeric tags of each attribute by at most `--bins` ranges ("ELEV 1800 to 1899"),
+        so the legend stays the same size however many distinct values the map has. Ranges have
+        equal width (on round numbers), or with `--bin-mode quantile` hold about as many locations
+        each.
+
+        Returns:
+            dict: Attribute -> {range tag: numeric sort key}, for order_tags.
+        """
+        mappings, keys = {}, {}
+        for attr_name, template in self.NUMERIC_TAGS.items():
+            attr_set = self.attr_sets.get(attr_name)
+            if not attr_set:
+                continue
+            values = {tag: int(self.NUMBER.search(tag).group()) for tag in attr_set}
+            if self.args.bin_mode == 'quantile':
+                counts = defaultdict(int)
+                for loc in self.map.locs:
+                    for tag in loc.get('extra', {}).get('tags') or ():
+                        if tag in values:
+                            counts[values[tag]] += 1
+                ranges = quantile_bins(counts, self.args.bins)
+            else:
+                ranges = width_bins(min(values.values()), max(values.values()), self.args.bins)
+
+            # Ranges are sorted, so each value's range is found by bisection on the lower bounds
+            lows = [low for low, _ in ranges]
+            mapping = {}
+            for tag, value in values.items():
+                low, high = ranges[bisect_right(lows, value) - 1]
+                mapping[tag] = template.format(f"{low} to {high}" if low != high else low)
+                keys.setdefault(attr_name, {})[mapping[tag]] = low
+            mappings.update(mapping)
+            self.attr_sets[attr_name] = set(mapping.values())
+
+        for loc in self.map.locs:
+            tags = loc.get('extra', {}).get('tags')
+            if tags:
+                loc['extra']['tags'] = list(dict.fromkeys(mappings.get(tag, tag) for tag in tags))
+        return keys
+
+    def order_tags(self, attribute_set, sortby='date', keys=None):
         """
         Orders the tags based on the specified attribute set and sort order.
         Args:
             attribute_set (set): The set of attributes to be ordered.
             sortby (str): The sort order.
+            keys (dict): Precomputed sort key of each tag, instead of parsing them.
         Returns:
             list: A list containing the start value, end value, and offset.
         """
-        if sortby == 'date':
-            sli = sorted(list(attribute_set), key=lambda i: dt.strptime(i, self.datestring) if self.datestring else i)
+        if keys is not None:
+            sli = sorted(sorted(attribute_set), key=keys.__getitem__)
+        elif sortby == 'date':
+            sli = sorted(sorted(attribute_set), key=lambda i: dt.strptime(i, self.datestring) if self.datestring else i)
         elif sortby == 'parseint':
-            sli = sorted(list(attribute_set), key=lambda i: int(re.search(r'-?\d+', i).group()) if int(re.search(r'-?\d+', i).group()) else i)
+            # Parsed once per tag rather than on every comparison
+            keys = {i: int(self.NUMBER.search(i).group()) for i in attribute_set}
+            sli = sorted(sorted(attribute_set), key=keys.__getitem__)
         else:
             sli = sorted(list(attribute_set))
         start = sli[0]
@@ -413,18 +738,36 @@ class MetaTag:
         return [start, end, len(sli)]
 
 class MetaFetchParser:
-    def __init__(self, map_obj, args, radius=30, chunk_size=15):
+    def __init__(self, map_obj, args, radius=30, chunk_size=15, store=None):
         # Constants
         self.RADIUS = radius
         self.CHUNK_SIZE = chunk_size
+        self.TIME_KEY = '%Y-%m-%d %H:%M %z'  # Local time of a -t tag, in a form that never decreases
         
         # Variables
         self.map = map_obj
         self.err = 0
         self.arg_parser = args
         self.args = args.args
+        self.store = store
+        self.tagger = LocationTagger(self.args, False, False)  # Rounds and localizes dates as the tags will
+        self.planner = Planner(args, bool(CONFIG['geocode']['boundaries']), store, self.timestamp_outputs)
+        self.checkpoint = None  # Called as stages make progress
+        self.budget = None  # TimeBudget of the run, if it has one
+
+        self.STAGES = {
+            self.fetch_meta: 'fetch_meta',
+            self.timestamp: 'timestamp',
+            self.solar: 'solar'
+        }
+        self.CACHE_NAMES = {
+            'fetch_meta': 'meta',
+            'timestamp': 'timestamp',
+            'solar': 'solar'
+        }
 
         self.PROCESS_NAMES = {
+            self.geocode: "Geocoding",
             self.fetch_meta: "Metadata fetch",
             self.timestamp: "Timestamp",
             self.solar: "Solar",
@@ -432,18 +775,35 @@ class MetaFetchParser:
         }
 
 
+    def timestamp_outputs(self, loc, unix_time):
+        """
+        Values of a run derived from the timestamp of a location, besides solar position: the
+        (rounded) local date and time the tag is taken from and the hour weather is matched at.
+        Each never decreases over time, so equal values at both ends of an interval hold within it.
+        """
+        outputs = []
+        if self.args.date or self.args.time:
+            # With -t the local time is compared with its date and UTC offset, not as tagged: a bare
+            # hour repeats every day, and local time goes back when DST ends
+            fmt = self.TIME_KEY if self.args.time else None
+            outputs.append(self.tagger.tz_datestring(float(loc['lat']), float(loc['lng']), unix_time, self.args.round, fmt))
+        if self.planner.weather_params:
+            outputs.append(round(unix_time / 3600))
+        return tuple(outputs)
+
     async def timestamp(self, loc, progress):
         try:
             lat, lng = loc['lat'], loc['lng']
             month = None
             loc = force_extra(loc, tags=True)
+            interval = timestamp_interval(loc)
 
             if loc.get('imageDate'):
                 month = loc['imageDate']
             elif loc.get('extra').get('panoDate'):
                 month = loc['extra']['panoDate']
-            elif loc.get('timestamp'):
-                month = dt.fromtimestamp(loc['timestamp'], utc).strftime('%Y-%m')
+            elif interval:
+                month = dt.fromtimestamp(sum(interval) / 2, utc).strftime('%Y-%m')
             elif self.args.load and loc.get('extra').get('tags'):
                 tags = loc['extra']['tags']
                 months = [month.lower() for month in calendar.month_name[1:]] + [month.lower() for month in calendar.month_abbr[1:]]
@@ -456,10 +816,26 @@ class MetaFetchParser:
                     month_number = str(dt.strptime(matching_month, '%b' if len(matching_month) == 3 else '%B').month).zfill(2)
                     month = matching_year + "-" + month_number
                 
+            if not self.planner.timestamp_settled(loc) and self.store and not self.args.no_cache_in:
+                stored = self.store.get(loc.get('panoId'))
+                hit = bool(stored and stored.get('timestamp') and self.planner.timestamp_settled({**stored, 'lat': lat, 'lng': lng}))
+                METRICS.cache('panoStore', hit)
+                if hit:
+                    loc['timestamp'] = stored['timestamp']
+                    loc['timestampAccuracy'] = stored.get('timestampAccuracy', 0)
+
             if month:
-                if not loc.get('timestamp'):
-                    timestamp = await find_accurate_timestamp(lat, lng, month, self.RADIUS, self.args.accuracy)
+                if not self.planner.timestamp_settled(loc):
+                    # A timestamp found for coarser tags is refined within its interval
+                    interval = timestamp_interval(loc)
+                    timestamp, width = await find_accurate_timestamp(
+                        lat, lng, month, self.RADIUS, self.args.accuracy, CONFIG['endpoints']['singleImageSearch'],
+                        lambda start, end: self.planner.interval_settled(loc, start, end), interval
+                    )
                     loc['timestamp'] = timestamp
+                    loc['timestampAccuracy'] = width
+                    if self.store and timestamp:
+                        self.store.put({'panoId': loc.get('panoId'), 'timestamp': timestamp, 'timestampAccuracy': width})
             else:
                 raise Exception("Unable to date image "+str(lat), str(lng))
 
@@ -475,124 +851,165 @@ class MetaFetchParser:
     async def fetch_meta(self, loc, progress):
         lat, lng = loc['lat'], loc['lng']
 
-        if (
-            (('imageDate' in loc or 'timestamp' in loc) or not (self.arg_parser.group_true('temporal') or self.arg_parser.group_true('terrestrial'))) and
-            ('country' in loc or not self.args.country) and
-            (not self.args.drivingdirection or loc.get('drivingDirection') is not None)
-        ) and not self.args.no_cache_in:
-            progress.update(1)
-            return loc
+        try:
+            stored = None
+            if self.store and not self.args.no_cache_in:
+                stored = self.store.lookup(lat, lng, self.RADIUS, loc.get('panoId'))
+                METRICS.cache('panoStore', stored is not None and 'imageDate' in stored)
+            if stored is not None and 'imageDate' in stored:
+                self.apply_meta(loc, stored)
+                progress.update(1)
+                return loc
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                imagePayload = f"""
+            imagePayload = f"""
+            [
+                ["apiv3", null, null, null, "US", null, null, null, null, null],
                 [
-                    ["apiv3", null, null, null, "US", null, null, null, null, null],
-                    [
-                        [null, null, {lat}, {lng}],
-                        {self.RADIUS}
-                    ],
+                    [null, null, {lat}, {lng}],
+                    {self.RADIUS}
+                ],
+                [
+                    null,
+                    ["en", "US"],
+                    null,
+                    null,
+                    null,
+                    null,
+                    null,
+                    null,
+                    [2],
+                    null,
                     [
-                        null,
-                        ["en", "US"],
-                        null,
-                        null,
-                        null,
-                        null,
-                        null,
-                        null,
-                        [2],
-                        null,
                         [
-                            [
-                                [2, true, 2]
-                            ]
+                            [2, true, 2]
                         ]
-                    ],
-                    [
-                        [2, 6]
                     ]
+                ],
+                [
+                    [2, 6]
                 ]
-                """
-
-                async with session.post(
-                    'https://maps.googleapis.com/$rpc/google.internal.maps.mapsjs.v1.MapsJsInternalService/SingleImageSearch',
-                    headers={'content-type': 'application/json+protobuf'},
-                    data=imagePayload,
-                ) as response:
-                    res = await response.text()
-                    loads = json.loads(res)
-                    
-                    # Driving direction
-                    try:
-                        loc['drivingDirection'] = loads[1][5][0][3][0][4][2][2][0]
-                    except IndexError:
-                        loc['drivingDirection'] = None
-
-                    # Elevation
-                    try:
-                        loc['elevation'] = loads[1][5][0][3][0][2][2][1][0]
-                    except IndexError:
-                        loc['elevation'] = None
-
-                    # Country
-                    try:
-                        country = loads[1][5][0][1][4]
-                    except IndexError:
-                        country = None
-
-                    # Subdivisions
-                    try:
-                        if loads[1][3][2] is not None and len(loads[1][3][2]) > 1:
-                            subdivision = loads[1][3][2][1][0]
-                        else:
-                            subdivision = loads[1][3][2][0][0] if loads[1][3][2] is not None else None
-                        subdivision = subdivision.split(', ') if subdivision else None
-                    except IndexError:
-                        subdivision = None
-                                            
-                    state = subdivision[-1] if subdivision else None
-                    locality = subdivision[-2] if subdivision and len(subdivision) > 1 else None
+            ]
+            """
+
+            res = await GOVERNOR.request(
+                'POST',
+                CONFIG['endpoints']['singleImageSearch'],
+                'singleImageSearch',
+                headers={'content-type': 'application/json+protobuf'},
+                data=imagePayload,
+            )
 
-                    loc['country'] = country
-                    loc['state'] = state
-                    loc['locality'] = locality
-
-                    # Image date
-                    try:
-                        month = str(loads[1][6][7][0])+"-"+str(loads[1][6][7][1])
-                    except IndexError:
-                        month = None
-                    loc['imageDate'] = month
-
-                    # Pano ID
-                    try:
-                        loc['panoId'] = loads[1][1][1]
-                    except IndexError:
-                        loc['panoId'] = None
-
-                    if self.args.heading:
-                        if self.args.heading == "drivingdirection":
-                            loc['heading'] = loc.get('drivingDirection') or 0
-                        elif ',' in self.args.heading:
-                            try:
-                                heading, pitch = map(int, self.args.heading.split(','))
-                                loc.update({
-                                    'heading': heading % 360,
-                                    'pitch': pitch % 90
-                                })
-                            except:
-                                raise ValueError("Invalid 'heading,pitch' tuple")
+            loads = jsonio.loads(res)
 
-            except Exception as e:
-                logging.error(e)
-                self.err += 1
-                self.map.locs.remove(loc)
-                progress.update(1)
-                return None
+            meta = {}
+
+            # Driving direction
+            try:
+                meta['drivingDirection'] = loads[1][5][0][3][0][4][2][2][0]
+            except IndexError:
+                meta['drivingDirection'] = None
 
+            # Elevation
+            try:
+                meta['elevation'] = loads[1][5][0][3][0][2][2][1][0]
+            except IndexError:
+                meta['elevation'] = None
+
+            # Country
+            try:
+                country = loads[1][5][0][1][4]
+            except IndexError:
+                country = None
+
+            # Subdivisions
+            try:
+                if loads[1][3][2] is not None and len(loads[1][3][2]) > 1:
+                    subdivision = loads[1][3][2][1][0]
+                else:
+                    subdivision = loads[1][3][2][0][0] if loads[1][3][2] is not None else None
+                subdivision = subdivision.split(', ') if subdivision else None
+            except IndexError:
+                subdivision = None
+                                
+            meta['country'] = country
+            meta['state'] = subdivision[-1] if subdivision else None
+            meta['locality'] = subdivision[-2] if subdivision and len(subdivision) > 1 else None
+
+            # Image date
+            try:
+                meta['imageDate'] = str(loads[1][6][7][0])+"-"+str(loads[1][6][7][1])
+            except IndexError:
+                meta['imageDate'] = None
+
+            # Pano ID
+            try:
+                meta['panoId'] = loads[1][1][1]
+            except IndexError:
+                meta['panoId'] = None
+
+            if self.store:
+                self.store.put(meta, lat, lng, self.RADIUS)
+            self.apply_meta(loc, meta)
+
+        except Exception as e:
+            logging.error(e)
+            self.err += 1
+            self.map.locs.remove(loc)
             progress.update(1)
-            return loc
+            return None
+
+        progress.update(1)
+        return loc
+
+    def apply_meta(self, loc, meta):
+        """
+        Copies fetched (or stored) pano metadata onto a location and applies the heading option.
+
+        Args:
+            loc (dict): The location.
+            meta (dict): Pano metadata (drivingDirection, elevation, country, state, locality,
+                imageDate, panoId and optionally timestamp).
+        """
+        for key in ('drivingDirection', 'elevation', 'locality', 'imageDate', 'panoId'):
+            loc[key] = meta.get(key)
+
+        # Keep fields already resolved offline
+        if loc.get('country') is None:
+            loc['country'] = meta.get('country')
+        if loc.get('state') is None:
+            loc['state'] = meta.get('state')
+
+        if self.args.heading:
+            if self.args.heading == "drivingdirection":
+                loc['heading'] = loc.get('drivingDirection') or 0
+            elif ',' in self.args.heading:
+                try:
+                    heading, pitch = map(int, self.args.heading.split(','))
+                    loc.update({
+                        'heading': heading % 360,
+                        'pitch': pitch % 90
+                    })
+                except:
+                    raise ValueError("Invalid 'heading,pitch' tuple")
+
+    def geocode(self, geocoder):
+        """
+        Resolves country and state offline for all locations in one vectorized pass.
+        Unresolved locations are left untouched for the network fetch.
+        """
+        pending = self.planner.pending('geocode', self.map.locs)
+        progress = progress_bar(len(self.map.locs), self.PROCESS_NAMES[self.geocode])
+        progress.update(len(self.map.locs) - len(pending))
+
+        if pending:
+            names = geocoder.reverse([loc['lat'] for loc in pending], [loc['lng'] for loc in pending])
+            for loc, (country, state) in zip(pending, names):
+                if country is not None:
+                    loc['country'] = country
+                if state is not None:
+                    loc['state'] = state
+            progress.update(len(pending))
+        progress.close()
 
     async def solar(self, loc, progress):
         lat, lng = loc['lat'], loc['lng']
@@ -602,15 +1019,15 @@ class MetaFetchParser:
         timestamp = loc['timestamp']
         timestamp_date = dt.fromtimestamp(timestamp, utc)
         try:
-            if not loc.get('altitude') or not loc.get('azimuth'):
+            if loc.get('altitude') is None or loc.get('azimuth') is None:
                 altitude = get_altitude(lat, lng, timestamp_date)
                 azimuth = get_azimuth(lat, lng, timestamp_date)
                 loc['altitude'] = altitude
                 loc['azimuth'] = azimuth
-            elif self.arg_parser.cached:
+            else:
                 altitude = loc['altitude']
                 azimuth = loc['azimuth']
-            if(not loc.get('altitudeClass') or not loc.get('azimuthClass') or not loc.get('sunEvent')):
+            if any(field not in loc for field in ('altitudeClass', 'azimuthClass', 'sunEvent')): # sunEvent is None away from sunrise and sunset
                 loc['altitudeClass'] = Classifier.altitude(altitude)
                 loc['azimuthClass'] = Classifier.direction(azimuth)
                 loc['sunEvent'] = Classifier.sun_event(altitude, azimuth)
@@ -633,154 +1050,718 @@ class MetaFetchParser:
             'precipitation': ['precipitation', 'precipitation'],
             'snow': ['snow_depth', 'snowDepth']
         }
-        requested_params = [
-            param.lower() 
-            for param in endpoints 
-            if getattr(self.arg_parser.args, param.lower(), False) or getattr(self.arg_parser.args, param.upper(), False)
-        ]
+        requested_params = self.planner.weather_params
         METEO_ARGSTRING = ",".join([endpoints[param][0] for param in requested_params])
 
         total_locations = len(self.map.locs)
-        progress = tqdm(total=total_locations, desc=self.PROCESS_NAMES[self.weather])
-
-        if self.arg_parser.cached and (all(endpoints[param][1] in self.map.locs[0] for param in requested_params) or (self.arg_parser.args.CLOUDS and 'cloudCoverClass' in self.map.locs[0])):
-            progress.update(total_locations)
+        progress = progress_bar(total_locations, self.PROCESS_NAMES[self.weather])
+
+        # Only locations missing a requested field are fetched
+        pending = self.planner.pending('weather', self.map.locs)
+        METRICS.cache('weather', True, total_locations - len(pending))
+        METRICS.cache('weather', False, len(pending))
+        progress.update(total_locations - len(pending))
+        if self.budget:
+            pending = self.schedule('weather', pending)
+        if not pending:
+            progress.close()
             return
 
-        chunk_size = 100
-        loc_pool = []
-        request_count = 0
-        METEO_MAX_RATE = (600/chunk_size) # You can also self-host the API https://github.com/open-meteo/open-meteo/blob/main/docs/getting-started.md
-        WEATHER_SEARCH_WINDOW = CONFIG['weatherSearchWindow']
-
-        rate_limiter = AsyncLimiter(max_rate=METEO_MAX_RATE, time_period=60)
-
-        async def process_chunk(latstring, lngstring, datestring, chunk_num, progress):
-            nonlocal request_count
-            request_url = f"https://archive-api.open-meteo.com/v1/archive?latitude={latstring}&longitude={lngstring}&start_date={datestring}&end_date={datestring}&hourly={METEO_ARGSTRING}&timezone=GMT&format=json&timeformat=unixtime"
+        # Nearby and repeat-coverage locations share one coordinate and date range
+        chunks = weather_chunks(pending, CONFIG['weatherSearchWindow'])
+        if self.budget:
+            # Requests answering the most locations first
+            chunks.sort(key=lambda chunk: -sum(len(entry.locs) for entry in chunk))
+            for i, chunk in enumerate(chunks):
+                if not self.budget.admit('weather', sum(len(entry.locs) for entry in chunk)):
+                    self.budget.leave('weather', sum(len(entry.locs) for rest in chunks[i:] for entry in rest))
+                    chunks = chunks[:i]
+                    break
+        started = time()
+        logging.debug(f"Weather: {len(pending)} locations in {sum(len(chunk) for chunk in chunks)} series, {len(chunks)} requests")
+        # Open-Meteo's rate limit is set per host in config.json ("rateLimits").
+        # You can also self-host the API https://github.com/open-meteo/open-meteo/blob/main/docs/getting-started.md
+
+        async def process_chunk(chunk, chunk_num, progress):
+            latstring = ",".join(str(entry.lat) for entry in chunk)
+            lngstring = ",".join(str(entry.lng) for entry in chunk)
+            startstring = ",".join(str(entry.start) for entry in chunk)
+            endstring = ",".join(str(entry.end) for entry in chunk)
+            request_url = f"{CONFIG['endpoints']['openMeteoArchive']}?latitude={latstring}&longitude={lngstring}&start_date={startstring}&end_date={endstring}&hourly={METEO_ARGSTRING}&timezone=GMT&format=json&timeformat=unixtime"
+            size = sum(len(entry.locs) for entry in chunk)
 
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with rate_limiter:
-                        async with session.get(request_url) as response:
-                            request_count += 1
-                            # print(f"Request {request_count} for chunk {chunk_num + 1}")
-                            progress.update(len(latstring.split(',')))
-                            if response.status == 200:
-                                response_data = await response.json()
-                                return response_data
-                            else:
-                                print(f"Request failed for chunk {chunk_num + 1} with status code: {response.status}")
-                                return None
+                res = await GOVERNOR.request('GET', request_url, 'openMeteoArchive')
+                progress.update(size)
+                return jsonio.loads(res)
+            except RequestError as e:
+                progress.update(size)
+                print(f"Request failed for chunk {chunk_num + 1}: {e}")
+                return None
             except Exception as e:
-                progress.update(len(latstring.split(',')))
+                progress.update(size)
                 logging.error(f"Error processing chunk {chunk_num + 1}: {str(e)}")
                 return None
 
-        chunks = []
-        latstring, lngstring, datestring = "", "", ""
-        
-        # Generate chunks (pre-process)
-        for i, loc in enumerate(self.map.locs):
-            lat, lng = loc['lat'], loc['lng']
-            timestamp = loc['timestamp']
-            current_datetime = dt.utcfromtimestamp(timestamp)
-            date = current_datetime.strftime('%Y-%m-%d')
-            
-            latstring += f"{lat},"
-            lngstring += f"{lng},"
-            datestring += f"{date},"
-            
-            if (i + 1) % chunk_size == 0 or i == len(self.map.locs) - 1:
-                chunks.append((latstring[:-1], lngstring[:-1], datestring[:-1]))
-                latstring, lngstring, datestring = "", "", ""
-
         # Gather chunks (process)
         async def process_chunks():
-            tasks = [asyncio.create_task(process_chunk(lat, lng, date, i, progress)) 
-                    for i, (lat, lng, date) in enumerate(chunks)]
+            tasks = [asyncio.create_task(process_chunk(chunk, i, progress)) 
+                    for i, chunk in enumerate(chunks)]
             return await asyncio.gather(*tasks)
 
-        chunk_results = await process_chunks()
+        try:
+            chunk_results = await process_chunks()
+        finally:
+            await GOVERNOR.close()
         progress.close()
+        if self.budget:
+            self.budget.observe('weather', sum(len(entry.locs) for chunk in chunks for entry in chunk), time() - started)
+
+        # Matching (post-process): each series answers the locations of its entry
+        for chunk, chunk_data in zip(chunks, chunk_results):
+            # Failed chunks are None; single-location responses are a bare object
+            if isinstance(chunk_data, dict):
+                chunk_data = [chunk_data]
+            for j, entry in enumerate(chunk):
+                series = chunk_data[j].get('hourly') if chunk_data and j < len(chunk_data) and chunk_data[j] else None
+                for loc in entry.locs:
+                    index = closest_hour(series['time'], loc['timestamp']) if series else None
+                    if index is None:
+                        logging.error(f"No weather data found within the time range for location {loc['lat']}, {loc['lng']}")
+                        continue
+
+                    if 'cloud_cover' in series:
+                        cloud_cover = series['cloud_cover'][index]
+                        loc['cloudCoverClass'] = str(Classifier.cloud_cover_event(cloud_cover))
+                        loc['cloudCover'] = cloud_cover
+                    if 'precipitation' in series:
+                        loc['precipitation'] = series['precipitation'][index]
+                    if 'snow_depth' in series:
+                        loc['snowDepth'] = series['snow_depth'][index]
+
+        if self.checkpoint:
+            self.checkpoint()
+
+
+    def schedule(self, stage, pending):
+        """
+        Orders the locations of a budgeted stage cheapest first, leaving out (for the next run)
+        those an earlier stage didn't get to.
+        """
+        ready = [loc for loc in pending if self.planner.ready(stage, loc)]
+        self.budget.leave(stage, len(pending) - len(ready))
+        return sorted(ready, key=lambda loc: self.priority(stage, loc))
 
-        # Matching (post-process)
-        for chunk_data in chunk_results:
-            for loc in chunk_data:
-                if loc and 'hourly' in loc:
-                    times = loc['hourly']['time']
-                    for time in times:
-                        weather_mapping = {'time': time, 'longitude': loc['longitude'], 'latitude': loc['latitude']}
-                        
-                        if 'cloud_cover' in loc['hourly']:
-                            weather_mapping['cloud_cover'] = loc['hourly']['cloud_cover'][times.index(time)]
-                        
-                        if 'precipitation' in loc['hourly']:
-                            weather_mapping['precipitation'] = loc['hourly']['precipitation'][times.index(time)]
-                        
-                        if 'snow_depth' in loc['hourly']:
-                            weather_mapping['snow_depth'] = loc['hourly']['snow_depth'][times.index(time)]
-                        
-                        loc_pool.append(weather_mapping)
-
-        for i, loc in enumerate(self.map.locs):
-            min_time = loc['timestamp'] - 1800
-            max_time = loc['timestamp'] + 1800
-            min_lng = loc['lng'] - WEATHER_SEARCH_WINDOW
-            max_lng = loc['lng'] + WEATHER_SEARCH_WINDOW
-            min_lat = loc['lat'] - WEATHER_SEARCH_WINDOW
-            max_lat = loc['lat'] + WEATHER_SEARCH_WINDOW
-            
-            filtered_data = [
-                data for data in loc_pool 
-                if min_time <= data['time'] <= max_time and min_lat <= data['latitude'] <= max_lat and min_lng <= data['longitude'] <= max_lng
-            ]
-            
-            if filtered_data:
-                closest_data = min(filtered_data, key=lambda data: abs(data['time'] - loc['timestamp']))
-                # print(f"Closest data for location {i + 1}: {closest_data}")
-                
-                if 'cloud_cover' in closest_data:
-                    cloud_cover = closest_data['cloud_cover']
-                    loc['cloudCoverClass'] = str(Classifier.cloud_cover_event(cloud_cover))
-                    loc['cloudCover'] = cloud_cover
-                if 'precipitation' in closest_data:
-                    loc['precipitation'] = closest_data['precipitation']
-                if 'snow_depth' in closest_data:
-                    loc['snowDepth'] = closest_data['snow_depth']
-            else:
-                logging.error(f"No weather data found within the time range for location {i + 1}")
-
+    def priority(self, stage, loc):
+        """
+        Rank of the expected cost of a location in a stage: answered by the pano store (0), a
+        timestamp refined within a known interval (1), or a full search (2).
+        """
+        store = self.store if not self.args.no_cache_in else None
+        if stage == 'fetch_meta':
+            stored = store.lookup(loc['lat'], loc['lng'], self.RADIUS, loc.get('panoId'), touch=False) if store else None
+            return 0 if stored is not None and 'imageDate' in stored else 2
+        if stage == 'timestamp':
+            stored = store.get(loc.get('panoId'), touch=False) if store else None
+            if stored and self.planner.timestamp_settled({**stored, 'lat': loc['lat'], 'lng': loc['lng']}):
+                return 0
+            return 1 if loc.get('timestamp') else 2
+        return 0
 
     async def bulk_parse(self, func):
-        chunks = [self.map.locs[i:i + self.CHUNK_SIZE] for i in range(0, len(self.map.locs), self.CHUNK_SIZE)]
+        # Only locations the plan still needs go through the stage
+        stage = self.STAGES[func]
+        pending = self.planner.pending(stage, self.map.locs)
+        skipped = len(self.map.locs) - len(pending)
+        METRICS.cache(self.CACHE_NAMES[stage], True, skipped)
+        METRICS.cache(self.CACHE_NAMES[stage], False, len(pending))
+        if self.budget:
+            pending = self.schedule(stage, pending)
+
+        chunks = [pending[i:i + self.CHUNK_SIZE] for i in range(0, len(pending), self.CHUNK_SIZE)]
 
         results = []
-        progress = tqdm(total=len(self.map.locs), desc=self.PROCESS_NAMES[func])
+        progress = progress_bar(len(self.map.locs), self.PROCESS_NAMES[func])
+        progress.update(skipped)
 
-        for chunk in chunks:
-            tasks = [asyncio.create_task(func(loc, progress)) for loc in chunk]
-            chunk_results = await asyncio.gather(*tasks)
-            results.extend([res for res in chunk_results if res is not None])
+        try:
+            for i, chunk in enumerate(chunks):
+                if self.budget and not self.budget.admit(stage, len(chunk)):
+                    self.budget.leave(stage, sum(len(rest) for rest in chunks[i:]))
+                    break
+                started = time()
+                tasks = [asyncio.create_task(func(loc, progress)) for loc in chunk]
+                chunk_results = await asyncio.gather(*tasks)
+                if self.budget:
+                    self.budget.observe(stage, len(chunk), time() - started)
+                results.extend([res for res in chunk_results if res is not None])
+                self.planner.done[stage].update(id(res) for res in chunk_results if res is not None)
+                if self.checkpoint:
+                    self.checkpoint()
+        finally:
+            await GOVERNOR.close()
 
         progress.close()
         if self.err > 0:
-            retained = len(results)
+            retained = len(results) + skipped
             print("Retained:", retained)
             if retained == 0:
                 raise ValueError("No data retained")
 
 
 
+def count_combinations(locs, args):
+    """
+    Counts attribute combinations per key value.
+
+    Args:
+        locs (list): The locations to count.
+        args (Namespace): Extract arguments (key, attr, classify, include_none).
+
+    Returns:
+        tuple: Counts per key value and combination, totals per key value, and the sorted combinations.
+    """
+    results = defaultdict(lambda: defaultdict(int))
+    total_counts = defaultdict(int)
+
+    classifiers = args.classify or ['none'] * len(args.attr)
+    if len(classifiers) != len(args.attr):
+        raise ValueError("Number of classifiers must match number of attributes")
+
+    for coord in locs:
+        key_value = coord.get(args.key)
+        if not key_value:
+            continue
+
+        attr_values = []
+        for attr, classifier in zip(args.attr, classifiers):
+            attr_value = coord.get(attr)
+            if attr_value is None:
+                if args.include_none:
+                    attr_value = "None"
+                else:
+                    break
+            elif classifier.lower() != 'none':
+                attr_value = getattr(Classifier, classifier)(attr_value)
+            attr_values.append(str(attr_value))
+
+        if len(attr_values) == len(args.attr):
+            combined_attr = " - ".join(attr_values)
+            results[key_value][combined_attr] += 1
+            total_counts[key_value] += 1
+
+    all_attr_combinations = set()
+    for attr_counts in results.values():
+        all_attr_combinations.update(attr_counts.keys())
+
+    sorted_attr_combinations = sorted(
+        all_attr_combinations,
+        key=lambda x: (x.count("None"), x)
+    )
+    return results, total_counts, sorted_attr_combinations
+
+
+def extract(map_obj, args):
+    """
+    Builds an attribute table of attribute combinations per key value.
+
+    Args:
+        map_obj (SVMap): The map to extract from.
+        args (Namespace): Extract arguments (key, attr, classify, format, include_none).
+
+    Returns:
+        tuple: The header row and the table rows.
+    """
+    results, total_counts, sorted_attr_combinations = count_combinations(map_obj.locs, args)
+
+    header = [args.key] + sorted_attr_combinations + ['TOTAL']
+    rows = []
+
+    for key_value, attr_counts in results.items():
+        row = [key_value]
+        for attr_combination in sorted_attr_combinations:
+            count = attr_counts[attr_combination]
+            if args.format == 'count':
+                row.append(count)
+            else:  # percent
+                percentage = (count / total_counts[key_value]) * 100 if total_counts[key_value] else 0
+                row.append(f"{percentage:.2f}%")
+        row.append(total_counts[key_value])
+        rows.append(row)
+
+    return header, rows
+
+
+def extract_sample(sample, sizes, args):
+    """
+    Builds an attribute table estimated from a stratified sample, with a confidence interval
+    column after each combination and the sample size of each row.
+
+    Counts are scaled from the sample to the whole key value; the interval is the Wilson
+    interval of the share (see approx.wilson), as counts or percentages.
+
+    Args:
+        sample (dict): Sampled locations per key value.
+        sizes (dict): Locations per key value in the whole map.
+        args (Namespace): Extract arguments (key, attr, classify, format, include_none, confidence).
+
+    Returns:
+        tuple: The header row and the table rows.
+    """
+    locs = [loc for locs in sample.values() for loc in locs]
+    results, total_counts, sorted_attr_combinations = count_combinations(locs, args)
+
+    header = [args.key]
+    for attr_combination in sorted_attr_combinations:
+        header += [attr_combination, f"{attr_combination} {args.confidence:.0%} CI"]
+    header += ['TOTAL', 'SAMPLED']
+    rows = []
+
+    for key_value, attr_counts in results.items():
+        sampled = len(sample[key_value])
+        total = total_counts[key_value] * sizes[key_value] / sampled  # Estimated locations with the attributes
+        row = [key_value]
+        for attr_combination in sorted_attr_combinations:
+            count = attr_counts[attr_combination]
+            low, high = approx.wilson(count, total_counts[key_value], round(total), args.confidence)
+            share = count / total_counts[key_value]
+            if args.format == 'count':
+                row += [round(share * total), f"{round(low * total)} - {round(high * total)}"]
+            else:  # percent
+                row += [f"{share * 100:.2f}%", f"{low * 100:.2f}% - {high * 100:.2f}%"]
+        row += [round(total), sampled]
+        rows.append(row)
+
+    return header, rows
+
+
+def approx_extract(map_obj, argparser):
+    """
+    Draws a stratified sample of a map by the extract key and fetches only what it needs, then
+    estimates the attribute table from it.
+
+    Locations missing the key are fetched first (all of them, to know their stratum); only the
+    sample is fetched for the attributes. Everything fetched is saved to the meta file, so a later
+    larger sample or full tag run doesn't fetch it again.
+
+    Args:
+        map_obj (SVMap): The map to extract from (its meta file if there is one).
+        argparser (ArgParser): Parsed arguments of an extract command.
+
+    Returns:
+        tuple: The header row and the table rows.
+    """
+    args = argparser.args
+    size = approx.parse_size(args.approx)
+    if not 0 < args.confidence < 1:
+        raise ValueError("Invalid confidence value")
+
+    store = None
+    if CONFIG['panoStore']['path']:
+        store = PanoStore(FILE / CONFIG['panoStore']['path'], CONFIG['panoStore']['maxMB'] << 20, CONFIG['panoStore']['coordinatePrecision'])
+
+    def parser_for(fields):
+        # Parser of a tag run fetching the fields (None if no stage fetches them)
+        flags = approx.flags(fields)
+        if not flags:
+            return None
+        return MetaFetchParser(SVMap.from_data({**map_obj.data, 'customCoordinates': []}), ArgParser(['tag', args.file, *flags]), CONFIG['panoFetchRadius'], CONFIG['panoFetchChunkSize'], store)
+
+    def complete(parser, loc):
+        return not any(parser.planner.runs(stage) and parser.planner.needs(stage, loc) for stage in Planner.STAGES[1:])
+
+    def fetch_missing(parser, locs):
+        # Fetches the locations still missing planned fields; whether any were
+        pending = [loc for loc in locs if not complete(parser, loc)] if parser else []
+        if pending:
+            parser.map.locs[:] = pending
+            fetch(parser)
+        return bool(pending)
+
+    fetched = fetch_missing(parser_for([args.key]), [loc for loc in map_obj.locs if not loc.get(args.key)])
+
+    strata = approx.stratify(map_obj.locs, args.key)
+    if not strata:
+        raise ValueError(f"No locations have a {args.key} value")
+    sizes = {key_value: len(locs) for key_value, locs in strata.items()}
+
+    attr_parser = parser_for(args.attr)
+    sample = approx.draw(strata, size, attr_parser and (lambda loc: complete(attr_parser, loc)))
+    sampled = [loc for locs in sample.values() for loc in locs]
+    print(f"Sampled {len(sampled)} of {sum(sizes.values())} locations in {len(sample)} strata")
+    fetched = fetch_missing(attr_parser, sampled) or fetched
+    if store:
+        store.close()
+
+    if fetched:
+        if not CONFIG['keepUnknownFields']:
+            map_obj.purge(SVMap.KNOWN_FIELDS)
+        map_obj.save(Path(f"{FOLDERS['meta']['path']}/{map_stem(argparser.filepath)}{MAP_SUFFIX}").absolute())
+
+    return extract_sample(sample, sizes, args)
+
+
+def coordinates(value, count, option):
+    """
+    Parses a comma-separated list of numbers given to a query option.
+    """
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise ValueError(f"{option} takes {count} comma-separated numbers, got '{value}'")
+    return numbers
+
+
+def query(argparser):
+    """
+    Selects locations of a map (its meta file if there is one) by bounding box, distance and
+    attribute predicates, using the map's index in the meta folder, and saves them as a new map.
+    Locations keep the order of the map, except with --nearest (nearest first).
+
+    Args:
+        argparser (ArgParser): Parsed arguments of a query command.
+    """
+    args = argparser.args
+    if (args.radius is not None or args.nearest is not None) and not args.near:
+        raise ValueError("--radius and --nearest need --near")
+    if args.near and args.radius is None and args.nearest is None:
+        raise ValueError("--near needs --radius or --nearest")
+
+    source = argparser.cached_file if argparser.cached else argparser.filepath
+    index = MapIndex(source, FOLDERS['meta']['path'])
+    positions = index.query(
+        bbox=coordinates(args.bbox, 4, '--bbox') if args.bbox else None,
+        near=coordinates(args.near, 2, '--near') if args.near else None,
+        radius=args.radius,
+        nearest=args.nearest,
+        where=args.where
+    )
+
+    output = Path(args.output or f"{FOLDERS['base']['path']}/{map_stem(argparser.filepath)}-query{MAP_SUFFIX}").absolute()
+    if output in (argparser.filepath.absolute(), Path(source).absolute()):
+        raise ValueError("Output path must differ from the queried map")
+    print(f"{len(positions)} of {index.size} locations match")
+    index.subset(positions).save(output)
+
+
+def save_report(file):
+    """
+    Writes the run's metrics report, and the Prometheus textfile if configured.
+    """
+    if CONFIG['metrics']['report']:
+        METRICS.save(file)
+    if CONFIG['metrics']['prometheusTextfile']:
+        METRICS.save_prometheus(FILE / CONFIG['metrics']['prometheusTextfile'])
+
+
+class Checkpoint:
+    """
+    Periodically publishes a tagged copy of the locations that have finished every stage of a run,
+    so results can be viewed (and used) before the run ends. The file is replaced atomically, and
+    each publication is announced as a "partial" progress event.
+
+    Args:
+        map_obj (SVMap): The map being fetched.
+        argparser (ArgParser): Parsed arguments of the tag command.
+        planner (Planner): The run's planner, which knows what each location still needs.
+        file (Path): The partial tagged file.
+        interval (float): Minimum seconds between publications.
+    """
+    def __init__(self, map_obj, argparser, planner, file, interval):
+        self.map = map_obj
+        self.argparser = argparser
+        self.planner = planner
+        self.file = file
+        self.interval = interval
+        self.last = 0
+        self.published = 0
+
+    def __call__(self):
+        """
+        Publishes the finished locations if the interval has passed and there are new ones.
+
+        Returns:
+            bool: Whether the partial file was written.
+        """
+        if time() - self.last < self.interval:
+            return False
+        self.last = time()
+
+        done = [loc for loc in self.map.locs if self.planner.complete(loc)]
+        if len(done) == self.published:
+            return False
+
+        # Tag copies; tagging adds tags and purges fields in place
+        header = copy.deepcopy({key: value for key, value in self.map.data.items() if key != 'customCoordinates'})
+        locs = [
+            {**loc, 'extra': {**loc['extra'], 'tags': list(loc['extra'].get('tags') or [])}} if isinstance(loc.get('extra'), dict) else dict(loc)
+            for loc in done
+        ]
+        partial = SVMap.from_data({**header, 'customCoordinates': locs})
+        try:
+            MetaTag(partial, self.argparser)
+            # Keep the suffixes, which decide the format and compression
+            temp = self.file.with_name('~' + self.file.name)
+            partial.save(temp, quiet=True)
+            os.replace(temp, self.file)
+        except (Exception, SystemExit) as e:
+            logging.warning(f"Failed to write partial output: {e}")
+            return False
+
+        self.published = len(done)
+        logging.info(f"Partial output: {len(done)} of {len(self.map.locs)} locations")
+        notify('partial', file=str(self.file), locations=len(done), total=len(self.map.locs))
+        return True
+
+
+def fetch(mfparser):
+    """
+    Runs the fetch stages of a tag run (geocoding, metadata, timestamps, solar, weather) on the map
+    of a MetaFetchParser, skipping stages and locations the plan doesn't need.
+
+    Args:
+        mfparser (MetaFetchParser): The parser of the map to fetch for.
+    """
+    map_obj = mfparser.map
+    planner = mfparser.planner
+
+    # Offline geocoding
+    if planner.runs('geocode'):
+        logging.info("Offline geocoding")
+        with METRICS.stage('geocode', len(map_obj.locs)):
+            geocoder = Geocoder(FILE / CONFIG['geocode']['boundaries'], CONFIG['geocode']['countryField'], CONFIG['geocode']['stateField'])
+            mfparser.geocode(geocoder)
+
+    # MetaFetch
+    logging.info("Metadata fetch")
+    with METRICS.stage('fetch_meta', len(map_obj.locs)):
+        asyncio.run(mfparser.bulk_parse(mfparser.fetch_meta))
+
+    if planner.runs('timestamp'):
+        logging.info("Temporal parsing")
+
+        try:
+            with METRICS.stage('timestamp', len(map_obj.locs)):
+                asyncio.run(mfparser.bulk_parse(mfparser.timestamp))
+        except Exception as e:
+            logging.error("Temporal data retrieval error: ",e)
+            exit(1)
+    
+    if planner.runs('solar'):
+        logging.info("Solar parsing")
+        try:
+            with METRICS.stage('solar', len(map_obj.locs)):
+                asyncio.run(mfparser.bulk_parse(mfparser.solar))
+        except Exception as e:
+            logging.error("Solar data retrieval error: ",e)
+            exit(1)
+    
+    if planner.runs('weather'):
+        logging.info("Weather parsing")
+        try:
+            with METRICS.stage('weather', len(map_obj.locs)):
+                asyncio.run(mfparser.weather())
+        except Exception as e:
+            logging.error("Weather data retrieval error: ",e)
+            exit(1)
+
+
+def tag(argparser):
+    """
+    Runs the tag pipeline: load, fetch, tag and save one map.
+
+    Args:
+        argparser (ArgParser): Parsed arguments of a tag command.
+
+    Returns:
+        SVMap: The tagged map.
+    """
+    started = monotonic()
+    base_file = argparser.filepath.absolute()
+
+    if not any(getattr(argparser.args, k) for k in argparser.SHORT_ARGS) and not argparser.args.heading and not argparser.args.drivingdirection:
+        raise ValueError("At least one output must be specified")
+    if argparser.args.round and (not argparser.args.time or argparser.args.round > 60 or argparser.args.round <= 1):
+        raise ValueError("Invalid round value")
+    if argparser.args.bins < 0:
+        raise ValueError("Invalid bins value")
+    if argparser.args.time_budget < 0:
+        raise ValueError("Invalid time budget")
+    
+    arg_string = ''.join([argparser.SHORT_ARGS[k] for k, v in vars(argparser.args).items() if v and k in argparser.SHORT_ARGS])
+    if argparser.args.round:
+        arg_string += str(argparser.args.round)
+    if argparser.args.bins:
+        arg_string += f"-{argparser.args.bins}{'q' if argparser.args.bin_mode == 'quantile' else ''}"
+
+    METRICS.info.update({'map': map_stem(base_file), 'command': 'tag', 'args': arg_string, 'cached': argparser.cached})
+
+    # Map
+    with METRICS.stage('load'):
+        if argparser.cached and argparser.args.merge:
+            map_obj = SVMap(argparser.args.file, argparser.args.workers)
+            reused = map_obj.merge(SVMap(argparser.cached_file, argparser.args.workers))
+            logging.info(f"Reused cached metadata for {reused} of {len(map_obj.locs)} locations")
+        elif(argparser.cached):
+            map_obj = SVMap(argparser.cached_file, argparser.args.workers)
+        else:
+            map_obj = SVMap(argparser.args.file, argparser.args.workers)
+    METRICS.info['locations'] = len(map_obj.locs)
+
+    store = None
+    if CONFIG['panoStore']['path']:
+        store = PanoStore(FILE / CONFIG['panoStore']['path'], CONFIG['panoStore']['maxMB'] << 20, CONFIG['panoStore']['coordinatePrecision'])
+    mfparser = MetaFetchParser(map_obj, argparser, CONFIG['panoFetchRadius'], CONFIG['panoFetchChunkSize'], store)
+    planner = mfparser.planner
+
+    partial_file = Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}.partial{MAP_SUFFIX}").absolute()
+    if argparser.args.checkpoint and not argparser.args.meta:
+        mfparser.checkpoint = Checkpoint(map_obj, argparser, planner, partial_file, argparser.args.checkpoint)
+
+    if argparser.args.plan:
+        print_plan(planner.estimate(map_obj, CONFIG), CONFIG['plan']['dailyQuota'])
+        if store:
+            store.close()
+        return map_obj
+
+    if argparser.args.time_budget:
+        # Per-location costs start from the plan, and the clock from the start of the run
+        costs = {row['stage']: row['seconds'] / row['locations'] for row in planner.estimate(map_obj, CONFIG) if row['locations']}
+        stages = [stage for stage in Planner.STAGES if planner.runs(stage)] + ['tag']
+        mfparser.budget = TimeBudget(argparser.args.time_budget, costs, stages, started)
+
+    fetch(mfparser)
+
+    if store:
+        store.close()
+    
+    if not CONFIG['keepUnknownFields']:
+        map_obj.purge(SVMap.KNOWN_FIELDS)
+    
+    if not argparser.args.no_cache_out:
+        with METRICS.stage('save_meta'):
+            map_obj.save(Path(f"{FOLDERS['meta']['path']}/{map_stem(base_file)}{MAP_SUFFIX}").absolute()) # Save to meta folder
+    
+    budget = mfparser.budget
+    if budget:
+        METRICS.info['budget'] = budget.report()
+        if budget.exhausted:
+            complete = sum(planner.complete(loc) for loc in map_obj.locs)
+            left = ', '.join(f"{stage} {count}" for stage, count in budget.left.items() if count)
+            print(f"Time budget reached: {complete} of {len(map_obj.locs)} locations complete; left for the next run: {left}")
+
+    # MetaTag
+    if argparser.args.meta:
+        save_report(Path(f"{FOLDERS['meta']['path']}/{map_stem(base_file)}.report.json"))
+        exit(0)
+    if budget and budget.exhausted:
+        # Only finished locations can be tagged; the rest are fetched by the next run
+        with METRICS.stage('tag', sum(planner.complete(loc) for loc in map_obj.locs)):
+            written = Checkpoint(map_obj, argparser, planner, partial_file, 0)()
+        if written:
+            print(f"Saved to {partial_file}")
+        elif partial_file.exists():
+            partial_file.unlink() # Stale partial of an earlier run
+        save_report(Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}.report.json"))
+        return map_obj
+    with METRICS.stage('tag', len(map_obj.locs)):
+        meta = MetaTag(map_obj, argparser, argparser.args.workers)
+    tiles_file = Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}.tiles.json")
+    if argparser.args.tiles:
+        with METRICS.stage('tiles', len(map_obj.locs)):
+            save_tiles(map_obj, tiles_file, CONFIG['tiles']['maxZoom']) # Save before the map, so the viewer finds it
+    elif tiles_file.exists():
+        tiles_file.unlink() # Stale index of a previous run
+    tagged_file = Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}{MAP_SUFFIX}")
+    overlay_file = Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}.overlay.json")
+    with METRICS.stage('save_tagged'):
+        if CONFIG['taggedOutput'] == 'overlay' and not argparser.args.no_cache_out:
+            save_overlay(map_obj, overlay_file, Path(f"{FOLDERS['meta']['path']}/{map_stem(base_file)}{MAP_SUFFIX}")) # Save overlay to tagged folder
+            stale = tagged_file
+        else:
+            map_obj.save(tagged_file) # Save to tagged folder
+            stale = overlay_file
+    if stale.exists():
+        stale.unlink() # Output of an earlier run in the other taggedOutput mode
+    if partial_file.exists():
+        partial_file.unlink() # Superseded by the full output
+    save_report(Path(f"{FOLDERS['tagged']['path']}/{map_stem(base_file)}-{arg_string}.report.json"))
+
+    end_time = time()
+    runtime = end_time - meta.start_time
+
+    logging.debug(f"Tagging runtime: {round(runtime,5)} seconds")
+    return map_obj
+
+
+def watch(profile, interval, once=False):
+    """
+    Polls the base folder and re-tags maps that are new or whose content changed. Changed maps
+    are merged with their meta cache (tag --merge), so only new or edited locations are fetched.
+    File hashes are kept in <meta folder>/.watch.json across restarts.
+
+    Args:
+        profile (list): Tag arguments to run.
+        interval (float): Seconds between scans.
+        once (bool): Scan once and return.
+    """
+    state_file = FOLDERS['meta']['path'] / '.watch.json'
+    state = json.load(open(state_file)) if state_file.exists() else {}
+    print(f"Watching {FOLDERS['base']['path']} (tag {' '.join(profile)})")
+
+    while True:
+        saved = dict(state)
+        files = {file.name: file for file in sorted(FOLDERS['base']['path'].iterdir())
+                 if file.is_file() and map_suffix(file) in ('.json', '.csv') + NDJSON_SUFFIXES}
+
+        for name, file in files.items():
+            stat = file.stat()
+            entry = state.get(name)
+            # Hash only files whose size or modification time moved
+            if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                continue
+            digest = file_version(file)
+            current = {'hash': digest, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+            if entry and entry['hash'] == digest:
+                state[name] = current
+                continue
+
+            print(f"{'Changed' if entry else 'New'}: {name}")
+            try:
+                METRICS.reset()
+                tag(ArgParser(['tag', str(file), *profile, '--merge']))
+            except (Exception, SystemExit) as e:
+                # Keep the previous hash (if any), so the next scan tries again
+                logging.error(f"Failed to tag {name}: {e}")
+                continue
+            state[name] = current
+
+        for name in set(state) - set(files):
+            del state[name]
+
+        if state != saved:
+            with open(state_file, 'w') as f:
+                json.dump(state, f)
+        if once:
+            return
+        sleep(interval)
+
+
 def main():
     logging.info("Starting process")
     # ArgParser
     argparser = ArgParser()
+    configure_progress(argparser.args.progress_format, argparser.args.progress_fd)
+    if argparser.args.record or argparser.args.replay:
+        GOVERNOR.archive = HttpArchive(argparser.args.record or argparser.args.replay, 'record' if argparser.args.record else 'replay')
+        METRICS.info['archive'] = {'mode': GOVERNOR.archive.mode, 'file': str(GOVERNOR.archive.file)}
 
     FOLDERS['base']['files'] = argparser.filepath.absolute()
-    FOLDERS['meta']['files'] = Path(f"{FOLDERS['meta']['path']}\{argparser.filepath.stem}.json")
-    FOLDERS['tagged']['files'] = list(Path(FOLDERS['tagged']['path']).glob(f"{argparser.filepath.stem}-*.json"))
-    FOLDERS['views']['files'] = list(Path(FOLDERS['views']['path']).glob(f"{argparser.filepath.stem}-*.csv"))
+    FOLDERS['meta']['files'] = meta_file(map_stem(argparser.filepath))
+    FOLDERS['tagged']['files'] = [file for suffix in ('json', 'ndjson', 'json.gz', 'ndjson.gz', 'json.zst', 'ndjson.zst') for file in Path(FOLDERS['tagged']['path']).glob(f"{map_stem(argparser.filepath)}-*.{suffix}")]
+    FOLDERS['views']['files'] = list(Path(FOLDERS['views']['path']).glob(f"{map_stem(argparser.filepath)}-*.csv"))
 
     FOLDERS['base']['exists'] =  argparser.filepath.exists()
     FOLDERS['meta']['exists'] = FOLDERS['meta']['files'].exists()
@@ -788,68 +1769,7 @@ def main():
     FOLDERS['views']['exists'] = len(FOLDERS['views']['files']) > 0
     
     if argparser.args.command == 'tag':
-        if not any(getattr(argparser.args, k) for k in argparser.SHORT_ARGS) and not argparser.args.heading and not argparser.args.drivingdirection:
-            raise ValueError("At least one output must be specified")
-        if argparser.args.round and (not argparser.args.time or argparser.args.round > 60 or argparser.args.round <= 1):
-            raise ValueError("Invalid round value")
-        
-        arg_string = ''.join([argparser.SHORT_ARGS[k] for k, v in vars(argparser.args).items() if v and k in argparser.SHORT_ARGS])
-        if argparser.args.round:
-            arg_string += str(argparser.args.round)
-
-        # Map
-        if(argparser.cached):
-            map_obj = SVMap(argparser.cached_file)
-        else:
-            map_obj = SVMap(argparser.args.file)
-        
-
-        # MetaFetch
-        logging.info("Metadata fetch")
-        mfparser = MetaFetchParser(map_obj, argparser, CONFIG['panoFetchRadius'], CONFIG['panoFetchChunkSize'])
-        asyncio.run(mfparser.bulk_parse(mfparser.fetch_meta))
-
-        if not (argparser.args.month or argparser.args.year) and (argparser.args.date or argparser.args.time) or argparser.group_true('terrestrial') or argparser.args.heading == 'solar':
-            logging.info("Temporal parsing")
-
-            try:
-                asyncio.run(mfparser.bulk_parse(mfparser.timestamp))
-            except Exception as e:
-                logging.error("Temporal data retrieval error: ",e)
-                exit(1)
-        
-        if argparser.args.solar or argparser.args.SOLAR or argparser.args.heading == 'solar':
-            logging.info("Solar parsing")
-            try:
-                asyncio.run(mfparser.bulk_parse(mfparser.solar))
-            except Exception as e:
-                logging.error("Solar data retrieval error: ",e)
-                exit(1)
-        
-        if argparser.args.clouds or argparser.args.CLOUDS or argparser.args.precipitation or argparser.args.snow:
-            logging.info("Weather parsing")
-            try:
-                asyncio.run(mfparser.weather())
-            except Exception as e:
-                logging.error("Weather data retrieval error: ",e)
-                exit(1)
-        
-        if not CONFIG['keepUnknownFields']:
-            map_obj.purge(SVMap.KNOWN_FIELDS)
-        
-        if not argparser.args.no_cache_out:
-            map_obj.save(Path(f"{FOLDERS['meta']['path']}/{FOLDERS['base']['files'].stem}.json").absolute()) # Save to meta folder
-        
-        # MetaTag
-        if argparser.args.meta:
-            exit(0)
-        meta = MetaTag(map_obj, argparser)
-        map_obj.save(Path(f"{FOLDERS['tagged']['path']}/{FOLDERS['base']['files'].stem}-{arg_string}.json")) # Save to tagged folder
-
-        end_time = time()
-        runtime = end_time - meta.start_time
-
-        logging.debug(f"Tagging runtime: {round(runtime,5)} seconds")
+        tag(argparser)
     elif argparser.args.command == 'delete':
         deletion_list = []
         
@@ -906,65 +1826,56 @@ def main():
         else:
             map_obj = SVMap(argparser.args.file)
 
-        results = defaultdict(lambda: defaultdict(int))
-        total_counts = defaultdict(int)
-
-        classifiers = argparser.args.classify or ['none'] * len(argparser.args.attr)
-        if len(classifiers) != len(argparser.args.attr):
-            raise ValueError("Number of classifiers must match number of attributes")
-
-        for coord in map_obj.locs:
-            key_value = coord.get(argparser.args.key)
-            if not key_value:
-                continue
-
-            attr_values = []
-            for attr, classifier in zip(argparser.args.attr, classifiers):
-                attr_value = coord.get(attr)
-                if attr_value is None:
-                    if argparser.args.include_none:
-                        attr_value = "None"
-                    else:
-                        break
-                elif classifier.lower() != 'none':
-                    attr_value = getattr(Classifier, classifier)(attr_value)
-                attr_values.append(str(attr_value))
-            
-            if len(attr_values) == len(argparser.args.attr):
-                combined_attr = " - ".join(attr_values)
-                results[key_value][combined_attr] += 1
-                total_counts[key_value] += 1
+        if argparser.args.approx:
+            header, rows = approx_extract(map_obj, argparser)
+        else:
+            header, rows = extract(map_obj, argparser.args)
 
-        output_filename = f"{FOLDERS['views']['path'] / Path(argparser.args.file).stem} - {argparser.args.key.upper()} to {'+'.join(argparser.args.attr).upper()}.csv"
+        output_filename = f"{FOLDERS['views']['path'] / map_stem(argparser.args.file)} - {argparser.args.key.upper()} to {'+'.join(argparser.args.attr).upper()}{' (approx)' if argparser.args.approx else ''}.csv"
         with open(output_filename, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
-
-            all_attr_combinations = set()
-            for attr_counts in results.values():
-                all_attr_combinations.update(attr_counts.keys())
-
-            sorted_attr_combinations = sorted(
-                all_attr_combinations,
-                key=lambda x: (x.count("None"), x)
-            )
-
-            header = [argparser.args.key] + sorted_attr_combinations + ['TOTAL']
             writer.writerow(header)
-            
-            for key_value, attr_counts in results.items():
-                row = [key_value]
-                for attr_combination in sorted_attr_combinations:
-                    count = attr_counts[attr_combination]
-                    if argparser.args.format == 'count':
-                        row.append(count)
-                    else:  # percent
-                        percentage = (count / total_counts[key_value]) * 100 if total_counts[key_value] else 0
-                        row.append(f"{percentage:.2f}%")
-                row.append(total_counts[key_value])
-                writer.writerow(row)
+            writer.writerows(rows)
 
         print(f"Results written to {output_filename}")
 
+    elif argparser.args.command == 'materialize':
+        output = argparser.args.output or argparser.filepath.with_name(argparser.filepath.name.replace('.overlay.json', MAP_SUFFIX))
+        if Path(output).absolute() == argparser.filepath.absolute():
+            raise ValueError("Output path must differ from the overlay path")
+        materialize(argparser.filepath, FOLDERS['meta']['path'], output)
+
+    elif argparser.args.command == 'shard':
+        map_obj = SVMap(argparser.args.file)
+        folder = Path(argparser.args.output or argparser.filepath.parent)
+        for i, shard in enumerate(shards.split(map_obj, argparser.args.count)):
+            shard.save(folder / (shards.shard_name(map_stem(argparser.filepath), i + 1, argparser.args.count) + argparser.filepath.name[len(map_stem(argparser.filepath)):]))
+
+    elif argparser.args.command == 'merge':
+        files = shards.find_shards(argparser.args.shards or FOLDERS['meta']['path'], map_stem(argparser.filepath))
+        merged = shards.merge(SVMap(argparser.args.file), [SVMap(file) for file in files])
+        merged.save(Path(f"{FOLDERS['meta']['path']}/{map_stem(argparser.filepath)}{MAP_SUFFIX}").absolute())
+        if argparser.args.tag:
+            # Tags the merged meta file, ordering the tag legend over the whole map
+            tag(ArgParser(['tag', argparser.args.file, *shlex.split(argparser.args.tag)]))
+
+    elif argparser.args.command == 'query':
+        query(argparser)
+
+    elif argparser.args.command == 'watch':
+        watch(shlex.split(argparser.args.profile), argparser.args.interval, argparser.args.once)
+
+    elif argparser.args.command == 'convert':
+        # The default output keeps the compression of the input
+        output = Path(argparser.args.output or compress.strip(argparser.filepath).with_suffix(f".{argparser.args.to}{argparser.filepath.suffix if compress.codec_of(argparser.filepath) else ''}"))
+        if output.absolute() == argparser.filepath.absolute():
+            raise ValueError("Output path must differ from the input path")
+        suffixes = {'json': ('.json',), 'ndjson': NDJSON_SUFFIXES, 'csv': ('.csv',)}[argparser.args.to]
+        if map_suffix(output) not in suffixes:
+            raise ValueError(f"Output extension must be one of {', '.join(suffixes)} for {argparser.args.to}")
+
+        SVMap(argparser.args.file, argparser.args.workers).save(output)
+
     elif argparser.args.version:
         from version import __version__
         print(__version__)
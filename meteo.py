@@ -0,0 +1,122 @@
+from bisect import bisect_left
+from datetime import datetime, timezone
+import math
+
+MAX_RANGE_DAYS = 14  # Open-Meteo counts longer ranges as several calls
+MAX_VARIABLES = 10  # Open-Meteo counts requests with more variables as several calls
+
+
+class WeatherEntry:
+    """
+    One coordinate and date range of a multi-location Open-Meteo request, with the locations it
+    answers.
+    """
+    __slots__ = ('lat', 'lng', 'start', 'end', 'locs')
+
+    def __init__(self, lat, lng, start, end, locs):
+        self.lat = lat
+        self.lng = lng
+        self.start = start
+        self.end = end
+        self.locs = locs
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+
+def snap(value, grid):
+    """
+    Rounds a coordinate to the nearest grid line.
+    """
+    return round(round(value / grid) * grid, 6)
+
+
+def nearest_hour_date(timestamp):
+    """
+    UTC date of the hourly value closest to a timestamp (which may fall on the next day).
+    """
+    return datetime.fromtimestamp(round(timestamp / 3600) * 3600, timezone.utc).date()
+
+
+def date_ranges(dates, max_days=MAX_RANGE_DAYS):
+    """
+    Covers sorted dates with as few ranges of at most max_days as possible.
+
+    Returns:
+        list: (start, end) date pairs.
+    """
+    ranges = []
+    for date in dates:
+        if ranges and (date - ranges[-1][0]).days < max_days:
+            ranges[-1][1] = date
+        else:
+            ranges.append([date, date])
+    return [tuple(r) for r in ranges]
+
+
+def weather_chunks(locs, grid, max_days=MAX_RANGE_DAYS, max_entries=100, max_hours=24 * 400, max_url=8000):
+    """
+    Groups locations into as few Open-Meteo requests as possible.
+
+    Locations are snapped to a grid, so nearby and repeat-coverage locations share one
+    coordinate, and the dates of each coordinate are packed into ranges of at most max_days.
+    Each range becomes one entry of a multi-location request; requests are cut by entry count,
+    total hours in the response and URL length.
+
+    Args:
+        locs (list): Locations with a timestamp.
+        grid (float): Grid size in degrees.
+        max_days (int): Longest date range of one entry.
+        max_entries (int): Entries per request.
+        max_hours (int): Hourly values per variable in one response.
+        max_url (int): Approximate URL length limit of the query parameters.
+
+    Returns:
+        list: Requests, each a list of WeatherEntry.
+    """
+    cells = {}
+    for loc in locs:
+        key = (snap(float(loc['lat']), grid), snap(float(loc['lng']), grid))
+        cells.setdefault(key, {}).setdefault(nearest_hour_date(loc['timestamp']), []).append(loc)
+
+    chunks, chunk, hours, length = [], [], 0, 0
+    for (lat, lng), by_date in cells.items():
+        for start, end in date_ranges(sorted(by_date), max_days):
+            entry = WeatherEntry(lat, lng, start, end, [loc for date in sorted(by_date) if start <= date <= end for loc in by_date[date]])
+            entry_length = len(f"{lat},{lng},{start},{end},")
+            if chunk and (len(chunk) >= max_entries or hours + entry.days * 24 > max_hours or length + entry_length > max_url):
+                chunks.append(chunk)
+                chunk, hours, length = [], 0, 0
+            chunk.append(entry)
+            hours += entry.days * 24
+            length += entry_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def weather_quota(chunks, variables):
+    """
+    Open-Meteo API calls a set of requests counts as: one per entry, more for long ranges or
+    many variables.
+    """
+    weight = math.ceil(variables / MAX_VARIABLES)
+    return sum(math.ceil(entry.days / MAX_RANGE_DAYS) * weight for chunk in chunks for entry in chunk)
+
+
+def closest_hour(times, timestamp, tolerance=1800):
+    """
+    Index of the hourly value closest to a timestamp, or None if none is within tolerance.
+
+    Args:
+        times (list): Sorted unix times of the series.
+        timestamp (int): The time to match.
+        tolerance (int): Largest accepted difference in seconds.
+    """
+    i = bisect_left(times, timestamp)
+    candidates = [j for j in (i - 1, i) if 0 <= j < len(times)]
+    if not candidates:
+        return None
+    best = min(candidates, key=lambda j: abs(times[j] - timestamp))
+    return best if abs(times[best] - timestamp) <= tolerance else None
@@ -0,0 +1,355 @@
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import datetime, timezone
+from time import perf_counter, process_time
+import asyncio
+import json
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram (Prometheus layout), so memory stays constant per endpoint.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.BUCKETS) and value > self.BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """
+        Estimates a percentile by linear interpolation within its bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+                return round(min(lower + (upper - lower) * (rank - seen) / n, self.max), 6)
+            seen += n
+        return round(self.max, 6)
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, n in zip(list(self.BUCKETS) + ['+Inf'], self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+        self.statuses = defaultdict(int)
+        self.latency = Histogram()
+        self.wait = Histogram()
+
+    def report(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'failures': self.failures,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'cancelled': self.cancelled,
+            'statuses': dict(self.statuses),
+            'latency': {
+                'mean': round(self.latency.sum / self.latency.count, 6) if self.latency.count else None,
+                'p50': self.latency.percentile(0.5),
+                'p90': self.latency.percentile(0.9),
+                'p99': self.latency.percentile(0.99),
+                'max': round(self.latency.max, 6)
+            },
+            'histogram': {str(bound): n for bound, n in self.latency.cumulative()},
+            'rate_limit_wait_s': round(self.wait.sum, 4)
+        }
+
+
+class EgressStats:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.dropped = 0
+        self.health = 1.0
+
+    def report(self, wall):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'requests_per_s': round(self.requests / wall, 3) if wall else None,
+            'health': round(self.health, 3),
+            'dropped': self.dropped
+        }
+
+
+class StageStats:
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None  # Peak of the whole process so far, as of the end of the stage
+        self.peak_rss_growth = 0  # How much the stage raised that peak
+        self.locations = None
+        self.endpoints = defaultdict(EndpointStats)
+        self.cache = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def report(self):
+        return {
+            'wall_s': round(self.wall, 4),
+            'cpu_s': round(self.cpu, 4),
+            'process_peak_rss_mb': round(self.peak_rss / 2**20, 1) if self.peak_rss else None,
+            'peak_rss_growth_mb': round(self.peak_rss_growth / 2**20, 1) if self.peak_rss else None,
+            'locations': self.locations,
+            'requests': {name: stats.report() for name, stats in self.endpoints.items()},
+            'cache': {
+                name: dict(counts, hit_rate=round(counts['hits'] / (counts['hits'] + counts['misses']), 4) if counts['hits'] + counts['misses'] else None)
+                for name, counts in self.cache.items()
+            }
+        }
+
+
+class Request:
+    """
+    Times one request; set `status` before leaving the block. Exceptions and non-2xx statuses count as errors,
+    except cancellation (the losing copy of a hedged request), which is counted apart.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.status = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.requests += 1
+        if exc_type is not None and issubclass(exc_type, asyncio.CancelledError):
+            self.stats.cancelled += 1
+            return False
+        self.stats.latency.observe(perf_counter() - self.start)
+        if self.status is not None:
+            self.stats.statuses[str(self.status)] += 1
+        if exc_type is not None or (self.status is not None and not 200 <= self.status < 300):
+            self.stats.errors += 1
+        return False
+
+
+class Metrics:
+    """
+    Run instrumentation: per-stage wall/CPU time, peak memory, request counts, latency
+    histograms, retries, errors and cache hit rates. Requests and cache lookups are attributed
+    to the stage that is running.
+    """
+    OTHER = 'other'
+
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self.start_wall = perf_counter()
+        self.start_cpu = process_time()
+        self.stages = {}
+        self.current = self.OTHER
+        self.info = {}
+        self.egresses = defaultdict(EgressStats)
+
+    def reset(self):
+        """
+        Starts a new run, for commands that tag repeatedly in one process.
+        """
+        self.__init__()
+
+    def stats(self, stage=None):
+        stage = stage or self.current
+        if stage not in self.stages:
+            self.stages[stage] = StageStats()
+        return self.stages[stage]
+
+    @contextmanager
+    def stage(self, name, locations=None):
+        """
+        Measures a pipeline stage.
+
+        Args:
+            name (str): The stage name.
+            locations (int): Number of locations handled by the stage.
+        """
+        stats = self.stats(name)
+        previous, self.current = self.current, name
+        wall, cpu, peak = perf_counter(), process_time(), peak_rss()
+        try:
+            yield stats
+        finally:
+            stats.wall += perf_counter() - wall
+            stats.cpu += process_time() - cpu
+            # ru_maxrss only ever grows, so a stage's own share is how much it raised the peak
+            stats.peak_rss = peak_rss()
+            if peak is not None:
+                stats.peak_rss_growth += stats.peak_rss - peak
+            if locations is not None:
+                stats.locations = locations
+            self.current = previous
+
+    def request(self, endpoint):
+        return Request(self.stats().endpoints[endpoint])
+
+    def retry(self, endpoint):
+        self.stats().endpoints[endpoint].retries += 1
+
+    def hedge(self, endpoint, won=False):
+        stats = self.stats().endpoints[endpoint]
+        if won:
+            stats.hedge_wins += 1
+        else:
+            stats.hedges += 1
+
+    def egress(self, name, ok, health):
+        """Records the outcome of an attempt sent through an egress route, and its health after it."""
+        stats = self.egresses[name]
+        stats.requests += 1
+        stats.failures += not ok
+        stats.health = health
+
+    def egress_down(self, name):
+        """Records an egress route being taken out of rotation."""
+        self.egresses[name].dropped += 1
+
+    def failure(self, endpoint):
+        """Records a request that failed for good: no attempt left, or a status not worth retrying."""
+        self.stats().endpoints[endpoint].failures += 1
+
+    def wait(self, endpoint, seconds):
+        """Records time spent waiting on a rate limiter before a request."""
+        self.stats().endpoints[endpoint].wait.observe(seconds)
+
+    def cache(self, name, hit, count=1):
+        self.stats().cache[name]['hits' if hit else 'misses'] += count
+
+    def report(self):
+        peak = peak_rss()
+        wall = perf_counter() - self.start_wall
+        return {
+            **self.info,
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_s': round(wall, 4),
+            'cpu_s': round(process_time() - self.start_cpu, 4),
+            'peak_rss_mb': round(peak / 2**20, 1) if peak else None,
+            'stages': {name: stats.report() for name, stats in self.stages.items()},
+            'egress': {name: stats.report(wall) for name, stats in self.egresses.items()}
+        }
+
+    def save(self, file):
+        """
+        Writes the JSON run report.
+        """
+        try:
+            with open(file, 'w') as f:
+                json.dump(self.report(), f, indent=4)
+            print("Saved report to " + str(file))
+        except OSError:
+            print("Failed to save report to " + str(file))
+
+    def save_prometheus(self, file):
+        """
+        Writes the run in Prometheus textfile-collector format (atomically, as node_exporter expects).
+        """
+        def labels(**kv):
+            escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in {**self.labels(), **kv}.items()) + '}'
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP metatag_{name} {help_text}")
+            lines.append(f"# TYPE metatag_{name} {kind}")
+            lines.extend(f"metatag_{name}{sample_labels} {value}" for sample_labels, value in samples)
+
+        stages = self.stages.items()
+        endpoints = [(stage, name, stats) for stage, s in stages for name, stats in s.endpoints.items()]
+        caches = [(stage, name, counts) for stage, s in stages for name, counts in s.cache.items()]
+
+        metric('stage_wall_seconds', 'gauge', 'Wall time per stage.', [(labels(stage=stage), round(s.wall, 6)) for stage, s in stages])
+        metric('stage_cpu_seconds', 'gauge', 'CPU time per stage.', [(labels(stage=stage), round(s.cpu, 6)) for stage, s in stages])
+        metric('stage_peak_rss_bytes', 'gauge', 'Peak resident memory of the process so far, at the end of each stage.',
+               [(labels(stage=stage), s.peak_rss) for stage, s in stages if s.peak_rss])
+        metric('stage_peak_rss_growth_bytes', 'gauge', 'How much each stage raised the peak resident memory of the process.',
+               [(labels(stage=stage), s.peak_rss_growth) for stage, s in stages if s.peak_rss])
+        metric('requests_total', 'counter', 'Requests per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), stats.requests) for stage, name, stats in endpoints])
+        metric('request_errors_total', 'counter', 'Failed request attempts per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), stats.errors) for stage, name, stats in endpoints])
+        metric('request_failures_total', 'counter', 'Requests that failed after every attempt per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), stats.failures) for stage, name, stats in endpoints])
+        metric('request_retries_total', 'counter', 'Retried requests per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), stats.retries) for stage, name, stats in endpoints])
+        metric('request_hedges_total', 'counter', 'Hedged (duplicated) requests per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), stats.hedges) for stage, name, stats in endpoints])
+        metric('request_hedge_wins_total', 'counter', 'Hedged requests answered first by the duplicate.',
+               [(labels(stage=stage, endpoint=name), stats.hedge_wins) for stage, name, stats in endpoints])
+
+        lines.append("# HELP metatag_request_latency_seconds Request latency per stage and endpoint.")
+        lines.append("# TYPE metatag_request_latency_seconds histogram")
+        for stage, name, stats in endpoints:
+            for bound, n in stats.latency.cumulative():
+                lines.append(f"metatag_request_latency_seconds_bucket{labels(stage=stage, endpoint=name, le=bound)} {n}")
+            lines.append(f"metatag_request_latency_seconds_sum{labels(stage=stage, endpoint=name)} {round(stats.latency.sum, 6)}")
+            lines.append(f"metatag_request_latency_seconds_count{labels(stage=stage, endpoint=name)} {stats.latency.count}")
+
+        metric('rate_limit_wait_seconds', 'counter', 'Time spent waiting on rate limiters per stage and endpoint.',
+               [(labels(stage=stage, endpoint=name), round(stats.wait.sum, 6)) for stage, name, stats in endpoints])
+        metric('egress_requests_total', 'counter', 'Request attempts per egress route.',
+               [(labels(egress=name), stats.requests) for name, stats in self.egresses.items()])
+        metric('egress_failures_total', 'counter', 'Failed request attempts per egress route.',
+               [(labels(egress=name), stats.failures) for name, stats in self.egresses.items()])
+        metric('egress_health', 'gauge', 'Health score (0-1) of each egress route.',
+               [(labels(egress=name), round(stats.health, 6)) for name, stats in self.egresses.items()])
+        metric('cache_hits_total', 'counter', 'Cache hits per stage.', [(labels(stage=stage, cache=name), c['hits']) for stage, name, c in caches])
+        metric('cache_misses_total', 'counter', 'Cache misses per stage.', [(labels(stage=stage, cache=name), c['misses']) for stage, name, c in caches])
+
+        temp = f"{file}.{os.getpid()}.tmp"
+        try:
+            with open(temp, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(temp, file)
+        except OSError:
+            print("Failed to save metrics to " + str(file))
+
+    def labels(self):
+        return {'map': self.info.get('map', '')}
+
+
+METRICS = Metrics()
@@ -0,0 +1,91 @@
+from pathlib import Path
+import hashlib
+
+import jsonio
+from sv_map import SVMap, force_extra
+
+OVERLAY_VERSION = 2  # Tags keyed by location (version 1 was keyed to the meta file's hash)
+
+
+def file_version(file):
+    """
+    Content hash identifying one version of a file.
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def location_key(loc):
+    """
+    Key of a location in an overlay: its pano ID, or its coordinates if it has none.
+    """
+    return loc['panoId'] if loc.get('panoId') else f"{loc['lat']},{loc['lng']}"
+
+
+def save_overlay(map_obj, file, meta_file):
+    """
+    Saves a tagged map as an overlay on its meta file: only the tag list of each location, keyed
+    by location, and the map-level extra (tag legend).
+
+    Args:
+        map_obj (SVMap): The tagged map.
+        file (str): The path to save the overlay to.
+        meta_file (str): The meta file the tags apply to.
+    """
+    overlay = {
+        'version': OVERLAY_VERSION,
+        'name': map_obj.data.get('name'),
+        'meta': Path(meta_file).name,
+        'extra': map_obj.data.get('extra'),
+        'tags': {
+            location_key(loc): loc['extra'].get('tags') if isinstance(loc.get('extra'), dict) else None
+            for loc in map_obj.locs
+        }
+    }
+
+    try:
+        with open(file, 'wb') as f:
+            f.write(jsonio.dumps(overlay))
+        print("Saved to " + str(file))
+    except OSError:
+        print("Failed to save to " + str(file))
+
+
+def materialize(overlay_file, meta_folder, output):
+    """
+    Rebuilds the full map-making.app JSON for an overlay and streams it to a file. The result is
+    the same file a full (non-overlay) tag run writes.
+
+    Args:
+        overlay_file (str): The overlay file.
+        meta_folder (str): The folder holding the meta file the overlay refers to.
+        output (str): The path to save the map to.
+    """
+    with open(overlay_file, 'rb') as f:
+        overlay = jsonio.loads(f.read())
+
+    if overlay.get('version') != OVERLAY_VERSION:
+        raise ValueError(f"Overlay {overlay_file} was written by another version of MetaTag; tag the map again")
+    meta_file = Path(meta_folder) / overlay['meta']
+    if not meta_file.exists():
+        raise FileNotFoundError(f"Meta file {meta_file} not found")
+
+    # Fields other runs add to the meta file don't matter; a location the overlay has no tags for does
+    map_obj = SVMap(meta_file)
+    missing = sum(location_key(loc) not in overlay['tags'] for loc in map_obj.locs)
+    if missing:
+        raise ValueError(f"{missing} locations of {meta_file} are not in the overlay; tag the map again")
+
+    map_obj.purge()
+    for loc in map_obj.locs:
+        tags = overlay['tags'][location_key(loc)]
+        if tags is not None:
+            force_extra(loc)['extra']['tags'] = tags
+    if overlay.get('extra') is not None:
+        map_obj.data['extra'] = overlay['extra']
+
+    map_obj.save_stream(output)
+    return map_obj
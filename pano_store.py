@@ -0,0 +1,172 @@
+from time import time
+import sqlite3
+
+import jsonio
+
+
+class PanoStore:
+    """
+    Metadata store shared by all maps, so panoramas that appear in several maps are fetched once.
+
+    Entries are keyed by panoId, with a second index from rounded coordinates (and search radius)
+    to the panoId found there. The database runs in WAL mode, so parallel runs can read while one
+    writes. Writes and access times are buffered and committed in batches. When the store
+    outgrows its budget, the least recently used panoramas are evicted.
+
+    Args:
+        file (str): Path to the SQLite database.
+        max_bytes (int): Disk budget for stored metadata.
+        precision (int): Decimal places coordinates are rounded to.
+        batch (int): Buffered writes per commit.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS panos (
+            pano_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS panos_accessed ON panos (accessed);
+        CREATE TABLE IF NOT EXISTS coords (
+            lat INTEGER NOT NULL,
+            lng INTEGER NOT NULL,
+            radius INTEGER NOT NULL,
+            pano_id TEXT NOT NULL,
+            PRIMARY KEY (lat, lng, radius)
+        );
+        CREATE INDEX IF NOT EXISTS coords_pano ON coords (pano_id);
+    """
+    ROW_OVERHEAD = 96  # Approximate bytes per entry beyond its JSON (keys, indexes, page slack)
+
+    def __init__(self, file, max_bytes, precision=5, batch=500):
+        self.file = file
+        self.max_bytes = max_bytes
+        self.scale = 10 ** precision
+        self.batch = batch
+
+        self.db = sqlite3.connect(file, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+        self.pending = {}   # pano_id -> data awaiting commit
+        self.coords = {}    # coordinate key -> pano_id awaiting commit
+        self.touched = set()
+
+    def key(self, lat, lng, radius):
+        return (round(float(lat) * self.scale), round(float(lng) * self.scale), int(radius))
+
+    def get(self, pano_id, touch=True):
+        """
+        Returns the stored metadata of a panorama, or None. With touch, the access counts
+        towards keeping it.
+        """
+        if pano_id is None:
+            return None
+        if pano_id in self.pending:
+            return self.pending[pano_id]
+
+        row = self.db.execute("SELECT data FROM panos WHERE pano_id = ?", (pano_id,)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self.touch(pano_id)
+        return jsonio.loads(row[0])
+
+    def lookup(self, lat, lng, radius, pano_id=None, touch=True):
+        """
+        Finds stored metadata by panoId or, failing that, by the rounded coordinates of a search.
+
+        Returns:
+            dict: The stored metadata, or None.
+        """
+        data = self.get(pano_id, touch)
+        if data is not None:
+            return data
+
+        key = self.key(lat, lng, radius)
+        pano_id = self.coords.get(key)
+        if pano_id is None:
+            row = self.db.execute("SELECT pano_id FROM coords WHERE lat = ? AND lng = ? AND radius = ?", key).fetchone()
+            pano_id = row[0] if row else None
+        return self.get(pano_id, touch)
+
+    def put(self, data, lat=None, lng=None, radius=None):
+        """
+        Stores (or updates) the metadata of a panorama, optionally recording the search that found it.
+
+        Args:
+            data (dict): The metadata; must include panoId.
+            lat (float): Latitude searched from.
+            lng (float): Longitude searched from.
+            radius (int): Search radius.
+        """
+        pano_id = data.get('panoId')
+        if pano_id is None:
+            return
+
+        stored = self.get(pano_id) or {}
+        self.pending[pano_id] = {**stored, **data}
+        if lat is not None:
+            self.coords[self.key(lat, lng, radius)] = pano_id
+
+        if len(self.pending) + len(self.coords) >= self.batch:
+            self.flush()
+
+    def touch(self, pano_id):
+        self.touched.add(pano_id)
+        if len(self.touched) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Commits buffered writes and access times, then evicts down to the budget.
+        """
+        if not (self.pending or self.coords or self.touched):
+            return
+        now = time()
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO panos (pano_id, data, size, accessed) VALUES (?, ?, ?, ?)",
+                [(pano_id, text, len(text) + self.ROW_OVERHEAD, now)
+                 for pano_id, text in ((pano_id, jsonio.dumps(data).decode('utf-8')) for pano_id, data in self.pending.items())]
+            )
+            self.db.executemany("INSERT OR REPLACE INTO coords (lat, lng, radius, pano_id) VALUES (?, ?, ?, ?)",
+                                [(*key, pano_id) for key, pano_id in self.coords.items()])
+            self.db.executemany("UPDATE panos SET accessed = ? WHERE pano_id = ?",
+                                [(now, pano_id) for pano_id in self.touched - self.pending.keys()])
+            self.evict()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        self.pending.clear()
+        self.coords.clear()
+        self.touched.clear()
+
+    def evict(self):
+        """
+        Deletes least recently used panoramas until the store is within 90% of its budget.
+        """
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM panos").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = total - self.max_bytes * 0.9
+        freed = 0
+        evicted = []
+        for pano_id, size in self.db.execute("SELECT pano_id, size FROM panos ORDER BY accessed"):
+            evicted.append((pano_id,))
+            freed += size
+            if freed >= target:
+                break
+
+        self.db.executemany("DELETE FROM panos WHERE pano_id = ?", evicted)
+        self.db.executemany("DELETE FROM coords WHERE pano_id = ?", evicted)
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,299 @@
+import math
+from urllib.parse import urlsplit
+
+from meteo import weather_chunks, weather_quota, MAX_VARIABLES
+
+WEATHER_FIELDS = {'clouds': 'cloudCover', 'precipitation': 'precipitation', 'snow': 'snowDepth'}
+SOLAR_FIELDS = ('altitude', 'azimuth', 'altitudeClass', 'azimuthClass', 'sunEvent')
+TIMESTAMP_WINDOW = 33 * 86400  # Search window of find_accurate_timestamp (the image month, padded)
+WEATHER_CHUNK = 100  # Entries per Open-Meteo request
+
+
+class Planner:
+    """
+    Decides which stages a tag run needs, and which locations each stage has to process, from the
+    requested flags and what the map (and pano store) already holds.
+
+    Args:
+        argparser (ArgParser): Parsed arguments of a tag command.
+        geocode (bool): Whether offline geocoding boundaries are configured.
+        store (PanoStore): Shared pano store, if any.
+        outputs (callable): Values derived from a location's timestamp, called as outputs(loc, unix_time);
+            timestamps are searched only until these are certain. None to search to --accuracy.
+    """
+    STAGES = ('geocode', 'fetch_meta', 'timestamp', 'solar', 'weather')
+
+    def __init__(self, argparser, geocode=False, store=None, outputs=None):
+        self.argparser = argparser
+        self.outputs = outputs
+        self.args = argparser.args
+        self.geocode = geocode
+        self.store = store if not self.args.no_cache_in else None
+        self.weather_params = [
+            param for param in WEATHER_FIELDS
+            if getattr(self.args, param, False) or getattr(self.args, param.upper(), False)
+        ]
+        # Locations each stage has processed, by id (with -n, cached data alone doesn't count)
+        self.done = {stage: set() for stage in self.STAGES}
+
+    def runs(self, stage):
+        """
+        Whether the requested flags need a stage at all.
+        """
+        args = self.args
+        if stage == 'geocode':
+            return self.geocode and bool(args.country or args.state)
+        if stage == 'fetch_meta':
+            return True
+        if stage == 'timestamp':
+            return bool(not (args.month or args.year) and (args.date or args.time) or self.argparser.group_true('terrestrial') or args.heading == 'solar')
+        if stage == 'solar':
+            return bool(args.solar or args.SOLAR or args.heading == 'solar')
+        if stage == 'weather':
+            return bool(self.weather_params)
+        raise ValueError(f"Unknown stage {stage}")
+
+    def needs(self, stage, loc):
+        """
+        Whether a location still has to go through a stage.
+        """
+        args = self.args
+        if stage == 'geocode':
+            return args.no_cache_in or loc.get('country') is None or (args.state and loc.get('state') is None)
+        if stage == 'fetch_meta':
+            return args.no_cache_in or not (
+                (('imageDate' in loc or 'timestamp' in loc) or not (self.argparser.group_true('temporal') or self.argparser.group_true('terrestrial'))) and
+                ('country' in loc or not args.country) and
+                ('state' in loc or not args.state) and
+                ('locality' in loc or not args.locality) and
+                (not args.drivingdirection or loc.get('drivingDirection') is not None)
+            )
+        if stage == 'timestamp':
+            return not self.timestamp_settled(loc)
+        if stage == 'solar':
+            return args.heading == 'solar' or not all(field in loc for field in SOLAR_FIELDS)
+        if stage == 'weather':
+            return not all(WEATHER_FIELDS[param] in loc for param in self.weather_params)
+        raise ValueError(f"Unknown stage {stage}")
+
+    def precise(self):
+        """
+        Whether the run needs timestamps to --accuracy (solar position changes with every second).
+        """
+        return self.outputs is None or bool(self.args.solar or self.args.SOLAR or self.args.heading == 'solar')
+
+    def interval_settled(self, loc, start, end):
+        """
+        Whether every output of the run is the same anywhere in a timestamp interval of a location.
+        Outputs are non-decreasing step functions of time, so equal ends mean an equal interval. An
+        interval a day or longer never settles a time of day tag, which repeats daily.
+        """
+        if end - start <= self.args.accuracy:
+            return True
+        if self.args.time and end - start >= 86400:
+            return False
+        return not self.precise() and self.outputs(loc, start) == self.outputs(loc, end)
+
+    def timestamp_settled(self, entry):
+        """
+        Whether a location (or stored pano) has a timestamp precise enough for the run. Its
+        timestampAccuracy is the width of the interval it was found in (0 if not recorded).
+        """
+        interval = timestamp_interval(entry)
+        return interval is not None and self.interval_settled(entry, *interval)
+
+    def timestamp_resolution(self):
+        """
+        Typical interval width, in seconds, a timestamp search of the run ends at.
+        """
+        if self.precise():
+            return self.args.accuracy
+        widths = []
+        if self.args.time:
+            widths.append((self.args.round or 1) * 60)
+        elif self.args.date:
+            widths.append(86400)
+        if self.weather_params:
+            widths.append(3600)
+        return max(min(widths, default=self.args.accuracy), self.args.accuracy)
+
+    def ready(self, stage, loc):
+        """
+        Whether a location has been through the network stages before one (as far as it needs them).
+        """
+        return not any(
+            self.runs(earlier) and id(loc) not in self.done[earlier] and self.needs(earlier, loc)
+            for earlier in self.STAGES[1:self.STAGES.index(stage)]
+        )
+
+    def complete(self, loc):
+        """
+        Whether a location has been through every network stage of the run. Offline geocoding is
+        not one: what it leaves unresolved falls through to the metadata fetch.
+        """
+        return not any(
+            self.runs(stage) and id(loc) not in self.done[stage] and self.needs(stage, loc)
+            for stage in self.STAGES[1:]
+        )
+
+    def pending(self, stage, locs):
+        """
+        The locations a stage has to process.
+        """
+        return [loc for loc in locs if self.needs(stage, loc)]
+
+    def estimate(self, map_obj, config):
+        """
+        Estimates the work of each stage the run needs, without fetching anything.
+
+        Locations that the pano store can answer are counted as stored rather than requested.
+        Runtimes assume the configured rate limits and typical latencies (config "plan"); retries
+        and failures are not modelled.
+
+        Args:
+            map_obj (SVMap): The loaded map.
+            config (dict): The configuration.
+
+        Returns:
+            list: One dict per stage (stage, locations, cached, stored, requests, quota, seconds).
+        """
+        locs = map_obj.locs
+        plan = config['plan']
+        chunk_size = config['panoFetchChunkSize']
+        radius = config['panoFetchRadius']
+        rows = []
+
+        def row(stage, pending, stored=0, requests=0, quota=0, seconds=None):
+            rows.append({
+                'stage': stage,
+                'locations': len(pending),
+                'cached': len(locs) - len(pending),
+                'stored': stored,
+                'requests': requests,
+                'quota': quota,
+                'seconds': round(seconds if seconds is not None else len(pending) * plan['perLocation'].get(stage, 0), 2)
+            })
+
+        if self.runs('geocode'):
+            row('geocode', self.pending('geocode', locs))
+
+        # Pano IDs known after the metadata fetch, for the timestamp lookups below
+        panos = {}
+        pending = self.pending('fetch_meta', locs)
+        stored = 0
+        for loc in pending:
+            data = self.store.lookup(loc['lat'], loc['lng'], radius, loc.get('panoId'), touch=False) if self.store else None
+            if data is not None and 'imageDate' in data:
+                stored += 1
+                panos[id(loc)] = data.get('panoId')
+        requests = len(pending) - stored
+        row('fetch_meta', pending, stored, requests, requests,
+            self.network_seconds(config, 'singleImageSearch', requests, math.ceil(requests / chunk_size)))
+
+        if self.runs('timestamp'):
+            pending = self.pending('timestamp', locs)
+            stored = probes = 0
+            resolution = self.timestamp_resolution()
+            for loc in pending:
+                data = self.store.get(panos.get(id(loc), loc.get('panoId')), touch=False) if self.store else None
+                if data and self.timestamp_settled({**data, 'lat': loc['lat'], 'lng': loc['lng']}):
+                    stored += 1
+                    continue
+                # A timestamp found for coarser tags is refined from its interval, not the month
+                interval = timestamp_interval(loc)
+                probes += timestamp_probes(resolution, interval[1] - interval[0] if interval else TIMESTAMP_WINDOW, not self.precise())
+            searched = len(pending) - stored
+            requests = math.ceil(probes)
+            rounds = math.ceil(searched / chunk_size) * math.ceil(requests / searched) if searched else 0
+            row('timestamp', pending, stored, requests, requests,
+                self.network_seconds(config, 'singleImageSearch', requests, rounds))
+
+        if self.runs('solar'):
+            # Fetched timestamps invalidate nothing, so this is what the solar stage will see
+            row('solar', self.pending('solar', locs))
+
+        if self.runs('weather'):
+            # Locations still without a timestamp can't be grouped by date yet; count them alone
+            pending = self.pending('weather', locs)
+            dated = [loc for loc in pending if loc.get('timestamp')]
+            chunks = weather_chunks(dated, config['weatherSearchWindow'])
+            undated = len(pending) - len(dated)
+            requests = len(chunks) + math.ceil(undated / WEATHER_CHUNK)
+            quota = weather_quota(chunks, len(self.weather_params)) + undated * math.ceil(len(self.weather_params) / MAX_VARIABLES)
+            row('weather', pending, 0, requests, quota,
+                self.network_seconds(config, 'openMeteoArchive', requests, 1 if requests else 0))
+
+        row('tag', locs)
+        return rows
+
+    def network_seconds(self, config, endpoint, requests, rounds):
+        """
+        Estimated runtime of a network stage: the slower of its sequential request rounds and the
+        host's rate limit (one budget per egress route).
+        """
+        host = urlsplit(config['endpoints'][endpoint]).hostname
+        limit = config['rateLimits'].get(host, config['rateLimits'].get('default'))
+        seconds = rounds * config['plan']['latency'].get(endpoint, 0)
+        if limit:
+            # The buckets start full, so the first `rate` requests of each go out at once
+            rate = limit['rate'] * max(len(config.get('egress', {}).get('routes', [])), 1)
+            seconds = max(seconds, max(requests - rate, 0) / rate * limit.get('period', 1))
+        return seconds
+
+
+def timestamp_interval(entry):
+    """
+    Interval a location's (or stored pano's) timestamp was found in, as (start, end) unix times.
+    CSV maps hold both fields as strings; a timestamp that doesn't parse counts as none.
+
+    Returns:
+        tuple | None: The interval, or None without a usable timestamp.
+    """
+    try:
+        timestamp = float(entry.get('timestamp') or 0)
+        width = float(entry.get('timestampAccuracy') or 0)
+    except (TypeError, ValueError):
+        return None
+    if not timestamp:
+        return None
+    return timestamp - width / 2, timestamp + width / 2
+
+
+def timestamp_probes(accuracy, window=TIMESTAMP_WINDOW, boundaries=False):
+    """
+    Number of searches find_accurate_timestamp makes to narrow a window (by default the month)
+    down to an interval width.
+
+    With boundaries, the search stops once the interval holds no output boundary instead, which
+    can take more: an interval of width w straddles one of the steps accuracy apart with a chance
+    of w / accuracy, halved by each further search (2 w / accuracy more searches on average).
+    """
+    probes = 0
+    while window > accuracy:
+        window -= window // 2
+        probes += 1
+    if boundaries and window:
+        probes += 2 * window / accuracy
+    return probes
+
+
+def print_plan(rows, quotas):
+    """
+    Prints the estimate of a run as a table, with the share of each daily quota it would use.
+
+    Args:
+        rows (list): Stage estimates from Planner.estimate.
+        quotas (dict): Endpoint -> requests allowed per day.
+    """
+    columns = ['stage', 'locations', 'cached', 'stored', 'requests', 'quota', 'seconds']
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+    seconds = sum(row['seconds'] for row in rows)
+    print(f"Total: {sum(row['requests'] for row in rows)} requests, ~{seconds:.0f} s")
+    stage_endpoints = {'fetch_meta': 'singleImageSearch', 'timestamp': 'singleImageSearch', 'weather': 'openMeteoArchive'}
+    for endpoint, quota in quotas.items():
+        used = sum(row['quota'] for row in rows if stage_endpoints.get(row['stage']) == endpoint)
+        print(f"{endpoint}: {used} of {quota} daily calls ({used / quota:.1%})")
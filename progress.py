@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import sys
+from time import monotonic, time
+
+from tqdm import tqdm
+
+FORMAT = 'auto'
+STREAM = None
+INTERVAL = 0.5  # Minimum seconds between progress events of one stage
+CURRENT = None
+
+
+class NullProgress:
+    """
+    Progress sink that discards updates.
+    """
+    def update(self, n=1):
+        pass
+
+    def close(self):
+        pass
+
+
+class EventProgress:
+    """
+    Progress of one stage as NDJSON events: start, rate-limited progress and end.
+
+    Args:
+        total (int): Number of locations in the stage.
+        desc (str): Name of the stage.
+    """
+    def __init__(self, total, desc):
+        global CURRENT
+        self.total = total
+        self.desc = desc
+        self.done = 0
+        self.errors = 0
+        self.start = monotonic()
+        self.last = self.start
+        CURRENT = self
+        emit('start', stage=desc, total=total)
+
+    def update(self, n=1):
+        self.done += n
+        now = monotonic()
+        if now - self.last >= INTERVAL:
+            self.last = now
+            emit('progress', **self.state(now))
+
+    def state(self, now):
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else None
+        return {
+            'stage': self.desc,
+            'done': self.done,
+            'total': self.total,
+            'elapsed': round(elapsed, 3),
+            'rate': round(rate, 2) if rate is not None else None,
+            'eta': round((self.total - self.done) / rate, 1) if rate else None,
+            'errors': self.errors
+        }
+
+    def close(self):
+        global CURRENT
+        emit('end', **self.state(monotonic()))
+        if CURRENT is self:
+            CURRENT = None
+
+
+class EventHandler(logging.Handler):
+    """
+    Forwards warnings and errors to the event stream, counted against the running stage.
+    """
+    def __init__(self):
+        super().__init__(logging.WARNING)
+
+    def emit(self, record):
+        if CURRENT is not None and record.levelno >= logging.ERROR:
+            CURRENT.errors += 1
+        emit('error' if record.levelno >= logging.ERROR else 'warning',
+             stage=CURRENT.desc if CURRENT is not None else None, message=record.getMessage())
+
+
+def emit(event, **fields):
+    """
+    Writes one event line to the event stream.
+    """
+    STREAM.write(json.dumps({'event': event, 'time': round(time(), 3), **fields}) + '\n')
+    STREAM.flush()
+
+
+def notify(event, **fields):
+    """
+    Writes an event that is not stage progress (e.g. a partial output) when events are enabled.
+    """
+    if FORMAT == 'ndjson':
+        emit(event, **fields)
+
+
+def configure_progress(fmt='auto', fd=2):
+    """
+    Selects how stage progress is reported.
+
+    Args:
+        fmt (str): 'tqdm' (progress bars), 'ndjson' (one JSON event per line), 'none', or 'auto'
+            (tqdm when stderr is a terminal, otherwise none).
+        fd (int): File descriptor NDJSON events are written to.
+    """
+    global FORMAT, STREAM
+    FORMAT = fmt
+    if fmt == 'ndjson':
+        STREAM = {1: sys.stdout, 2: sys.stderr}.get(fd) or os.fdopen(fd, 'w', buffering=1)
+        logging.getLogger().addHandler(EventHandler())
+
+
+def progress_bar(total, desc):
+    """
+    Progress reporter for one stage, with the update/close interface of tqdm.
+
+    Args:
+        total (int): Number of locations in the stage.
+        desc (str): Name of the stage.
+    """
+    fmt = FORMAT
+    if fmt == 'auto':
+        fmt = 'tqdm' if sys.stderr.isatty() else 'none'
+
+    if fmt == 'tqdm':
+        return tqdm(total=total, desc=desc)
+    if fmt == 'ndjson':
+        return EventProgress(total, desc)
+    return NullProgress()
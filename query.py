@@ -0,0 +1,421 @@
+from hashlib import sha256
+from pathlib import Path
+import json
+import math
+import re
+import shutil
+
+import numpy as np
+
+import jsonio
+from sv_map import SVMap, NDJSON_SUFFIXES
+from compress import codec_of, map_suffix
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat, lng, lats, lngs):
+    """
+    Great-circle distances (km) from one point to arrays of points.
+    """
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class MapIndex:
+    """
+    Persistent spatial and attribute indexes of a map, for answering queries without scanning it.
+
+    Locations are bucketed into a grid of CELL-degree cells, stored as one position array sorted
+    by cell, so the cells of a bounding box row are one contiguous slice. Attribute indexes are
+    sorted (value, position) arrays, built the first time an attribute is queried: numeric
+    attributes support range comparisons, others compare as strings, and `tag` indexes the
+    location tags. Indexes live in `<folder>/<map file name>.index/` and are rebuilt when the map file
+    changes. For NDJSON maps the index also holds the byte offset of every location, so results
+    are read without parsing the rest of the file.
+
+    Args:
+        file (str): The map file.
+        folder (str): The folder to keep the index in.
+    """
+    CELL = 0.25
+    COLUMNS = int(360 / CELL)
+
+    def __init__(self, file, folder):
+        self.file = Path(file)
+        self.folder = Path(folder) / f"{self.file.name}.index"
+        self.map = None
+        self.attributes = {}
+
+        stat = self.file.stat()
+        version = {'file': self.file.name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'cell': self.CELL}
+        manifest = self.folder / 'manifest.json'
+        if manifest.exists() and json.loads(manifest.read_text()) == version:
+            self.load_spatial()
+        else:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder.mkdir(parents=True)
+            self.build_spatial()
+            manifest.write_text(json.dumps(version))
+
+    def load_map(self):
+        if self.map is None:
+            self.map = SVMap(self.file)
+        return self.map
+
+    def cell_keys(self, lats, lngs):
+        rows = np.floor((np.asarray(lats) + 90) / self.CELL).astype(np.int64)
+        cols = np.floor(((np.asarray(lngs) + 180) % 360) / self.CELL).astype(np.int64)
+        return rows * self.COLUMNS + np.minimum(cols, self.COLUMNS - 1)
+
+    def build_spatial(self):
+        """
+        Builds and saves the grid index (and NDJSON line offsets).
+        """
+        locs = self.load_map().locs
+        self.lats = np.fromiter((float(loc['lat']) for loc in locs), dtype=np.float64, count=len(locs))
+        self.lngs = np.fromiter((float(loc['lng']) for loc in locs), dtype=np.float64, count=len(locs))
+
+        keys = self.cell_keys(self.lats, self.lngs)
+        self.order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[self.order]
+        self.cells, starts = np.unique(sorted_keys, return_index=True)
+        self.bounds = np.append(starts, len(sorted_keys)).astype(np.int64)
+        # Compressed files can't be seeked into; their matches are read from the loaded map
+        plain_ndjson = map_suffix(self.file) in NDJSON_SUFFIXES and not codec_of(self.file)
+        self.offsets = self.line_offsets() if plain_ndjson else np.empty(0, dtype=np.int64)
+
+        np.savez(self.folder / 'spatial.npz', lats=self.lats, lngs=self.lngs, order=self.order,
+                 cells=self.cells, bounds=self.bounds, offsets=self.offsets)
+
+    def load_spatial(self):
+        spatial = np.load(self.folder / 'spatial.npz')
+        self.lats, self.lngs = spatial['lats'], spatial['lngs']
+        self.order, self.cells, self.bounds = spatial['order'], spatial['cells'], spatial['bounds']
+        self.offsets = spatial['offsets']
+
+    def line_offsets(self):
+        """
+        Byte offset of each location line of an NDJSON map (skipping the header line).
+        """
+        offsets = []
+        with open(self.file, 'rb') as f:
+            position = 0
+            for line in f:
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+        if offsets:
+            with open(self.file, 'rb') as f:
+                first = jsonio.loads(f.readline())
+            if not ('lat' in first and 'lng' in first):
+                offsets = offsets[1:]
+        return np.asarray(offsets, dtype=np.int64)
+
+    @property
+    def size(self):
+        return len(self.lats)
+
+    def box_candidates(self, min_lat, max_lat, min_lng, max_lng):
+        """
+        Positions in the grid cells overlapping a box that does not cross the antimeridian.
+        """
+        rows = range(int((max(min_lat, -90) + 90) // self.CELL), int((min(max_lat, 90) + 90) // self.CELL) + 1)
+        first, last = (int(((lng + 180) % 360) // self.CELL) if lng < 180 else self.COLUMNS - 1 for lng in (min_lng, max_lng))
+        slices = []
+        for row in rows:
+            lo = np.searchsorted(self.cells, row * self.COLUMNS + first, side='left')
+            hi = np.searchsorted(self.cells, row * self.COLUMNS + last, side='right')
+            if lo < hi:
+                slices.append(self.order[self.bounds[lo]:self.bounds[hi]])
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def bbox(self, min_lat, min_lng, max_lat, max_lng):
+        """
+        Positions inside a bounding box; min_lng > max_lng crosses the antimeridian.
+        """
+        boxes = [(min_lng, max_lng)] if min_lng <= max_lng else [(min_lng, 180), (-180, max_lng)]
+        found = []
+        for lo, hi in boxes:
+            candidates = self.box_candidates(min_lat, max_lat, lo, hi)
+            lats, lngs = self.lats[candidates], self.lngs[candidates]
+            found.append(candidates[(lats >= min_lat) & (lats <= max_lat) & (lngs >= lo) & (lngs <= hi)])
+        return np.unique(np.concatenate(found))
+
+    def radius(self, lat, lng, km):
+        """
+        Positions within a distance of a point.
+
+        Returns:
+            tuple: Positions and their distances (km).
+        """
+        dlat = km / KM_PER_DEGREE
+        if abs(lat) + dlat >= 90:
+            boxes = [(-180, 180)]
+        else:
+            dlng = dlat / math.cos(math.radians(abs(lat) + dlat))
+            if dlng >= 180:
+                boxes = [(-180, 180)]
+            else:
+                west, east = (lng - dlng + 180) % 360 - 180, (lng + dlng + 180) % 360 - 180
+                boxes = [(west, east)] if west <= east else [(west, 180), (-180, east)]
+
+        candidates = np.unique(np.concatenate([self.box_candidates(lat - dlat, lat + dlat, lo, hi) for lo, hi in boxes]))
+        distances = haversine(lat, lng, self.lats[candidates], self.lngs[candidates])
+        inside = distances <= km
+        return candidates[inside], distances[inside]
+
+    def nearest(self, lat, lng, k, within=None):
+        """
+        The k positions closest to a point (optionally only those within a distance), nearest first.
+        The search radius starts at one cell and doubles until it holds k locations.
+        """
+        km = within if within is not None else self.CELL * KM_PER_DEGREE
+        while True:
+            positions, distances = self.radius(lat, lng, km)
+            if len(positions) >= k or within is not None or km >= math.pi * EARTH_RADIUS_KM:
+                break
+            km *= 2
+        closest = np.argsort(distances, kind='stable')[:k]
+        return positions[closest]
+
+    def attribute(self, name):
+        """
+        Loads (or builds and saves) the index of one attribute.
+
+        Returns:
+            tuple: Kind ('number' or 'string'), sorted values and their positions.
+        """
+        if name in self.attributes:
+            return self.attributes[name]
+
+        # Sanitized names can collide (a.b, a_b), so the file name ends with a hash of the name
+        file = self.folder / f"attr-{re.sub(r'[^A-Za-z0-9_]', '_', name)}-{sha256(name.encode()).hexdigest()[:12]}.npz"
+        if file.exists():
+            packed = np.load(file)
+            index = (str(packed['kind']), packed['values'], packed['positions'])
+        else:
+            index = self.build_attribute(name)
+            np.savez(file, kind=np.array(index[0]), values=index[1], positions=index[2])
+        self.attributes[name] = index
+        return index
+
+    def build_attribute(self, name):
+        values, positions = [], []
+        for i, loc in enumerate(self.load_map().locs):
+            if name == 'tag':
+                extra = loc.get('extra')
+                tags = extra.get('tags') if isinstance(extra, dict) else None
+                for tag in dict.fromkeys(tags or []):
+                    values.append(str(tag))
+                    positions.append(i)
+            elif loc.get(name) is not None:
+                values.append(loc[name])
+                positions.append(i)
+
+        numeric = bool(values) and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+        if numeric:
+            values = np.asarray(values, dtype=np.float64)
+        else:
+            values = np.asarray([str(value) for value in values])
+        positions = np.asarray(positions, dtype=np.int64)
+        order = np.argsort(values, kind='stable')
+        return ('number' if numeric else 'string'), values[order], positions[order]
+
+    def compare(self, name, op, value):
+        """
+        Positions whose attribute satisfies `attribute op value`. A value of None matches
+        locations without the attribute (== null) or with it (!= null). `!=` is the complement of
+        `==`: it matches locations without the attribute, and `tag != X` those not tagged X.
+        """
+        kind, values, positions = self.attribute(name)
+        everything = np.arange(self.size, dtype=np.int64)
+        if op == '!=' and value is not None:
+            return np.setdiff1d(everything, self.compare(name, '==', value), assume_unique=True)
+        if value is not None and not len(values):
+            return np.empty(0, dtype=np.int64)
+        if value is None:
+            present = np.unique(positions)
+            if op == '==':
+                return np.setdiff1d(everything, present, assume_unique=True)
+            if op == '!=':
+                return present
+            raise ValueError("Only == and != can compare with null")
+
+        if kind == 'number':
+            if isinstance(value, str):
+                raise ValueError(f"'{name}' is numeric; cannot compare with '{value}'")
+        elif not isinstance(value, str):
+            if op not in ('==', '!='):
+                raise ValueError(f"'{name}' is not numeric")
+            value = str(int(value)) if float(value).is_integer() else str(value)
+
+        left = np.searchsorted(values, value, side='left')
+        right = np.searchsorted(values, value, side='right')
+        if op == '==':
+            found = positions[left:right]
+        elif op == '<':
+            found = positions[:left]
+        elif op == '<=':
+            found = positions[:right]
+        elif op == '>':
+            found = positions[right:]
+        elif op == '>=':
+            found = positions[left:]
+        else:
+            raise ValueError(f"Unknown operator {op}")
+        return np.unique(found)
+
+    def where(self, predicate):
+        """
+        Positions matching a predicate such as `state == 'Tunis' and (altitude < 6 or tag == Overcast)`.
+        """
+        return Predicate(predicate).evaluate(self)
+
+    def query(self, bbox=None, near=None, radius=None, nearest=None, where=None):
+        """
+        Positions matching every given filter, in map order (nearest first with `nearest`).
+
+        Args:
+            bbox (list): min_lat, min_lng, max_lat, max_lng.
+            near (list): lat, lng of the point for `radius` and `nearest`.
+            radius (float): Distance from `near` in km.
+            nearest (int): Keep only the k matches closest to `near`.
+            where (str): Attribute predicate.
+        """
+        filters = []
+        if bbox:
+            filters.append(self.bbox(*bbox))
+        if near and radius is not None:
+            filters.append(self.radius(*near, radius)[0])
+        if where:
+            filters.append(self.where(where))
+
+        if nearest is not None and not (bbox or where):
+            return self.nearest(*near, nearest, radius)
+        positions = np.arange(self.size, dtype=np.int64)
+        for found in filters:
+            positions = np.intersect1d(positions, found, assume_unique=True)
+        if nearest is not None:
+            distances = haversine(*near, self.lats[positions], self.lngs[positions])
+            positions = positions[np.argsort(distances, kind='stable')[:nearest]]
+        return positions
+
+    def subset(self, positions):
+        """
+        Builds a map of the given locations (in the given order), with the header of the indexed map.
+        """
+        positions = [int(position) for position in positions]
+        if len(self.offsets):
+            with open(self.file, 'rb') as f:
+                first = jsonio.loads(f.readline())
+                header = {} if 'lat' in first and 'lng' in first else {key: value for key, value in first.items() if key != 'customCoordinates'}
+                locs = []
+                for position in positions:
+                    f.seek(int(self.offsets[position]))
+                    locs.append(jsonio.loads(f.readline()))
+        else:
+            map_obj = self.load_map()
+            header = {key: value for key, value in map_obj.data.items() if key != 'customCoordinates'}
+            locs = [map_obj.locs[position] for position in positions]
+        return SVMap.from_data({**header, 'customCoordinates': locs})
+
+
+class Predicate:
+    """
+    Parser for attribute predicates: comparisons (`==`, `!=`, `<`, `<=`, `>`, `>=`) of an attribute
+    with a number, a quoted or bare string, or null, combined with and/or/not and parentheses.
+    `tag == X` matches locations tagged X, and `tag != X` those that are not.
+
+    Args:
+        text (str): The predicate.
+    """
+    TOKEN = re.compile(r"\s*(?:(?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)|(?P<string>'[^']*'|\"[^\"]*\")|(?P<op>==|!=|<=|>=|=|<|>)|(?P<paren>[()])|(?P<word>[A-Za-z_][\w.-]*))")
+
+    def __init__(self, text):
+        self.tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = self.TOKEN.match(text, position)
+            if not match:
+                raise ValueError(f"Invalid predicate near '{text[position:]}'")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.position = 0
+        self.tree = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position][1]}' in predicate")
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of predicate")
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        kind, value = self.peek()
+        if kind == 'word' and value.lower() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.keyword('or'):
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.keyword('and'):
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.keyword('not'):
+            return ('not', self.parse_not())
+        if self.peek() == ('paren', '('):
+            self.next()
+            node = self.parse_or()
+            if self.next() != ('paren', ')'):
+                raise ValueError("Missing ')' in predicate")
+            return node
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        kind, name = self.next()
+        if kind != 'word':
+            raise ValueError(f"Expected an attribute, got '{name}'")
+        kind, op = self.next()
+        if kind != 'op':
+            raise ValueError(f"Expected an operator after '{name}', got '{op}'")
+        kind, literal = self.next()
+        if kind == 'number':
+            value = float(literal)
+        elif kind == 'string':
+            value = literal[1:-1]
+        elif kind == 'word':
+            value = None if literal.lower() == 'null' else literal
+        else:
+            raise ValueError(f"Expected a value after '{name} {op}'")
+        return ('compare', name, '==' if op == '=' else op, value)
+
+    def evaluate(self, index, node=None):
+        """
+        Positions of the indexed map matching the predicate (sorted).
+        """
+        node = node or self.tree
+        if node[0] == 'compare':
+            return index.compare(*node[1:])
+        if node[0] == 'not':
+            return np.setdiff1d(np.arange(index.size, dtype=np.int64), self.evaluate(index, node[1]), assume_unique=True)
+        left, right = self.evaluate(index, node[1]), self.evaluate(index, node[2])
+        return np.intersect1d(left, right, assume_unique=True) if node[0] == 'and' else np.union1d(left, right)
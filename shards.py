@@ -0,0 +1,120 @@
+from pathlib import Path
+import logging
+import re
+import zlib
+
+from sv_map import SVMap, NDJSON_SUFFIXES
+from compress import map_stem, map_suffix
+
+MAP_SUFFIXES = ('.json', '.csv', *NDJSON_SUFFIXES)
+SHARD_NAME = re.compile(r'^(?P<stem>.+)\.shard-(?P<index>\d+)-of-(?P<count>\d+)$')
+
+
+def shard_name(stem, index, count):
+    """
+    Stem of a shard file, e.g. "map.shard-2-of-4".
+    """
+    return f"{stem}.shard-{index}-of-{count}"
+
+
+def shard_of(loc, count):
+    """
+    Shard (0-based) a location belongs to. Depends only on its coordinates, so every machine splits
+    a map the same way and duplicate locations land in the same shard.
+    """
+    return zlib.crc32(f"{loc['lat']},{loc['lng']}".encode()) % count
+
+
+def split(map_obj, count):
+    """
+    Splits a map into shards that keep its header (name, tag legend, ...).
+
+    Args:
+        map_obj (SVMap): The map to split.
+        count (int): Number of shards.
+
+    Returns:
+        list: One SVMap per shard, locations in their original order.
+    """
+    if count < 1:
+        raise ValueError("Shard count must be at least 1")
+
+    header = {key: value for key, value in map_obj.data.items() if key != 'customCoordinates'}
+    shards = [[] for _ in range(count)]
+    for loc in map_obj.locs:
+        shards[shard_of(loc, count)].append(loc)
+    return [SVMap.from_data({**header, 'customCoordinates': locs}) for locs in shards]
+
+
+def find_shards(folder, stem):
+    """
+    Finds the shard files of a map in a folder and checks that the set is complete.
+
+    Returns:
+        list: Shard file paths, ordered by shard index.
+    """
+    found = {}
+    counts = set()
+    for file in Path(folder).iterdir():
+        match = SHARD_NAME.match(map_stem(file))
+        if map_suffix(file) not in MAP_SUFFIXES or not match or match['stem'] != stem:
+            continue
+        counts.add(int(match['count']))
+        found[int(match['index'])] = file
+
+    if not found:
+        raise ValueError(f"No shards of {stem} found in {folder}")
+    if len(counts) > 1:
+        raise ValueError(f"Shards of {stem} from different splits ({', '.join(map(str, sorted(counts)))} shards)")
+    count = counts.pop()
+    missing = [str(i) for i in range(1, count + 1) if i not in found]
+    if missing:
+        raise ValueError(f"Missing shards {', '.join(missing)} of {count}")
+    return [found[i] for i in sorted(found)]
+
+
+def merge(base, shards):
+    """
+    Merges shard meta files back into one map, in the order of the base map.
+
+    Locations are matched to the base map by coordinates (the n-th occurrence of a coordinate to
+    the n-th copy in a shard). A location found in several shards is resolved to its most complete
+    copy, with missing fields filled in from the others. Base locations missing from every shard
+    (dropped by failed fetches) are dropped, as in a single tag run.
+
+    Args:
+        base (SVMap): The base map; its header and location order are kept.
+        shards (list): SVMaps of the shard meta files.
+
+    Returns:
+        SVMap: The merged map.
+    """
+    copies = [{} for _ in shards]
+    for i, shard in enumerate(shards):
+        for loc in shard.locs:
+            copies[i].setdefault((loc['lat'], loc['lng']), []).append(loc)
+
+    seen = {}
+    locs = []
+    duplicates = 0
+    for loc in base.locs:
+        key = (loc['lat'], loc['lng'])
+        n = seen[key] = seen.get(key, -1) + 1
+        candidates = [shard[key][n] for shard in copies if len(shard.get(key, ())) > n]
+        if not candidates:
+            continue
+        if len(candidates) > 1:
+            duplicates += 1
+
+        merged = dict(max(candidates, key=len))
+        for candidate in candidates:
+            for field, value in candidate.items():
+                merged.setdefault(field, value)
+        locs.append(merged)
+
+    matched = sum(min(len(shard.get(key, ())), count + 1) for shard in copies for key, count in seen.items())
+    unmatched = sum(len(shard.locs) for shard in shards) - matched
+    logging.info(f"Merged {len(locs)} of {len(base.locs)} locations ({len(base.locs) - len(locs)} missing, {duplicates} duplicated across shards, {unmatched} not in the base map)")
+
+    header = {key: value for key, value in base.data.items() if key != 'customCoordinates'}
+    return SVMap.from_data({**header, 'customCoordinates': locs})
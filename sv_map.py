@@ -1,76 +1,232 @@
 from pathlib import Path
-import json, csv
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import codecs
+import csv
+import io
+import json
+import os
+import re
+
+import jsonio
+from compress import open_file, codec_of, map_suffix, map_stem
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+# Fields read back as numbers from CSV
+NUMERIC_FIELDS = ('lat', 'lng', 'heading', 'pitch', 'zoom', 'elevation', 'altitude', 'azimuth', 'timestamp', 'timestampAccuracy',
+                  'drivingDirection', 'cloudCover', 'precipitation', 'snowDepth')
 
 class SVMap:
     """
     StreetView metadata map object.
 
     Args:
-        file (str): The path to the file containing map data.
+        file (str): The path to the file containing map data (JSON, NDJSON or CSV, optionally
+            gzip or zstd compressed: map.json.gz, map.ndjson.zst).
+        workers (int): Processes to parse NDJSON files with (0 for one per CPU).
 
     Attributes:
         data (dict): The top-level map data.
         locs (list): The list of coordinate data.
     """
     KNOWN_FIELDS = ['lat', 'lng', 'heading', 'panoId', 'extra', 'pitch', 'tags', 'drivingDirection', 'elevation', 'altitude', 
-                    'country', 'state', 'locality', 'imageDate', 'timestamp', 'altitude', 'azimuth', 'altitudeClass', 'azimuthClass',
+                    'country', 'state', 'locality', 'imageDate', 'timestamp', 'timestampAccuracy', 'altitude', 'azimuth', 'altitudeClass', 'azimuthClass',
                     'sunEvent', 'cloudCover', 'cloudCoverClass', 'precipitation', 'snowDepth']
     CRITICAL_FIELDS = ['lat', 'lng', 'heading', 'panoId', 'extra', 'pitch']
 
-    def __init__(self, file):
-        with open(file) as f:
-            if Path(file).suffix == '.json':
-                self.data = json.load(f)
-                if not 'customCoordinates' in self.data:
-                    self.data = {"customCoordinates": self.data}
-                self.locs = self.data['customCoordinates']
-        
-            elif Path(file).suffix == '.csv':
+    PARALLEL_MIN_BYTES = 32 << 20  # Smaller NDJSON files are parsed in one process
+
+    def __init__(self, file, workers=1):
+        if map_suffix(file) in NDJSON_SUFFIXES:
+            self.data, self.locs = read_ndjson(file, workers, self.PARALLEL_MIN_BYTES)
+
+        elif map_suffix(file) == '.json':
+            with open_file(file) as f:
+                # A compressed map is parsed as it is decompressed, not decompressed whole first
+                self.data = read_json_stream(f) if codec_of(file) else jsonio.loads(f.read())
+            if not 'customCoordinates' in self.data:
+                self.data = {"customCoordinates": self.data}
+            self.locs = self.data['customCoordinates']
+
+        elif map_suffix(file) == '.csv':
+            with io.TextIOWrapper(open_file(file), newline='') as f:
                 reader = csv.reader(f)
                 headers = next(reader)
-                content = list(reader)
 
                 lat_index = headers.index('lat')
                 lng_index = headers.index('lng')
+                fields = [(i, header) for i, header in enumerate(headers) if i not in (lat_index, lng_index)]
 
                 self.locs = []
-
-                for row in content:
+                for row in reader:
+                    # Rows without parsable coordinates are skipped
                     try:
-                        self.locs.append({
-                            "lat": float(row[lat_index]),
-                            "lng": float(row[lng_index]),
-                            "extra": {"tags": []}
-                        })
-
-                        for i, value in enumerate(row):
-                            if i not in (lat_index, lng_index):
-                                self.locs[-1][headers[i]] = value
-
-                        if 'heading' not in self.locs[-1]:
-                            self.locs[-1]['heading'] = 0
-                    
-                    except:
+                        lat, lng = csv_value('lat', row[lat_index]), csv_value('lng', row[lng_index])
+                    except IndexError:
                         continue
+                    if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+                        continue
+                    loc = {"lat": lat, "lng": lng, "extra": {"tags": []}}
+
+                    for i, header in fields:
+                        if i < len(row) and row[i] != '':
+                            loc[header] = csv_value(header, row[i])
+                    if 'heading' not in loc:
+                        loc['heading'] = 0
+                    self.locs.append(loc)
 
-                self.data = {'name': Path(file).stem, "customCoordinates": self.locs}
+            self.data = {'name': map_stem(file), "customCoordinates": self.locs}
 
-    def save(self, file):
+    @classmethod
+    def from_data(cls, data):
+        """
+        Builds a map from top-level map data (with its customCoordinates) instead of a file.
+        """
+        map_obj = cls.__new__(cls)
+        map_obj.data = data
+        map_obj.locs = data['customCoordinates']
+        return map_obj
+
+    def save(self, file, quiet=False):
         """
         Saves the map data to a file.
 
         Args:
             file (str): The path to the file to save the data to.
+            quiet (bool): Don't announce the saved file.
         """
         from metatag import CONFIG
 
+        if map_suffix(file) in NDJSON_SUFFIXES:
+            return self.save_stream(file, quiet)
+        if map_suffix(file) == '.csv':
+            return self.save_csv(file, quiet)
+
         try:
-            with open(file, 'w') as f:
-                json.dump(self.data, f, indent = None if CONFIG['compressFile'] else 4)
-            print("Saved to " + str(file))
+            with open_file(file, 'wb') as f:
+                f.write(jsonio.dumps(self.data, indent = None if CONFIG['compressFile'] else 4))
+            if not quiet:
+                print("Saved to " + str(file))
         except:
              print("Failed to save to " + str(file))
-    
+
+    def save_stream(self, file, quiet=False):
+        """
+        Saves the map data one location at a time, without building the whole document in memory.
+        The bytes written are the same as those of save().
+
+        Args:
+            file (str): The path to the file to save the data to.
+            quiet (bool): Don't announce the saved file.
+        """
+        from metatag import CONFIG
+
+        if map_suffix(file) in NDJSON_SUFFIXES:
+            return self.save_ndjson(file, quiet)
+        indent = None if CONFIG['compressFile'] else 4
+        sentinel = '\x00customCoordinates\x00'
+
+        # Serialize the map around a placeholder, then splice the locations in
+        shell = jsonio.dumps({**self.data, 'customCoordinates': sentinel}, indent).decode('utf-8')
+        head, tail = shell.split(jsonio.dumps(sentinel).decode('utf-8'))
+
+        # Separator and indent unit of the active JSON backend
+        probe = jsonio.dumps([0, 0], indent)
+        if indent is None:
+            separator, newline, unit = probe[2:-2], b'', b''
+        else:
+            unit = probe.split(b'\n')[1][:-2]
+            separator, newline = b',\n', b'\n'
+
+        try:
+            with open_file(file, 'wb') as f:
+                f.write(head.encode('utf-8'))
+                if not self.locs:
+                    f.write(b'[]')
+                else:
+                    f.write(b'[')
+                    for i, loc in enumerate(self.locs):
+                        f.write((separator if i else newline) + unit * 2 + jsonio.dumps(loc, indent).replace(b'\n', b'\n' + unit * 2))
+                    f.write(newline + unit + b']')
+                f.write(tail.encode('utf-8'))
+            if not quiet:
+                print("Saved to " + str(file))
+        except:
+            print("Failed to save to " + str(file))
+
+    def save_ndjson(self, file, quiet=False):
+        """
+        Saves the map data as NDJSON: the map header on the first line, then one location per line.
+        The header holds every top-level field, with customCoordinates as null to keep key order.
+
+        Args:
+            file (str): The path to the file to save the data to.
+            quiet (bool): Don't announce the saved file.
+        """
+        header = {key: None if key == 'customCoordinates' else value for key, value in self.data.items()}
+
+        try:
+            with open_file(file, 'wb') as f:
+                f.write(jsonio.dumps(header) + b'\n')
+                for loc in self.locs:
+                    f.write(jsonio.dumps(loc) + b'\n')
+            if not quiet:
+                print("Saved to " + str(file))
+        except:
+            print("Failed to save to " + str(file))
+
+    def save_csv(self, file, quiet=False):
+        """
+        Saves the locations as CSV, one column per field. Nested values (such as extra) and null are
+        written as JSON and a missing field as an empty cell, so reading the file back gives the same
+        locations.
+
+        Args:
+            file (str): The path to the file to save the data to.
+            quiet (bool): Don't announce the saved file.
+        """
+        headers = ['lat', 'lng']
+        for loc in self.locs:
+            headers.extend(key for key in loc if key not in headers)
+        headers = list(dict.fromkeys(headers))
+
+        try:
+            with io.TextIOWrapper(open_file(file, 'wb'), encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(headers)
+                for loc in self.locs:
+                    writer.writerow([
+                        jsonio.dumps(loc[key]).decode('utf-8') if isinstance(loc.get(key), (dict, list)) or (key in loc and loc[key] is None) else loc.get(key, '')
+                        for key in headers
+                    ])
+            if not quiet:
+                print("Saved to " + str(file))
+        except:
+            print("Failed to save to " + str(file))
+
+    def merge(self, cache):
+        """
+        Fills in metadata from a cached copy of the map (its meta file). Locations are matched by
+        coordinates; fields the location already has are kept, so edits to the base file win.
+
+        Args:
+            cache (SVMap): The cached map.
+
+        Returns:
+            int: Number of locations that matched a cached location.
+        """
+        cached = {(loc['lat'], loc['lng']): loc for loc in cache.locs}
+        reused = 0
+        for loc in self.locs:
+            match = cached.get((loc['lat'], loc['lng']))
+            if match is None:
+                continue
+            reused += 1
+            for key, value in match.items():
+                if key != 'extra' and key not in loc:
+                    loc[key] = value
+        return reused
+
     def purge(self, exclude=CRITICAL_FIELDS):
         """
         Removes all non-excluded fields from the map data. By default, critical fields are excluded.
@@ -177,4 +333,253 @@ def force_extra(loc, tags = False):
 def clear_tags(loc):
     if 'extra' in loc and 'tags' in loc['extra']:
         loc['extra']['tags'] = []
-    return loc
\ No newline at end of file
+    return loc
+
+
+class JsonStream:
+    """
+    Incremental JSON parser over a binary stream, decoding from a buffer of the text read so far.
+    Arrays of objects are decoded a buffer at a time, so a long array of locations never has to be
+    held as text all at once.
+
+    Args:
+        f: Binary file object.
+        chunk (int): Bytes read at a time.
+    """
+    FOLLOWING = tuple(' \t\n\r,:]}')  # Characters that can follow a complete value
+    BOUNDARY = re.compile(r'\}\s*,\s*\{')  # Likely end of one object of an array and start of the next
+
+    def __init__(self, f, chunk=1 << 20):
+        self.f = f
+        self.chunk = chunk
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.scanner = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self.batching = True
+
+    def fill(self, size=0):
+        """
+        Reads at least size more bytes (one chunk by default). False at the end of the stream.
+        """
+        if self.eof:
+            return False
+        if self.position > len(self.buffer) // 2:
+            self.buffer, self.position = self.buffer[self.position:], 0
+        data = self.f.read(max(size, self.chunk))
+        self.eof = not data
+        self.buffer += self.decoder.decode(data, final=self.eof)
+        return True
+
+    def peek(self):
+        """
+        The next non-whitespace character, without consuming it ('' at the end).
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\n\r':
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r}, got {char!r}")
+        self.position += 1
+        return char
+
+    def value(self):
+        """
+        Decodes the next value. A number at the end of the buffer may be cut short (1.5 of 1.5e3),
+        so a value is only accepted once whitespace or punctuation, or the end of the stream,
+        follows it.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.scanner.raw_decode(self.buffer, self.position)
+                if self.eof or self.buffer[end:end + 1] in self.FOLLOWING:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read as much again as the value so far, so a long value is not rescanned chunk by chunk
+            self.fill(len(self.buffer) - self.position)
+
+    def batch(self):
+        """
+        Decodes the objects of an array up to the last `},{` in the buffer with one decoder call.
+        If that boundary lies inside a string or a nested array, the text doesn't decode and
+        batching is given up for the rest of the stream.
+
+        Returns:
+            list: The decoded objects (empty if there was no boundary).
+        """
+        end = len(self.buffer)
+        while self.batching:
+            end = self.buffer.rfind('}', self.position, end)
+            if end < 0:
+                return []
+            if self.BOUNDARY.match(self.buffer, end):
+                try:
+                    values = jsonio.loads('[' + self.buffer[self.position:end + 1] + ']')
+                except ValueError:
+                    self.batching = False
+                    return []
+                self.position = end + 1
+                return values
+        return []
+
+    def array(self):
+        """
+        Yields the elements of the array that follows.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            if self.peek() == '{':
+                values = self.batch()
+                if values:
+                    yield from values
+                    self.expect(',')
+                    continue
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def read_json_stream(f, key='customCoordinates', chunk=1 << 20):
+    """
+    Parses a map from a binary stream, decoding its locations as they are read (see JsonStream).
+
+    Args:
+        f: Binary file object.
+        key (str): Top-level key of the locations.
+        chunk (int): Bytes read at a time.
+
+    Returns:
+        dict | list: The map data (or the bare list of locations).
+    """
+    stream = JsonStream(f, chunk)
+    if stream.peek() == '[':
+        data = list(stream.array())
+    else:
+        data = {}
+        stream.expect('{')
+        if stream.peek() == '}':
+            stream.position += 1
+        else:
+            while True:
+                name = stream.value()
+                stream.expect(':')
+                data[name] = list(stream.array()) if name == key and stream.peek() == '[' else stream.value()
+                if stream.expect(',}') == '}':
+                    break
+    if stream.peek():
+        raise ValueError("Extra data after the map")
+    return data
+
+
+def csv_value(header, text):
+    """
+    Value of a CSV cell. Numeric fields are read as numbers, and JSON arrays, objects and null (as
+    save_csv writes them) are decoded; anything else stays a string.
+
+    Args:
+        header (str): The column name.
+        text (str): The cell.
+    """
+    if header in NUMERIC_FIELDS or text == 'null' or text[:1] in ('[', '{'):
+        try:
+            value = jsonio.loads(text)
+        except ValueError:
+            return text
+        if header not in NUMERIC_FIELDS or value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+            return value
+    return text
+
+
+def ndjson_ranges(file, start, chunks):
+    """
+    Splits an NDJSON file into byte ranges that start and end on line boundaries.
+
+    Args:
+        file (str): The NDJSON file.
+        start (int): Offset of the first location line.
+        chunks (int): Number of ranges to aim for.
+
+    Returns:
+        list: (start, end) byte offsets.
+    """
+    size = os.path.getsize(file)
+    step = max(1, (size - start) // chunks)
+    ranges = []
+
+    with open(file, 'rb') as f:
+        while start < size:
+            f.seek(min(start + step, size))
+            if f.tell() < size:
+                f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def read_ndjson_range(file, start, end):
+    """
+    Parses the locations in one byte range of an NDJSON file.
+    """
+    with open(file, 'rb') as f:
+        f.seek(start)
+        block = f.read(end - start)
+    # One decode call per block rather than per line
+    return jsonio.loads(b'[' + b','.join(line for line in block.splitlines() if line.strip()) + b']')
+
+def read_ndjson(file, workers=1, parallel_min=0):
+    """
+    Parses an NDJSON map. A first line without coordinates is the map header; files without
+    one are read as bare locations. Large files are split into byte ranges parsed by a process pool;
+    compressed files can't be split, and are decompressed as one stream.
+
+    Args:
+        file (str): The NDJSON file.
+        workers (int): Processes to parse with (0 for one per CPU).
+        parallel_min (int): Size in bytes below which the file is parsed in one process.
+
+    Returns:
+        tuple: The map data and its list of locations.
+    """
+    if codec_of(file):
+        with open_file(file) as f:
+            first = f.readline()
+            header = jsonio.loads(first) if first.strip() else {}
+            block = f.read()
+        if 'lat' in header and 'lng' in header:
+            header, block = {}, first + block
+        locs = jsonio.loads(b'[' + b','.join(line for line in block.splitlines() if line.strip()) + b']')
+        header['customCoordinates'] = locs
+        return header, locs
+
+    with open(file, 'rb') as f:
+        first = f.readline()
+        header = jsonio.loads(first) if first.strip() else {}
+        start = f.tell()
+
+    if 'lat' in header and 'lng' in header:
+        header, start = {}, 0
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and os.path.getsize(file) - start >= parallel_min:
+        ranges = ndjson_ranges(file, start, workers * 4)
+        with ProcessPoolExecutor(workers) as executor:
+            chunks = executor.map(read_ndjson_range, repeat(file), *zip(*ranges)) if ranges else []
+            locs = [loc for chunk in chunks for loc in chunk]
+    else:
+        locs = read_ndjson_range(file, start, os.path.getsize(file))
+
+    header['customCoordinates'] = locs
+    return header, locs
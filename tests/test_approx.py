@@ -0,0 +1,70 @@
+import pytest
+
+import approx
+
+
+def locs(count, key):
+    return [{'lat': i / 100, 'lng': i / 50, 'country': key} for i in range(count)]
+
+
+def test_parse_size():
+    assert approx.parse_size('0.05') == 0.05
+    assert approx.parse_size('1') == 1.0
+    assert approx.parse_size('200') == 200
+    for value in ('0', '-3', '2.5', 'many'):
+        with pytest.raises(ValueError):
+            approx.parse_size(value)
+
+
+def test_flags():
+    assert approx.flags(['imageDate']) == ['-m']
+    assert approx.flags(['timestamp']) == ['-t']
+    assert approx.flags(['altitude', 'sunEvent', 'country']) == ['-a', '-s']
+    assert approx.flags(['panoId']) == []
+
+
+def test_allocate_fraction():
+    assert approx.allocate({'a': 100, 'b': 10, 'c': 1}, 0.1) == {'a': 10, 'b': 2, 'c': 1}
+
+
+def test_allocate_count():
+    counts = approx.allocate({'a': 60, 'b': 30, 'c': 10}, 20)
+    assert counts == {'a': 12, 'b': 6, 'c': 2}
+    assert approx.allocate({'a': 5, 'b': 3}, 100) == {'a': 5, 'b': 3}
+
+
+def test_draw_nests_samples():
+    strata = approx.stratify(locs(50, 'FR') + locs(30, 'DE') + [{'lat': 0, 'lng': 0}], 'country')
+    assert set(strata) == {'FR', 'DE'}
+    small = approx.draw(strata, 0.1)
+    large = approx.draw(strata, 0.5)
+    for key in strata:
+        assert len(small[key]) < len(large[key])
+        assert all(loc in large[key] for loc in small[key])
+    assert approx.draw(strata, 0.1) == small
+
+
+def test_draw_takes_complete_strata_whole():
+    strata = {'FR': locs(50, 'FR'), 'DE': locs(30, 'DE')}
+    sample = approx.draw(strata, 0.1, lambda loc: loc['country'] == 'DE')
+    assert len(sample['DE']) == 30
+    assert len(sample['FR']) == 5
+
+
+def test_wilson():
+    assert approx.wilson(0, 0, 100) == (0.0, 1.0)
+    assert approx.wilson(30, 100, 100) == (0.3, 0.3)
+    low, high = approx.wilson(30, 100, 100000)
+    assert low < 0.3 < high
+    assert low == pytest.approx(0.219, abs=0.001)
+    assert high == pytest.approx(0.396, abs=0.001)
+
+
+def test_wilson_narrows_with_coverage():
+    wide = approx.wilson(10, 50, 100000)
+    narrow = approx.wilson(10, 50, 60)
+    assert narrow[0] > wide[0] and narrow[1] < wide[1]
+    low, high = approx.wilson(0, 50, 100000)
+    assert low == 0.0 and high > 0
+    low, high = approx.wilson(99, 99, 1000, 0.99)
+    assert low < 1.0 and high == pytest.approx(1.0)
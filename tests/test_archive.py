@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+import pytest
+
+from archive import HttpArchive
+from governor import RateGovernor
+
+
+def test_record_and_replay(tmp_path):
+    file = tmp_path / 'run.sqlite'
+    archive = HttpArchive(file, 'record', batch=2)
+    archive.put('singleImageSearch', 'post', 'https://example.com/a', '[1]', b'first')
+    assert archive.get('POST', 'https://example.com/a', b'[1]') == b'first'
+    assert archive.get('POST', 'https://example.com/a', '[2]') is None
+    archive.put('openMeteoArchive', 'GET', 'https://example.com/b', None, b'second')
+    assert not archive.pending
+    archive.close()
+
+    replay = HttpArchive(file, 'replay')
+    assert replay.replaying
+    assert replay.get('GET', 'https://example.com/b') == b'second'
+    replay.close()
+
+
+def test_missing_replay_file(tmp_path):
+    with pytest.raises(ValueError):
+        HttpArchive(tmp_path / 'missing.sqlite', 'replay')
+    with pytest.raises(ValueError):
+        HttpArchive(tmp_path / 'run.sqlite', 'rewind')
+
+
+def test_close_reopens_on_use(tmp_path):
+    file = tmp_path / 'run.sqlite'
+    archive = HttpArchive(file, 'record')
+    archive.put('singleImageSearch', 'GET', 'https://example.com/a', None, b'first')
+    archive.close()
+    assert archive.db is None
+    assert not os.path.exists(f"{file}-wal")
+    assert archive.get('GET', 'https://example.com/a') == b'first'
+    archive.put('singleImageSearch', 'GET', 'https://example.com/b', None, b'second')
+    archive.close()
+    assert HttpArchive(file, 'replay').get('GET', 'https://example.com/b') == b'second'
+
+
+def test_governor_close_closes_archive(tmp_path):
+    file = tmp_path / 'run.sqlite'
+    limiter = RateGovernor()
+    limiter.archive = HttpArchive(file, 'record')
+    limiter.archive.put('singleImageSearch', 'GET', 'https://example.com/a', None, b'first')
+
+    async def stage():
+        await limiter.close()
+    asyncio.run(stage())
+    assert limiter.archive.db is None
+    assert not os.path.exists(f"{file}-wal")
+    assert HttpArchive(file, 'replay').get('GET', 'https://example.com/a') == b'first'
@@ -0,0 +1,41 @@
+import gzip
+import os
+
+import pytest
+
+import compress
+
+
+@pytest.fixture(autouse=True)
+def configured():
+    yield
+    compress.configure(None, None)
+
+
+def write(file, level=None):
+    data = b'{"lat": 1.5, "lng": 2.5}' * 2000
+    with compress.open_file(file, 'wb', level) as f:
+        f.write(data)
+    return data
+
+
+def test_level_zero_is_not_the_default(tmp_path):
+    data = write(tmp_path / 'stored.json.gz', 0)
+    write(tmp_path / 'default.json.gz')
+    assert os.path.getsize(tmp_path / 'stored.json.gz') > len(data)
+    assert os.path.getsize(tmp_path / 'default.json.gz') < len(data) / 10
+    assert gzip.decompress((tmp_path / 'stored.json.gz').read_bytes()) == data
+
+
+def test_configured_level_zero(tmp_path):
+    compress.configure('gzip', 0)
+    data = write(tmp_path / 'map.json.gz')
+    assert os.path.getsize(tmp_path / 'map.json.gz') > len(data)
+
+
+def test_suffixes():
+    assert compress.codec_of('map.json.gz') == 'gzip'
+    assert compress.codec_of('map.ndjson.zst') == 'zstd'
+    assert compress.codec_of('map.json') is None
+    assert compress.map_suffix('map.ndjson.gz') == '.ndjson'
+    assert compress.map_stem('dir/map.json.zst') == 'map'
@@ -0,0 +1,63 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from geocode import Geocoder
+
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+FEATURES = [
+    # A country with a lake (hole) and an island
+    {'properties': {'iso_a2': 'AA', 'name': 'Alpha'},
+     'geometry': {'type': 'MultiPolygon', 'coordinates': [[square(0, 0, 10, 10), square(1, 1, 3, 3)], [square(20, 0, 22, 2)]]}},
+    # An enclave inside it
+    {'properties': {'iso_a2': 'BB', 'name': 'Beta'}, 'geometry': {'type': 'Polygon', 'coordinates': [square(4, 4, 6, 6)]}},
+    # A triangle without a code
+    {'properties': {'iso_a2': '-99', 'name': 'Gamma'}, 'geometry': {'type': 'Polygon', 'coordinates': [[[-10, 0], [-5, 10], [0, 0]]]}},
+    {'properties': {'iso_a2': 'XX'}, 'geometry': None},
+]
+
+
+@pytest.fixture
+def boundaries(tmp_path):
+    file = tmp_path / 'boundaries.geojson'
+    file.write_text(json.dumps({'type': 'FeatureCollection', 'features': FEATURES}))
+    return file
+
+
+def test_reverse(boundaries):
+    geocoder = Geocoder(boundaries)
+    points = [
+        (8, 8, ('AA', 'Alpha')),    # inside
+        (2, 2, (None, None)),       # in the lake
+        (5, 5, ('BB', 'Beta')),     # in the enclave
+        (1, 21, ('AA', 'Alpha')),   # on the island
+        (2, -5, (None, 'Gamma')),   # no code
+        (9, -9, (None, None)),      # outside the triangle but in its bounding box
+        (50, 50, (None, None)),     # nowhere
+    ]
+    lats, lngs, expected = zip(*points)
+    assert geocoder.reverse(lats, lngs) == list(expected)
+
+
+def test_many_points_match_single_queries(boundaries):
+    geocoder = Geocoder(boundaries)
+    rng = np.random.default_rng(1)
+    lats, lngs = rng.uniform(-2, 12, 2000), rng.uniform(-12, 24, 2000)
+    assert list(geocoder.locate(lats, lngs)) == [geocoder.locate([lat], [lng])[0] for lat, lng in zip(lats, lngs)]
+
+
+def test_packed_cache(boundaries):
+    Geocoder(boundaries)
+    cache = boundaries.with_suffix('.npz')
+    assert cache.exists()
+    assert Geocoder(boundaries).reverse([8], [8]) == [('AA', 'Alpha')]
+    # Another country field repacks instead of reusing the cached codes
+    assert Geocoder(boundaries, country_field='name', state_field=None).reverse([8], [8]) == [('Alpha', None)]
+    os.utime(boundaries, ns=(cache.stat().st_mtime_ns + 10**9,) * 2)
+    assert Geocoder(boundaries).reverse([5], [5]) == [('BB', 'Beta')]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from governor import RateGovernor, RequestError
+from metrics import Metrics, peak_rss
+import governor
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(governor, 'METRICS', metrics)
+    return metrics
+
+
+def test_stage_memory():
+    metrics = Metrics()
+    with metrics.stage('load'):
+        block = bytearray(64 << 20)
+        block[::4096] = b'x' * len(block[::4096])
+    with metrics.stage('tag'):
+        pass
+    del block
+    stages = metrics.report()['stages']
+    if peak_rss() is None:
+        pytest.skip("No peak memory on this platform")
+    assert stages['load']['peak_rss_growth_mb'] >= 32
+    assert stages['tag']['peak_rss_growth_mb'] < 32
+    assert stages['tag']['process_peak_rss_mb'] >= stages['load']['process_peak_rss_mb']
+
+
+def respond(status, body=b''):
+    async def handler(request):
+        return web.Response(status=status, body=body)
+    return handler
+
+
+def test_failures(metrics):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/missing', respond(404))
+        app.router.add_get('/busy', respond(503))
+        app.router.add_get('/ok', respond(200, b'ok'))
+        server = TestServer(app)
+        await server.start_server()
+        limiter = RateGovernor()
+        limiter.configure({'default': {'rate': 100, 'period': 1}}, {'attempts': 2, 'backoffBase': 0.01, 'backoffMax': 0.01})
+        try:
+            assert await limiter.request('GET', str(server.make_url('/ok')), 'test') == b'ok'
+            for path in ('/missing', '/busy'):
+                with pytest.raises(RequestError):
+                    await limiter.request('GET', str(server.make_url(path)), 'test')
+        finally:
+            await limiter.close()
+            await server.close()
+
+    with metrics.stage('fetch_meta'):
+        asyncio.run(main())
+    stats = metrics.report()['stages']['fetch_meta']['requests']['test']
+    assert stats['requests'] == 4
+    assert stats['errors'] == 3
+    assert stats['retries'] == 1
+    assert stats['failures'] == 2
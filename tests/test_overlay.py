@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from overlay import OVERLAY_VERSION, materialize, save_overlay
+from sv_map import SVMap
+
+LOCS = [
+    {'lat': 36.8, 'lng': 10.18, 'heading': 0, 'panoId': 'a', 'country': 'TN'},
+    {'lat': 35.8, 'lng': 10.6, 'heading': 90, 'panoId': 'b', 'country': 'TN'},
+    {'lat': 48.85, 'lng': 2.35, 'heading': 180, 'country': 'FR'},
+]
+
+
+def tagged(locs):
+    locs = json.loads(json.dumps(locs))
+    for loc in locs:
+        loc['extra'] = {'tags': [loc['country']]}
+    return SVMap.from_data({'name': 'map', 'customCoordinates': locs, 'extra': {'tags': {'TN': {}, 'FR': {}}}})
+
+
+@pytest.fixture
+def meta(tmp_path):
+    (tmp_path / 'meta').mkdir()
+    file = tmp_path / 'meta' / 'map.json'
+    file.write_text(json.dumps({'name': 'map', 'customCoordinates': LOCS}))
+    return file
+
+
+def test_materialize_matches_full_output(meta, tmp_path, capsys):
+    full = tagged(LOCS)
+    save_overlay(full, tmp_path / 'map-a.overlay.json', meta)
+    assert capsys.readouterr().out.startswith("Saved to ")
+    overlay = json.loads((tmp_path / 'map-a.overlay.json').read_text())
+    assert overlay['version'] == OVERLAY_VERSION
+    assert set(overlay['tags']) == {'a', 'b', '48.85,2.35'}
+
+    materialize(tmp_path / 'map-a.overlay.json', meta.parent, tmp_path / 'materialized.json')
+    full.purge()
+    full.save_stream(tmp_path / 'full.json')
+    assert (tmp_path / 'materialized.json').read_bytes() == (tmp_path / 'full.json').read_bytes()
+
+
+def test_materialize_survives_later_runs(meta, tmp_path):
+    save_overlay(tagged(LOCS), tmp_path / 'map-a.overlay.json', meta)
+    # Another run adds fields and rewrites the meta file
+    meta.write_text(json.dumps({'name': 'map', 'customCoordinates': [{**loc, 'timestamp': 1600000000} for loc in LOCS]}))
+    map_obj = materialize(tmp_path / 'map-a.overlay.json', meta.parent, tmp_path / 'out.json')
+    assert [loc['extra']['tags'] for loc in map_obj.locs] == [['TN'], ['TN'], ['FR']]
+    assert 'timestamp' not in map_obj.locs[0]
+
+
+def test_materialize_refuses_untagged_locations(meta, tmp_path):
+    save_overlay(tagged(LOCS), tmp_path / 'map-a.overlay.json', meta)
+    meta.write_text(json.dumps({'name': 'map', 'customCoordinates': [*LOCS, {'lat': 1, 'lng': 2, 'heading': 0}]}))
+    with pytest.raises(ValueError):
+        materialize(tmp_path / 'map-a.overlay.json', meta.parent, tmp_path / 'out.json')
+
+
+def test_materialize_refuses_other_versions(meta, tmp_path):
+    (tmp_path / 'old.overlay.json').write_text(json.dumps({'meta': 'map.json', 'metaVersion': 'abc', 'tags': [['TN'], ['TN'], ['FR']]}))
+    with pytest.raises(ValueError):
+        materialize(tmp_path / 'old.overlay.json', meta.parent, tmp_path / 'out.json')
@@ -0,0 +1,114 @@
+import pytest
+
+import metatag
+from metatag import ArgParser, SVMap, tag
+from planner import Planner, timestamp_interval, timestamp_probes, TIMESTAMP_WINDOW
+
+SETTLED = 1600000000  # 2020-09-13 14:26:40 in Paris
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    for name in metatag.FOLDERS:
+        (tmp_path / name).mkdir()
+        monkeypatch.setitem(metatag.FOLDERS[name], 'path', tmp_path / name)
+    monkeypatch.setitem(metatag.CONFIG['panoStore'], 'path', None)
+    return tmp_path
+
+
+def planner(argv, outputs=None):
+    return Planner(ArgParser(['tag', 'map.json', *argv]), outputs=outputs)
+
+
+def hours(loc, unix_time):
+    return (round(unix_time / 3600),)
+
+
+def test_timestamp_interval():
+    assert timestamp_interval({'timestamp': 1000, 'timestampAccuracy': 20}) == (990, 1010)
+    assert timestamp_interval({'timestamp': '1000', 'timestampAccuracy': '20'}) == (990, 1010)
+    assert timestamp_interval({'timestamp': 1000}) == (1000, 1000)
+    assert timestamp_interval({'timestamp': 'soon'}) is None
+    assert timestamp_interval({'timestamp': ''}) is None
+    assert timestamp_interval({}) is None
+
+
+def test_interval_settled_by_outputs():
+    run = planner(['-u'], hours)
+    loc = {'lat': 0, 'lng': 0}
+    assert run.interval_settled(loc, 3600 * 10, 3600 * 10 + 600)
+    assert not run.interval_settled(loc, 3600 * 10 + 1700, 3600 * 10 + 1900)
+
+
+def test_interval_settled_to_accuracy_when_precise():
+    run = planner(['-s', '--accuracy', '60'], hours)
+    loc = {'lat': 0, 'lng': 0}
+    assert run.precise()
+    assert run.interval_settled(loc, 0, 60)
+    assert not run.interval_settled(loc, 0, 61)
+
+
+def test_time_never_settles_on_a_day():
+    run = planner(['-t'], lambda loc, unix_time: ())
+    assert not run.interval_settled({'lat': 0, 'lng': 0}, 0, 86400)
+    assert run.interval_settled({'lat': 0, 'lng': 0}, 0, 3600)
+
+
+def test_timestamp_settled_parses_strings():
+    run = planner(['-u'], hours)
+    assert run.timestamp_settled({'lat': 0, 'lng': 0, 'timestamp': '36000', 'timestampAccuracy': '600'})
+    assert not run.timestamp_settled({'lat': 0, 'lng': 0, 'timestamp': 'n/a'})
+    assert not run.needs('timestamp', {'lat': 0, 'lng': 0, 'timestamp': '36000', 'timestampAccuracy': '600'})
+    assert run.needs('timestamp', {'lat': 0, 'lng': 0, 'timestamp': 'n/a'})
+
+
+def test_timestamp_probes():
+    assert timestamp_probes(TIMESTAMP_WINDOW) == 0
+    assert timestamp_probes(1) > timestamp_probes(3600) > timestamp_probes(86400) > 0
+    assert timestamp_probes(3600, 3600) == 0
+    assert timestamp_probes(3600, 3600, True) == 2
+
+
+def test_tag_csv_with_string_timestamp(folders, monkeypatch):
+    file = folders / 'base' / 'paris.csv'
+    file.write_text(
+        'lat,lng,panoId,imageDate,timestamp,timestampAccuracy\n'
+        f'48.8566,2.3522,abc,2020-09,{SETTLED},60\n'
+    )
+
+    async def offline(*args, **kwargs):
+        raise AssertionError("Settled timestamps need no requests")
+    monkeypatch.setattr(metatag, 'find_accurate_timestamp', offline)
+
+    map_obj = tag(ArgParser(['tag', str(file), '-d']))
+    assert len(map_obj.locs) == 1
+    assert '2020-09-13' in map_obj.locs[0]['extra']['tags']
+
+
+def test_needs_solar_by_presence():
+    run = planner(['-s'], hours)
+    solar = {'altitude': 0.0, 'azimuth': 90.0, 'altitudeClass': 'Very Low', 'azimuthClass': 'East', 'sunEvent': None}
+    assert not run.needs('solar', {'lat': 0, 'lng': 0, **solar})
+    assert run.needs('solar', {'lat': 0, 'lng': 0, 'altitude': 1.0, 'azimuth': 90.0})
+
+
+def test_estimate_refines_stored_intervals():
+    run = planner(['-u'], hours)
+    month = {'lat': 0, 'lng': 0, 'imageDate': '2020-09'}
+    dated = {**month, 'timestamp': SETTLED, 'timestampAccuracy': 44550}
+    rows = {row['stage']: row for row in run.estimate(SVMap.from_data({'customCoordinates': [month, dated]}), metatag.CONFIG)}
+    searched = timestamp_probes(3600, TIMESTAMP_WINDOW, True) + timestamp_probes(3600, 44550, True)
+    assert rows['timestamp']['locations'] == 2
+    assert rows['timestamp']['requests'] == pytest.approx(searched, abs=1)
+    assert timestamp_probes(3600, 44550) < timestamp_probes(3600)
+
+
+def test_time_outputs_leave_tag_format_alone():
+    parser = metatag.MetaFetchParser(SVMap.from_data({'customCoordinates': []}), ArgParser(['tag', 'map.json', '-t', '--round', '30']))
+    assert parser.tagger.datestring == '%H:%M'
+    paris = {'lat': 48.8566, 'lng': 2.3522}
+    # DST ended in Paris at 2020-10-25 01:00 UTC: 02:50 local comes twice
+    before, after = parser.timestamp_outputs(paris, 1603587000), parser.timestamp_outputs(paris, 1603590600)
+    assert before == ('2020-10-25 03:00 +0200',) and after == ('2020-10-25 03:00 +0100',)
+    assert before != after
+    assert not parser.planner.interval_settled(paris, 1603587000, 1603590600)
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+from query import MapIndex, Predicate
+
+LOCS = [
+    {'lat': 36.8, 'lng': 10.18, 'state': 'Tunis', 'altitude': 3.5, 'extra': {'tags': ['Overcast', 'Sunset']}},
+    {'lat': 36.81, 'lng': 10.2, 'state': 'Tunis', 'altitude': 20, 'extra': {'tags': ['Clear']}},
+    {'lat': 35.8, 'lng': 10.6, 'state': 'Sousse', 'altitude': 8, 'extra': {'tags': ['Overcast']}},
+    {'lat': -33.9, 'lng': 151.2, 'altitude': 40, 'a.b': 'dot', 'a_b': 'underscore'},
+    {'lat': 64.1, 'lng': -179.9, 'state': 'Chukotka', 'extra': {'tags': []}},
+]
+
+
+@pytest.fixture(params=['.json', '.ndjson'])
+def index(tmp_path, request):
+    file = tmp_path / f"map{request.param}"
+    if request.param == '.json':
+        file.write_text(json.dumps({'name': 'map', 'customCoordinates': LOCS}))
+    else:
+        file.write_text('\n'.join(json.dumps(line) for line in [{'name': 'map', 'customCoordinates': None}, *LOCS]) + '\n')
+    return MapIndex(file, tmp_path)
+
+
+def where(index, predicate):
+    return index.where(predicate).tolist()
+
+
+def test_parse_precedence():
+    tree = Predicate("a == 1 or b == 'x' and not c != null").tree
+    assert tree == ('or', ('compare', 'a', '==', 1.0), ('and', ('compare', 'b', '==', 'x'), ('not', ('compare', 'c', '!=', None))))
+    assert Predicate("(a = x)").tree == ('compare', 'a', '==', 'x')
+
+
+@pytest.mark.parametrize('text', ["state ==", "== 3", "(a == 1", "a == 1 b", "a ~ 1"])
+def test_parse_errors(text):
+    with pytest.raises(ValueError):
+        Predicate(text)
+
+
+def test_compare_numbers(index):
+    assert where(index, "altitude < 8") == [0]
+    assert where(index, "altitude <= 8") == [0, 2]
+    assert where(index, "altitude > 8") == [1, 3]
+    assert where(index, "altitude >= 20 and altitude < 40") == [1]
+    with pytest.raises(ValueError):
+        index.where("altitude == high")
+
+
+def test_compare_strings_and_null(index):
+    assert where(index, "state == Tunis") == [0, 1]
+    assert where(index, "state == 'Sousse' or state == Chukotka") == [2, 4]
+    assert where(index, "state == null") == [3]
+    assert where(index, "state != null") == [0, 1, 2, 4]
+
+
+def test_not_equal_is_complement(index):
+    for predicate in ("state == Tunis", "altitude == 8", "tag == Overcast", "tag == Missing"):
+        matched = set(where(index, predicate))
+        assert set(where(index, predicate.replace('==', '!='))) == set(range(len(LOCS))) - matched
+        assert where(index, predicate.replace('==', '!=')) == where(index, f"not {predicate}")
+
+
+def test_tags(index):
+    assert where(index, "tag == Overcast") == [0, 2]
+    assert where(index, "tag != Overcast") == [1, 3, 4]
+    assert where(index, "tag == Overcast and tag == Sunset") == [0]
+
+
+def test_sanitized_names_do_not_collide(index, tmp_path):
+    assert where(index, "a.b == dot") == [3]
+    assert where(index, "a_b == underscore") == [3]
+    reloaded = MapIndex(index.file, tmp_path)
+    assert where(reloaded, "a.b == dot") == [3]
+    assert where(reloaded, "a_b == dot") == []
+
+
+def test_spatial(index):
+    assert index.bbox(35, 10, 37, 11).tolist() == [0, 1, 2]
+    assert index.bbox(60, 170, 70, -170).tolist() == [4]
+    positions, distances = index.radius(36.8, 10.18, 5)
+    assert positions.tolist() == [0, 1] and distances[positions.tolist().index(0)] == pytest.approx(0)
+    assert index.nearest(36.0, 10.5, 2).tolist() == [2, 0]
+
+
+def test_query_and_subset(index):
+    positions = index.query(bbox=[30, 0, 40, 20], where="tag != Clear", near=[36.8, 10.18], nearest=5)
+    assert positions.tolist() == [0, 2]
+    subset = index.subset(positions)
+    assert subset.data['name'] == 'map'
+    assert [loc['state'] for loc in subset.locs] == ['Tunis', 'Sousse']
+    assert np.array_equal(index.query(), np.arange(len(LOCS)))
@@ -0,0 +1,60 @@
+import pytest
+
+import shards
+from sv_map import SVMap
+
+BASE = [{'lat': i / 10, 'lng': i / 20, 'heading': 0} for i in range(40)] + [{'lat': 0.5, 'lng': 0.25, 'heading': 90}]
+
+
+def base_map():
+    return SVMap.from_data({'name': 'map', 'extra': {'tags': {}}, 'customCoordinates': [dict(loc) for loc in BASE]})
+
+
+def test_split_partitions_by_coordinates():
+    parts = shards.split(base_map(), 3)
+    assert len(parts) == 3
+    assert sorted(len(part.locs) for part in parts) != [0, 0, 41]
+    assert sum(len(part.locs) for part in parts) == len(BASE)
+    assert all(part.data['name'] == 'map' for part in parts)
+    for i, part in enumerate(parts):
+        assert all(shards.shard_of(loc, 3) == i for loc in part.locs)
+    with pytest.raises(ValueError):
+        shards.split(base_map(), 0)
+
+
+def test_find_shards(tmp_path):
+    for i in (1, 2, 3):
+        (tmp_path / f"{shards.shard_name('map', i, 3)}.json").write_text('[]')
+    (tmp_path / 'other.shard-1-of-1.json').write_text('[]')
+    (tmp_path / 'map.shard-1-of-3.report.json').write_text('{}')
+    assert [file.name for file in shards.find_shards(tmp_path, 'map')] == [f"map.shard-{i}-of-3.json" for i in (1, 2, 3)]
+
+    (tmp_path / 'map.shard-2-of-3.json').unlink()
+    with pytest.raises(ValueError, match='Missing shards 2'):
+        shards.find_shards(tmp_path, 'map')
+    (tmp_path / 'map.shard-2-of-4.json').write_text('[]')
+    with pytest.raises(ValueError):
+        shards.find_shards(tmp_path, 'map')
+    with pytest.raises(ValueError):
+        shards.find_shards(tmp_path, 'missing')
+
+
+def test_merge_restores_the_base_map():
+    parts = shards.split(base_map(), 3)
+    for part in parts:
+        for loc in part.locs:
+            loc['country'] = 'TN'
+    # A failed fetch dropped one location
+    dropped = parts[0].locs.pop(0)
+    # A copy of another location was tagged twice, with different fields
+    extra = dict(parts[1].locs[0], imageDate='2020-09')
+    del extra['country']
+    parts[2].locs.append(extra)
+
+    merged = shards.merge(base_map(), parts)
+    expected = [loc for loc in BASE if (loc['lat'], loc['lng']) != (dropped['lat'], dropped['lng'])]
+    assert [(loc['lat'], loc['lng'], loc['heading']) for loc in merged.locs] == [(loc['lat'], loc['lng'], loc['heading']) for loc in expected]
+    assert all(loc['country'] == 'TN' for loc in merged.locs)
+    twice = next(loc for loc in merged.locs if (loc['lat'], loc['lng']) == (extra['lat'], extra['lng']))
+    assert twice['imageDate'] == '2020-09'
+    assert merged.data['extra'] == {'tags': {}}
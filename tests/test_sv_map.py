@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+import compress
+from sv_map import SVMap, csv_value, read_json_stream
+
+LOCS = [
+    {'lat': 36.8, 'lng': 10, 'heading': 0, 'pitch': 1.5, 'panoId': '0123', 'extra': {'tags': ['TN', '2020-09'], 'panoDate': '2020-09'},
+     'timestamp': 1600000000, 'timestampAccuracy': 3600, 'altitude': -2.25, 'sunEvent': None, 'country': 'TN', 'elevation': 1e-05},
+    {'lat': -33.9, 'lng': 151.2, 'heading': 270.5, 'extra': {'tags': []}, 'state': 'New South Wales, "NSW"'},
+]
+
+
+def test_csv_round_trip(tmp_path):
+    source = SVMap.from_data({'name': 'map', 'customCoordinates': json.loads(json.dumps(LOCS))})
+    source.save(tmp_path / 'map.csv', quiet=True)
+    loaded = SVMap(tmp_path / 'map.csv')
+    assert json.dumps(loaded.locs, sort_keys=True) == json.dumps(LOCS, sort_keys=True)
+    assert loaded.data['name'] == 'map'
+
+
+def test_csv_base_map(tmp_path):
+    (tmp_path / 'base.csv').write_text('lat,lng,panoId,heading,country\n36.8,10.18,,,TN\n,1,x,0,FR\n1.5,2.5,abc,90,null\nnorth,2,y,0,FR\n')
+    locs = SVMap(tmp_path / 'base.csv').locs
+    assert locs == [
+        {'lat': 36.8, 'lng': 10.18, 'extra': {'tags': []}, 'country': 'TN', 'heading': 0},
+        {'lat': 1.5, 'lng': 2.5, 'extra': {'tags': []}, 'panoId': 'abc', 'heading': 90, 'country': None},
+    ]
+
+
+def test_csv_value():
+    assert csv_value('timestamp', '1600000000') == 1600000000
+    assert csv_value('altitude', '-1.5e-3') == -0.0015
+    assert csv_value('altitude', 'high') == 'high'
+    assert csv_value('altitude', '[1]') == '[1]'
+    assert csv_value('panoId', '0123') == '0123'
+    assert csv_value('extra', '{"tags": ["a"]}') == {'tags': ['a']}
+    assert csv_value('state', '[unclosed') == '[unclosed'
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096])
+@pytest.mark.parametrize('indent', [None, 4])
+def test_json_stream(chunk, indent):
+    data = {'name': 'map', 'version': 1.5e3, 'customCoordinates': [
+        {'lat': i / 7, 'lng': -1.25e-7, 'panoId': '},{' if i % 5 == 0 else 'é"\\', 'extra': {'tags': ['a'], 'links': [{'x': 1}]}}
+        for i in range(300)
+    ], 'extra': {'tags': {}}}
+    text = json.dumps(data, indent=indent).encode()
+    assert read_json_stream(io.BytesIO(text), chunk=chunk) == data
+    assert read_json_stream(io.BytesIO(json.dumps(data['customCoordinates']).encode()), chunk=chunk) == data['customCoordinates']
+
+
+@pytest.mark.parametrize('text', [b'', b'{"a": 1', b'{"a": 1}x', b'[1, 2', b'{"a" 1}', b'{"customCoordinates": [{"lat": 1}'])
+def test_json_stream_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        read_json_stream(io.BytesIO(text), chunk=3)
+
+
+@pytest.mark.parametrize('suffix', ['.json.gz', '.json.zst'])
+def test_compressed_json(tmp_path, suffix):
+    if suffix.endswith('.zst') and compress.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    data = {'name': 'map', 'customCoordinates': json.loads(json.dumps(LOCS))}
+    with compress.open_file(tmp_path / f"map{suffix}", 'wb') as f:
+        f.write(json.dumps(data).encode())
+    assert SVMap(tmp_path / f"map{suffix}").data == data
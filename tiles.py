@@ -0,0 +1,155 @@
+import base64
+import math
+
+import numpy as np
+
+import jsonio
+
+MAX_LAT = 85.05112878  # Web Mercator latitude limit
+
+
+def tile_coords(lats, lngs, zoom):
+    """
+    Web Mercator tile coordinates of each point.
+
+    Args:
+        lats (array): Latitudes.
+        lngs (array): Longitudes.
+        zoom (int): The zoom level.
+
+    Returns:
+        tuple: Tile x and y arrays.
+    """
+    n = 1 << zoom
+    lats = np.radians(np.clip(lats, -MAX_LAT, MAX_LAT))
+    lngs = (np.asarray(lngs) + 180) % 360 - 180
+
+    x = np.floor((lngs + 180) / 360 * n)
+    y = np.floor((1 - np.log(np.tan(lats) + 1 / np.cos(lats)) / math.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.uint64), np.clip(y, 0, n - 1).astype(np.uint64)
+
+
+def interleave(x, y):
+    """
+    Morton (quadkey) code of 16-bit tile coordinates, so every tile at every coarser zoom is a
+    contiguous run of codes.
+    """
+    def spread(v):
+        v = v & np.uint64(0xFFFF)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x33333333)
+        v = (v | (v << np.uint64(1))) & np.uint64(0x55555555)
+        return v
+    return spread(x) | (spread(y) << np.uint64(1))
+
+
+def deinterleave(codes):
+    """
+    Tile coordinates of Morton codes (inverse of interleave).
+    """
+    def compact(v):
+        v = v & np.uint64(0x55555555)
+        v = (v | (v >> np.uint64(1))) & np.uint64(0x33333333)
+        v = (v | (v >> np.uint64(2))) & np.uint64(0x0F0F0F0F)
+        v = (v | (v >> np.uint64(4))) & np.uint64(0x00FF00FF)
+        v = (v | (v >> np.uint64(8))) & np.uint64(0x0000FFFF)
+        return v
+    return compact(codes), compact(codes >> np.uint64(1))
+
+
+def encode_bitmap(positions, size):
+    """
+    Encodes a sorted set of positions as runs ([start, length, ...]) or, when smaller, as a
+    base64 bitset (least significant bit first).
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = positions[np.concatenate([[0], breaks])] if len(positions) else positions
+    lengths = np.diff(np.concatenate([[0], breaks, [len(positions)]])) if len(positions) else positions
+
+    if len(starts) * 2 * 8 < size / 8 * 4 / 3:
+        return {'runs': np.column_stack([starts, lengths]).ravel().tolist()}
+
+    bits = np.zeros(size, dtype=bool)
+    bits[positions] = True
+    return {'bits': base64.b64encode(np.packbits(bits, bitorder='little').tobytes()).decode('ascii')}
+
+
+def build_tiles(map_obj, max_zoom=14):
+    """
+    Builds a multi-resolution tile index of a map.
+
+    Locations are sorted by their quadkey at max_zoom, so each tile at any zoom covers one
+    contiguous range of the sorted order. For every zoom, the index lists the non-empty tiles
+    with their location count and centroid; ranges follow from the running sum of counts. Tag
+    membership is stored as one bitmap per tag over the sorted order.
+
+    Args:
+        map_obj (SVMap): The tagged map.
+        max_zoom (int): The finest zoom level (at most 16).
+
+    Returns:
+        dict: The tile index.
+    """
+    max_zoom = min(max_zoom, 16)
+    locs = map_obj.locs
+    lats = np.fromiter((float(loc['lat']) for loc in locs), dtype=np.float64, count=len(locs))
+    lngs = np.fromiter((float(loc['lng']) for loc in locs), dtype=np.float64, count=len(locs))
+
+    codes = interleave(*tile_coords(lats, lngs, max_zoom))
+    order = np.argsort(codes, kind='stable')
+    codes, lats, lngs = codes[order], lats[order], lngs[order]
+
+    zooms = []
+    for zoom in range(max_zoom + 1):
+        prefix = codes >> np.uint64(2 * (max_zoom - zoom))
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(prefix)) + 1]).astype(np.int64) if len(codes) else np.empty(0, dtype=np.int64)
+        counts = np.diff(np.concatenate([starts, [len(codes)]]))
+        x, y = deinterleave(prefix[starts])
+
+        zooms.append({
+            'x': x.tolist(),
+            'y': y.tolist(),
+            'counts': counts.tolist(),
+            'lat': np.round(np.add.reduceat(lats, starts) / counts, 6).tolist() if len(codes) else [],
+            'lng': np.round(np.add.reduceat(lngs, starts) / counts, 6).tolist() if len(codes) else []
+        })
+
+    # Tag membership by position in the sorted order
+    positions = {}
+    for position, i in enumerate(order.tolist()):
+        extra = locs[i].get('extra')
+        tags = extra.get('tags') if isinstance(extra, dict) else None
+        for tag in dict.fromkeys(tags or []):
+            positions.setdefault(tag, []).append(position)
+
+    legend = map_obj.data.get('extra', {}).get('tags', {}) if isinstance(map_obj.data.get('extra'), dict) else {}
+    names = [tag for tag in legend if tag in positions] + sorted(tag for tag in positions if tag not in legend)
+
+    return {
+        'version': 1,
+        'locations': len(locs),
+        'maxZoom': max_zoom,
+        'order': order.tolist(),
+        'zooms': zooms,
+        'tags': {tag: encode_bitmap(positions[tag], len(locs)) for tag in names}
+    }
+
+
+def save_tiles(map_obj, file, max_zoom=14):
+    """
+    Builds the tile index of a map and saves it.
+
+    Args:
+        map_obj (SVMap): The tagged map.
+        file (str): The path to save the index to.
+        max_zoom (int): The finest zoom level.
+    """
+    index = build_tiles(map_obj, max_zoom)
+    try:
+        with open(file, 'wb') as f:
+            f.write(jsonio.dumps(index))
+        print("Saved tiles to " + str(file))
+    except OSError:
+        print("Failed to save tiles to " + str(file))